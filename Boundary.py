@@ -0,0 +1,339 @@
+"""
+    boundary conditions for the two ghost layers Grid.grid reserves around
+    every field
+
+    each condition is declared per side (TBLR) and per field of the
+    solution array, and fills both ghost layers of that side in one
+    vectorized assignment. Conditions can also describe every ghost cell as
+        phi_ghost = phi_source + constant
+    so that linearSolver can fold them into the matrix instead of lagging
+    them on the right hand side.
+
+    fields may carry leading batch axes, as in ensemble.py, in which case
+    dirichlet values and neumann gradients can be arrays holding one value
+    per member.
+"""
+
+import copy
+import numpy as np
+
+sides = ("T", "B", "L", "R")
+
+def ghostLayers(grid,side):
+
+    """
+        returns the padded index along the side's normal of its two ghost
+        layers, nearest first, and of the nearest non-BC layer
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            side      (string)    -side of the domain (TBLR)
+        returns:
+            axis      (int)       -0 for x, 1 for y
+            layers    (tuple)     -(first ghost, second ghost) indices
+            inner     (int)       -index of the nearest non-BC layer
+    """
+
+    if side == "B":
+        return 1, (1,0), 2
+    elif side == "T":
+        return 1, (grid.ny+2,grid.ny+3), grid.ny+1
+    elif side == "L":
+        return 0, (1,0), 2
+    elif side == "R":
+        return 0, (grid.nx+2,grid.nx+3), grid.nx+1
+    print("ERROR: Not a side name: {}".format(side))
+
+def layer(array,axis,index):
+    # the cells of one layer along a side, without the corners, after any
+    # leading batch axes
+    if axis == 0:
+        return array[...,index,2:-2]
+    return array[...,2:-2,index]
+
+def perMember(value):
+    # a scalar, or an array of one value per batch member shaped to
+    # broadcast against a layer
+    if np.ndim(value) == 0:
+        return value
+    return np.asarray(value)[...,np.newaxis]
+
+def selectMembers(value,members):
+    # the values of some batch members, scalars are shared by all
+    if np.ndim(value) == 0:
+        return value
+    return np.asarray(value)[members]
+
+class dirichlet:
+
+    """
+        fixed value on both ghost layers
+    """
+
+    def __init__(self,value=0.0):
+        self.value = value
+
+    def apply(self,grid,phi,side):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost in layers:
+            layer(phi,axis,ghost)[:] = perMember(self.value)
+
+    def select(self,members):
+        chosen = copy.copy(self)
+        chosen.value = selectMembers(self.value,members)
+        return chosen
+
+    def ghostMap(self,grid,side,source,constant):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost in layers:
+            layer(source,axis,ghost)[:] = -1
+            layer(constant,axis,ghost)[:] = self.value
+
+class neumann:
+
+    """
+        fixed outward normal gradient, zero by default. The ghost values are
+        extrapolated from the nearest non-BC cell over the same center to
+        center distances the schemes use, (width + neighbor width) / 2
+    """
+
+    def __init__(self,gradient=0.0):
+        self.gradient = gradient
+
+    def distances(self,grid,side):
+        axis, layers, inner = ghostLayers(grid,side)
+        if grid.uniform:
+            size = (grid.dx,grid.dy)[axis]
+            return (size,2*size)
+        widths = grid.val[:,:,2+axis]
+        first = (layer(widths,axis,inner) + layer(widths,axis,layers[0])) / 2
+        second = first + (layer(widths,axis,layers[0]) + layer(widths,axis,layers[1])) / 2
+        return (first,second)
+
+    def apply(self,grid,phi,side):
+        axis, layers, inner = ghostLayers(grid,side)
+        if np.all(np.asarray(self.gradient) == 0.0):
+            for ghost in layers:
+                layer(phi,axis,ghost)[:] = layer(phi,axis,inner)
+            return
+        gradient = perMember(self.gradient)
+        for ghost, distance in zip(layers,self.distances(grid,side)):
+            layer(phi,axis,ghost)[:] = layer(phi,axis,inner) + gradient * distance
+
+    def select(self,members):
+        chosen = copy.copy(self)
+        chosen.gradient = selectMembers(self.gradient,members)
+        return chosen
+
+    def ghostMap(self,grid,side,source,constant):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost, distance in zip(layers,self.distances(grid,side)):
+            layer(source,axis,ghost)[:] = layer(grid.index,axis,inner)
+            layer(constant,axis,ghost)[:] = self.gradient * distance
+
+class inflow(dirichlet):
+
+    """
+        inflow boundary, the incoming value is fixed on the ghost layers
+    """
+
+class outflow(neumann):
+
+    """
+        outflow boundary, values are carried out with zero gradient
+    """
+
+    def __init__(self):
+        neumann.__init__(self,0.0)
+
+class periodic:
+
+    """
+        ghost layers copy the non-BC cells at the opposite side of the
+        domain. Declare it on both of a pair of opposite sides.
+    """
+
+    def apply(self,grid,phi,side):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost, partner in zip(layers,self.partners(grid,side)):
+            layer(phi,axis,ghost)[:] = layer(phi,axis,partner)
+
+    def select(self,members):
+        return self
+
+    def partners(self,grid,side):
+        # the non-BC layers copied into the first and second ghost layers
+        n = grid.nx if side in ("L","R") else grid.ny
+        if side in ("B","L"):
+            return (n+1,n)
+        return (2,3)
+
+    def ghostMap(self,grid,side,source,constant):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost, partner in zip(layers,self.partners(grid,side)):
+            layer(source,axis,ghost)[:] = layer(grid.index,axis,partner)
+            layer(constant,axis,ghost)[:] = 0.0
+
+class prescribed:
+
+    """
+        ghost layers copied from a padded (nx+4,ny+4) array of known values,
+        such as an exact solution evaluated at the ghost cell centers
+    """
+
+    def __init__(self,values):
+        self.values = values
+
+    def apply(self,grid,phi,side):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost in layers:
+            layer(phi,axis,ghost)[:] = layer(self.values,axis,ghost)
+
+    def select(self,members):
+        return self
+
+    def ghostMap(self,grid,side,source,constant):
+        axis, layers, inner = ghostLayers(grid,side)
+        for ghost in layers:
+            layer(source,axis,ghost)[:] = -1
+            layer(constant,axis,ghost)[:] = layer(self.values,axis,ghost)
+
+# condition classes by the names used in case files
+kinds = {
+    "dirichlet": dirichlet,
+    "neumann": neumann,
+    "inflow": inflow,
+    "outflow": outflow,
+    "periodic": periodic,
+}
+
+class boundaries:
+
+    def __init__(self,grid):
+
+        """
+        the set of boundary conditions of a case, keyed by field and side
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+        """
+
+        self.grid = grid
+        self.conditions = {}
+
+    def set(self,side,condition,field=2):
+
+        """
+        declares the condition of one side of one field
+
+        inputs:
+            side      (string)    -side of the domain (TBLR)
+            condition             -dirichlet, neumann, inflow, outflow, periodic
+                                   or prescribed
+            field     (int)       -field of the solution array
+        """
+
+        if side not in sides:
+            print("ERROR: Not a side name: {}".format(side))
+            return
+        self.conditions[(field,side)] = condition
+
+    def configure(self,sides,field=2):
+
+        """
+        declares the conditions of one field from their names, as read from
+        a case file
+
+            bcs.configure({"T": ["inflow",1.0], "B": ["outflow"]})
+
+        inputs:
+            sides     (dict)      -per side a list of the name in kinds and
+                                   the arguments of its condition
+            field     (int)       -field of the solution array
+        returns:
+            bcs       (boundaries)-self, None if a condition is not known
+        """
+
+        for side, declaration in sides.items():
+            kind, arguments = declaration[0], declaration[1:]
+            if kind not in kinds:
+                print("ERROR: Not a boundary condition: {}".format(kind))
+                return
+            self.set(side,kinds[kind](*arguments),field=field)
+        return self
+
+    def fields(self):
+        return sorted(set(field for field, side in self.conditions))
+
+    def applyField(self,phi,field):
+
+        """
+        fills the ghost layers of one padded (nx+4,ny+4) field array, such
+        as solution[:,:,2], in place
+        """
+
+        for side in sides:
+            condition = self.conditions.get((field,side))
+            if condition is not None:
+                condition.apply(self.grid,phi,side)
+
+    def apply(self,solution,fields=None):
+
+        """
+        fills the ghost layers of every declared field of a solution array
+
+        inputs:
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            fields    (list)      -optional subset of fields to update
+        """
+
+        for field in (self.fields() if fields is None else fields):
+            self.applyField(solution[...,field],field)
+
+    def select(self,members):
+
+        """
+        returns the conditions of some members of a batch, with per-member
+        values and gradients indexed by members
+
+        inputs:
+            members               -index or mask of the batch members
+        """
+
+        chosen = boundaries(self.grid)
+        for key, condition in self.conditions.items():
+            chosen.conditions[key] = condition.select(members)
+        return chosen
+
+    def updater(self,solution,field=2):
+
+        """
+        returns a no-argument callable applying one field's conditions,
+        for the boundary argument of the smoothers and multigrid
+        """
+
+        phi = solution[...,field]
+        return lambda: self.applyField(phi,field)
+
+    def ghostMap(self,field=2):
+
+        """
+        describes every ghost cell of one field as
+            phi_ghost = phi[source] + constant
+        with source -1 for cells whose value is fixed. Cells without a
+        declared condition are -1 and NaN, so the caller keeps their
+        current value.
+
+        returns:
+            source    (ndarray)   -(nx+4,ny+4) flat padded source index
+            constant  (ndarray)   -(nx+4,ny+4) constant part
+        """
+
+        shape = (self.grid.nx+4,self.grid.ny+4)
+        source = np.full(shape,-1,dtype=int)
+        constant = np.full(shape,np.nan)
+        for side in sides:
+            condition = self.conditions.get((field,side))
+            if condition is not None:
+                condition.ghostMap(self.grid,side,source,constant)
+        return source, constant
@@ -123,13 +123,66 @@ class face:
             self.neighborDownwindApn = int(self.neighbor1Apn + ApnUpstream * -0.5)
 
 
+class faceView:
 
+    """
+        a read-only view of one face of one cell in a Grid.faceTable, with
+        the same attribute names as face. Intended for debugging the face
+        tables, so the hot path never needs to build face objects.
+    """
 
+    __slots__ = ("table", "cellIndex")
 
-        
+    def __init__(self,table,i,j):
+        """
+        inputs:
+            table     (faceTable) -face table from grid.faces
+            i         (int)       -x index of the cell, counted from the first non-BC cell
+            j         (int)       -y index of the cell, counted from the first non-BC cell
+        """
+        self.table = table
+        self.cellIndex = (i,j)
 
+    @property
+    def normal(self):
+        return self.table.normal
 
+    @property
+    def area(self):
+        # a float on uniform grids, the same for every cell
+        return np.broadcast_to(self.table.area,self.table.owner.shape)[self.cellIndex]
 
+    @property
+    def sizeDirection(self):
+        return self.table.sizeDirection
 
+    @property
+    def cell(self):
+        return np.array(self.cellIndex) + 2
 
+    @property
+    def neighbor1(self):
+        return self.cell + self.table.normal
 
+    @property
+    def neighbor1Apn(self):
+        return self.table.neighborApn
+
+    def upwind(self,velocity):
+        """
+        returns the upwind cells as (neighbor1, neighbor1Apn, neighbor2,
+        neighbor2Apn) for a 2 element velocity, matching face(...,velocity)
+        """
+        upstream = int(-np.sign(velocity[self.table.axis])) + 1
+        offset1 = self.table.upwind1Apn[upstream] - 2
+        offset2 = self.table.upwind2Apn[upstream] - 2
+        direction = np.abs(self.table.normal)
+        return (
+            self.cell + offset1 * direction,
+            int(self.table.upwind1Apn[upstream]),
+            self.cell + offset2 * direction,
+            int(self.table.upwind2Apn[upstream]),
+        )
+
+    def __repr__(self):
+        return "faceView({0} of cell {1},{2})".format(self.table.name, *self.cell)
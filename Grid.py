@@ -1,30 +1,268 @@
 import numpy as np
 
+clusterings = ("uniform","geometric","tanh")
+
+def distribution(n,start=0.0,end=1.0,clustering="uniform",side="both",strength=None):
+
+    """
+        face coordinates of n cells between start and end, optionally
+        clustered so the smallest cells sit at one side or at both
+
+        geometric cells grow by a constant ratio away from the clustered
+        side(s). tanh maps uniform points through a hyperbolic tangent of
+        stretching beta, which grows the cells smoothly rather than by a
+        constant ratio:
+            start       s = 1 + tanh(beta (xi - 1)) / tanh(beta)
+            end         s = tanh(beta xi) / tanh(beta)
+            both        s = (1 + tanh(beta (xi - 1/2)) / tanh(beta/2)) / 2
+
+        inputs:
+            n         (int)       -number of cells
+            start     (float)     -first coordinate
+            end       (float)     -last coordinate
+            clustering(string)    -one of clusterings
+            side      (string)    -"start", "end" or "both", where the cells
+                                   are smallest
+            strength  (float)     -growth ratio of neighboring cells for
+                                   geometric (default 1.1), beta for tanh
+                                   (default 2.0)
+        returns:
+            points    (ndarray)   -(n+1,) increasing face coordinates
+    """
+
+    if clustering not in clusterings:
+        print("ERROR: clustering not known: {}".format(clustering))
+        return
+    if side not in ("start","end","both"):
+        print("ERROR: clustering side not known: {}".format(side))
+        return
+
+    xi = np.linspace(0,1,num=n+1)
+    if clustering == "uniform":
+        s = xi
+    elif clustering == "geometric":
+        ratio = 1.1 if strength is None else strength
+        # cells counted from the clustered side(s)
+        k = np.arange(n)
+        if side == "end":
+            k = k[::-1]
+        elif side == "both":
+            k = np.minimum(k,k[::-1])
+        widths = ratio**k
+        s = np.concatenate(([0.0],np.cumsum(widths)))/widths.sum()
+    else:
+        beta = 2.0 if strength is None else strength
+        if side == "start":
+            s = 1 + np.tanh(beta*(xi - 1))/np.tanh(beta)
+        elif side == "end":
+            s = np.tanh(beta*xi)/np.tanh(beta)
+        else:
+            s = (1 + np.tanh(beta*(xi - 0.5))/np.tanh(beta/2))/2
+
+    points = start + (end - start)*s
+    points[0], points[-1] = start, end
+    return points
+
+class faceTable:
+
+    """
+        precomputed connectivity and geometry of one face (T, B, L or R) of
+        every non-BC cell. Everything Face.face would work out for a cell is
+        stored here as contiguous (nx,ny) arrays, with the leading axis of
+        the upwind arrays indexed by the upstream direction + 1, so that
+        [0] holds the values for an upstream direction of -1, [1] for 0 and
+        [2] for +1. Cell indices are flat indices into the (nx+4,ny+4) grid.
+    """
+
+    __slots__ = (
+        "name",             # face name (TBLR)
+        "normal",           # outward normal (2,) int
+        "axis",             # axis of the normal, 0 for x, 1 for y
+        "sign",             # sign of the outward normal (-1 or 1)
+        "sizeDirection",    # which direction grid.width takes across the face
+        "owner",            # flat index of the cell owning the face
+        "neighbor",         # flat index of the cell across the face
+        "neighborApn",      # index of the neighbor in the Apn vector
+        "upwind1",          # (3,nx,ny) flat index of the first upwind cell
+        "upwind2",          # (3,nx,ny) flat index of the second upwind cell
+        "upwind1Apn",       # (3,) index of the first upwind cell in Apn
+        "upwind2Apn",       # (3,) index of the second upwind cell in Apn
+        "area",             # face area (a float on uniform grids)
+        "ownerWidth",       # owner width across the face (float if uniform)
+        "neighborWidth",    # neighbor width across the face (float if uniform)
+        "upwind1Width",     # (3,nx,ny) first upwind cell width across the face
+        "upwind2Width",     # (3,nx,ny) second upwind cell width across the face
+        "distance",         # owner center to neighbor center distance (float if uniform)
+    )
+
+    def __init__(self, grid, name):
+
+        if name == "T":
+            self.normal = np.array([0,1])
+        elif name == "B":
+            self.normal = np.array([0,-1])
+        elif name == "L":
+            self.normal = np.array([-1,0])
+        elif name == "R":
+            self.normal = np.array([1,0])
+        else:
+            raise ValueError("Not a face name: {}".format(name))
+
+        self.name = name
+        self.axis = int(np.argmax(np.abs(self.normal)))
+        self.sign = int(self.normal[self.axis])
+        self.sizeDirection = "xy"[self.axis]
+
+        sizeColumn = 2 + self.axis
+        areaColumn = 3 - self.axis
+
+        self.owner = self.shifted(grid, grid.index, 0)
+        self.neighbor = self.shifted(grid, grid.index, self.sign)
+        self.neighborApn = 2 + self.sign
+
+        if grid.uniform:
+            # one size for every cell, kept as floats so that the schemes
+            # reduce their weights to constants
+            size = (grid.dx, grid.dy)[self.axis]
+            self.area = (grid.dy, grid.dx)[self.axis]
+            self.ownerWidth = size
+            self.neighborWidth = size
+        else:
+            self.area = np.ascontiguousarray(grid.interior(grid.val[:,:,areaColumn]))
+            self.ownerWidth = self.shifted(grid, grid.val[:,:,sizeColumn], 0)
+            self.neighborWidth = self.shifted(grid, grid.val[:,:,sizeColumn], self.sign)
+        self.distance = (self.ownerWidth + self.neighborWidth) / 2
+
+        # the first upwind cell is the 1/2 offset from the face position in
+        # the upstream direction, the second is one more cell upstream
+        offsets1 = [int(np.floor(0.5 * self.sign + 0.5 * u)) for u in (-1,0,1)]
+        offsets2 = [offset + u for offset, u in zip(offsets1,(-1,0,1))]
+
+        self.upwind1Apn = 2 + np.array(offsets1)
+        self.upwind2Apn = 2 + np.array(offsets2)
+        self.upwind1 = np.stack([self.shifted(grid, grid.index, o) for o in offsets1])
+        self.upwind2 = np.stack([self.shifted(grid, grid.index, o) for o in offsets2])
+        if grid.uniform:
+            # read-only broadcast views, indexed like the full arrays
+            self.upwind1Width = np.broadcast_to(size, self.upwind1.shape)
+            self.upwind2Width = np.broadcast_to(size, self.upwind2.shape)
+        else:
+            self.upwind1Width = np.stack(
+                [self.shifted(grid, grid.val[:,:,sizeColumn], o) for o in offsets1]
+            )
+            self.upwind2Width = np.stack(
+                [self.shifted(grid, grid.val[:,:,sizeColumn], o) for o in offsets2]
+            )
+
+    def shifted(self, grid, array, offset):
+        # contiguous copy of array for the cells offset along the normal axis
+        if self.axis == 0:
+            return np.ascontiguousarray(grid.interior(array,offset,0))
+        return np.ascontiguousarray(grid.interior(array,0,offset))
+
+def isUniform(points, tol=1e-9):
+    #whether the spacing of 1D coordinates is constant to within tol of it
+    spacing=np.diff(points)
+    return bool(np.abs(spacing-spacing.mean()).max()<=tol*abs(spacing.mean()))
+
 class grid:
 
-    def __init__(self, nx, ny, verbose=False):
+    def __init__(self, nx, ny, verbose=False, x=None, y=None, uniform=None):
+
+        """
+        inputs:
+            nx, ny    (int)       -number of cells in x and y
+            verbose   (bool)      -print the geometry
+            x         (ndarray)   -optional (nx+1,) increasing x coordinates
+                                   of the cell faces, from distribution() or
+                                   the user, uniform on [0,1] when None
+            y         (ndarray)   -the same for the (ny+1,) y coordinates
+            uniform   (bool)      -keep only the extents and dx, dy of an
+                                   evenly spaced grid (see initialize), None
+                                   to decide from the coordinates
+        """
 
         #number of points in each direction
         self.nx=nx
         self.ny=ny
         self.ncells=nx*ny
 
+        self.initialize(verbose, x, y, uniform)
+
+    def initialize(self, verbose, x=None, y=None, uniform=None):
+        #a uniform grid stores only its extents and cell sizes. center and
+        #width answer from those, the face tables hold the sizes as floats
+        #so the schemes fold them into constant weights, and the val,
+        #planes and points arrays are only built when first used
+        if x is None:
+            x=np.linspace(0,1,num=self.nx+1)
+        if y is None:
+            y=np.linspace(0,1,num=self.ny+1)
+        x=np.asarray(x,dtype=float)
+        y=np.asarray(y,dtype=float)
+        for name, coordinates, n in (("x",x,self.nx),("y",y,self.ny)):
+            if coordinates.shape!=(n+1,):
+                raise ValueError("{0} needs {1} coordinates, got shape {2}".format
+                    (name,n+1,coordinates.shape))
+            if np.any(np.diff(coordinates)<=0):
+                raise ValueError("{} coordinates are not increasing".format(name))
+
+        evenlySpaced=isUniform(x) and isUniform(y)
+        if uniform and not evenlySpaced:
+            raise ValueError("uniform grid asked for with uneven coordinates")
+        self.uniform=evenlySpaced if uniform is None else bool(uniform)
+        self.extents=((x[0],x[-1]),(y[0],y[-1]))
+
+        if self.uniform:
+            self.dx=(x[-1]-x[0])/self.nx
+            self.dy=(y[-1]-y[0])/self.ny
+            self.version=getattr(self,"version",0)+1
+        else:
+            self.dx=self.dy=None
+            self.materialize(x,y)
+            self.buildFaceTables()
+
+        if verbose:
+            #for debugging:
+            # these will print the x cetroids followed by y centroids
+            # note that transpose is necessary to make sure x values appear as 
+            # columns and the flip ensures row 0 (x0 appears at the bottom)
+            print("centroid position x")
+            print(np.flip(np.transpose(self.val[:,:,0]),0))
+            print("\n")
+            print("centroid position y")
+            print(np.flip(np.transpose(self.val[:,:,1]),0))
+            print("\n")
+            print("cell width x")
+            print(np.flip(np.transpose(self.val[:,:,2]),0))
+            print("\n")
+            print("cell width y")
+            print(np.flip(np.transpose(self.val[:,:,3]),0))
+
+    def materialize(self, x=None, y=None):
+        #build the geometry arrays from the face coordinates, those of the
+        #extents when not given
+        if x is None:
+            x=np.linspace(*self.extents[0],num=self.nx+1)
+        if y is None:
+            y=np.linspace(*self.extents[1],num=self.ny+1)
+
         #grid is stored in this numpy array (val)
         ##order is:
         ### 0 centroid x
         ### 1 centroid y
         ### 2 cell width
         ### 3 cell height
-        self.val=np.zeros((nx+4,ny+4,4))
-        self.points=np.zeros((nx+1,ny+1,2))
-
-        self.initialize(verbose)
+        ##each quantity is a contiguous plane of planes, val is an
+        ##[x,y,quantity] view of them (see fields.py)
+        self.planes=np.zeros((4,self.nx+4,self.ny+4))
+        self.val=np.moveaxis(self.planes,0,-1)
 
-    def initialize(self, verbose):
-        #get points on which cells are to be made
+        #get points on which cells are to be made, the tensor product of
+        #the x and y face coordinates
         self.points=np.zeros((self.nx+1,self.ny+1,2))
-        self.points[:,:,0]=np.linspace(0,1,num=self.nx+1)[:,np.newaxis]
-        self.points[:,:,1]=np.linspace(0,1,num=self.nx+1)[np.newaxis,:]
+        self.points[:,:,0]=x[:,np.newaxis]
+        self.points[:,:,1]=y[np.newaxis,:]
 
         #internal point setup
         #x centroids are the average of the points grid offset in x
@@ -48,8 +286,8 @@ class grid:
         #self.val[2:-2,1,3] = 0 # bottom x height
         #self.val[2:-2,-2,3] = 0 # top x height
         # the face y quantities are as their adjacent row +- half the grid width
-        self.val[2:-2,1,1] = 0 # bottom y centroid
-        self.val[2:-2,-2,1] = 1 # top y centroid
+        self.val[2:-2,1,1] = y[0] # bottom y centroid
+        self.val[2:-2,-2,1] = y[-1] # top y centroid
         #note no action taken for the y width, as for the face this is zero
 
         # left and right
@@ -63,8 +301,8 @@ class grid:
         #self.val[1,2:-2,2] = 0 # left y width
         #self.val[-2,2:-2,2] = 0 # right y width
         # the face x quantities are as their adjacent row +- half the grid width
-        self.val[1,2:-2,0] = 0 # left x centroid
-        self.val[-2,2:-2,0] = 1 # right x centroid
+        self.val[1,2:-2,0] = x[0] # left x centroid
+        self.val[-2,2:-2,0] = x[-1] # right x centroid
         #note no action taken for the x width, as for the face this is zero   
 
         #ghost point setup
@@ -78,31 +316,58 @@ class grid:
         self.val[-1,2:-2,2] = self.val[-3,2:-2,2] # right y width
 
         # put a value in the corners
-        self.val[1,1,0]=0
-        self.val[-2,1,0]=1
-        self.val[1,-2,0]=0
-        self.val[-2,-2,0]=1
-        self.val[1,1,1]=0
-        self.val[-2,1,1]=0
-        self.val[1,-2,1]=1
-        self.val[-2,-2,1]=1
+        self.val[1,1,0]=x[0]
+        self.val[-2,1,0]=x[-1]
+        self.val[1,-2,0]=x[0]
+        self.val[-2,-2,0]=x[-1]
+        self.val[1,1,1]=y[0]
+        self.val[-2,1,1]=y[0]
+        self.val[1,-2,1]=y[-1]
+        self.val[-2,-2,1]=y[-1]
 
-        if verbose:
-            #for debugging:
-            # these will print the x cetroids followed by y centroids
-            # note that transpose is necessary to make sure x values appear as 
-            # columns and the flip ensures row 0 (x0 appears at the bottom)
-            print("centroid position x")
-            print(np.flip(np.transpose(self.val[:,:,0]),0))
-            print("\n")
-            print("centroid position y")
-            print(np.flip(np.transpose(self.val[:,:,1]),0))
-            print("\n")
-            print("cell width x")
-            print(np.flip(np.transpose(self.val[:,:,2]),0))
-            print("\n")
-            print("cell width y")
-            print(np.flip(np.transpose(self.val[:,:,3]),0))
+    def setCoordinates(self, x, y, uniform=None):
+        #replace the geometry by new face coordinates, dropping the arrays
+        #and face tables built for the old one. A uniform grid builds them
+        #again lazily, a stretched one right away
+        for name in ("planes","val","points","index","faces"):
+            self.__dict__.pop(name,None)
+        self.initialize(False, x, y, uniform)
+
+    def __getattr__(self, name):
+        #only reached for attributes not set yet, the geometry arrays and
+        #face tables of a uniform grid before their first use
+        if name in ("planes","val","points"):
+            self.materialize()
+            return self.__dict__[name]
+        if name in ("index","faces"):
+            self.index=np.arange((self.nx+4)*(self.ny+4)).reshape(self.nx+4,self.ny+4)
+            self.faces={face: faceTable(self,face) for face in "TBLR"}
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def buildFaceTables(self):
+        #face connectivity and geometry tables, these never change for a
+        #fixed grid so they are built once here rather than per face visit.
+        #call again after modifying val by hand, which also ends the uniform
+        #fast path. version counts the calls, so caches of geometry
+        #dependent operators can tell a grid changed
+        self.version=getattr(self,"version",0)+1
+        self.uniform=False
+        self.dx=self.dy=None
+        #flat index of every cell in the (nx+4,ny+4) arrays
+        self.index=np.arange((self.nx+4)*(self.ny+4)).reshape(self.nx+4,self.ny+4)
+        self.faces={name: faceTable(self,name) for name in "TBLR"}
+
+    def __getstate__(self):
+        #val is a view of planes, which pickling would turn into a copy
+        state=dict(self.__dict__)
+        state.pop("val",None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if "planes" in state:
+            self.val=np.moveaxis(self.planes,0,-1)
 
     def center(self,i,j,xy):
         #xy=0 for x, 1 for y
@@ -113,6 +378,11 @@ class grid:
         else:
             print("ERROR: Invalid centroid select: {}".format(xy))
             return
+        if self.uniform and 1<=i<=self.nx+2 and 1<=j<=self.ny+2:
+            #cell centers, with the BC layers on the domain edges
+            n,size=((self.nx,self.dx),(self.ny,self.dy))[xy]
+            cell=(i,j)[xy]
+            return self.extents[xy][0]+min(max(cell-1.5,0),n)*size
         return self.val[i,j,xy]
 
     def width(self,i,j,xy):
@@ -124,8 +394,63 @@ class grid:
         else:
             print("ERROR: Invalid width select: {}".format(xy))        
             return
+        if self.uniform and (2<=i<=self.nx+1 or 2<=j<=self.ny+1):
+            #every cell but the unused corners has the same size
+            return self.dx if xy==2 else self.dy
         return self.val[i,j,xy]
 
+    def cellWidths(self):
+        """
+        returns the x and y widths of every non-BC cell, floats on a
+        uniform grid and (nx,ny) views of val otherwise
+        """
+        if self.uniform:
+            return self.dx, self.dy
+        return self.interior(self.val[:,:,2]), self.interior(self.val[:,:,3])
+
+    def interior(self,array,di=0,dj=0):
+        """
+        returns a view of a padded [x,y,...] array covering every non-BC cell,
+        shifted by (di,dj) cells. The two ghost layers allow shifts of up to
+        two cells in each direction, so interior(a,1,0)[i-2,j-2] is a[i+1,j]
+
+        inputs:
+            array     (ndarray)   -array shaped (nx+4,ny+4,...)
+            di        (int)       -x shift in cells (-2 to 2)
+            dj        (int)       -y shift in cells (-2 to 2)
+        returns:
+            view      (ndarray)   -(nx,ny,...) view into array
+        """
+        return array[2+di:self.nx+2+di,2+dj:self.ny+2+dj]
+
+    def subgrid(self,i0,i1,j0,j1):
+        """
+        returns a grid of the non-BC cells i0 <= i < i1, j0 <= j < j1
+        (counted from 0 at the first non-BC cell) with its two-deep halo,
+        whose val is copied from this grid. Halo cells inside this grid
+        keep their real geometry, halo cells outside are the BC and ghost
+        layers of this grid.
+
+        inputs:
+            i0, i1    (int)       -x range of non-BC cells
+            j0, j1    (int)       -y range of non-BC cells
+        returns:
+            block     (Grid)      -grid object of the block
+        """
+        block=grid(i1-i0,j1-j0,x=self.points[i0:i1+1,0,0],y=self.points[0,j0:j1+1,1])
+        block.val[:]=self.val[i0:i1+4,j0:j1+4]
+        block.points=np.copy(self.points[i0:i1+1,j0:j1+1])
+        block.buildFaceTables()
+        return block
+
+    def faceView(self,i,j,facename):
+        """
+        returns a lightweight Face.faceView of face facename on cell i,j
+        read from the face tables, for debugging
+        """
+        import Face
+        return Face.faceView(self.faces[facename],i-2,j-2)
+
     def plot(self, saveImage=False):
         import matplotlib.pyplot as mpl
         mpl.plot(
@@ -147,4 +472,140 @@ class grid:
             mpl.savefig("grid.png")
         else:
             mpl.show()
-        mpl.close()
\ No newline at end of file
+        mpl.close()
+
+def clusteringCheck(kinVisc=0.05,ny=8,tol=2e-2,strength=3.0,
+                    cells=(16,24,32,48,64,96,128,192,256,384,512,768,1024)):
+
+    """
+        solves steady convection-diffusion across the domain, u = (1,0)
+        with phi 0 at L and 1 at R, whose exact solution
+            phi = (exp(x/kinVisc) - 1) / (exp(1/kinVisc) - 1)
+        is a boundary layer of thickness kinVisc at R. Uniform cells and
+        cells tanh clustered towards R are refined in x until the largest
+        error is below tol
+
+        returns:
+            results   (dict)      -per distribution the cells, error and
+                                   solve seconds of the first grid within
+                                   tol, with the savings of the clustered
+                                   grid in cells and time
+    """
+
+    import time
+    import Boundary
+    import fields
+    import kernels
+    import linearSolver
+
+    results = {}
+    for clustering in ("uniform","tanh"):
+        for n in cells:
+            block = grid(n,ny,x=distribution(n,clustering=clustering,side="end",strength=strength))
+            solution = fields.fields(block).solution
+            solution[:,:,0] = 1.0
+            bcs = Boundary.boundaries(block)
+            bcs.set("L", Boundary.inflow(0.0), field=2)
+            bcs.set("R", Boundary.inflow(1.0), field=2)
+            bcs.set("T", Boundary.outflow(), field=2)
+            bcs.set("B", Boundary.outflow(), field=2)
+            bcs.apply(solution)
+
+            start = time.perf_counter()
+            Apx, Apy = kernels.assemble\
+                (
+                    block,solution,kinVisc,diffusion=True,backend="numpy"
+                )
+            linearSolver.solve(block,Apx,Apy,solution,field=2,method="lu",boundary=bcs)
+            seconds = time.perf_counter() - start
+
+            x = block.interior(block.val[:,:,0])
+            exact = np.expm1(x/kinVisc)/np.expm1(1/kinVisc)
+            error = float(np.abs(block.interior(solution[:,:,2]) - exact).max())
+            if error < tol:
+                break
+        results[clustering] = {"nx": n, "cells": n*ny, "error": error,
+                               "seconds": seconds, "converged": error < tol}
+
+    baseline = results["uniform"]
+    for result in results.values():
+        result["cellSaving"] = 1 - result["cells"]/baseline["cells"]
+        result["timeSaving"] = 1 - result["seconds"]/baseline["seconds"]
+    return results
+
+def uniformCheck(n=1024):
+
+    """
+        builds an n x n unit square with and without the uniform fast path
+        and assembles second-order upwind convection with diffusion on each
+
+        returns:
+            results   (dict)      -per mode the seconds to build and to
+                                   assemble, the bytes held by the geometry
+                                   (val, points and the face table sizes,
+                                   counting broadcast views once) and the
+                                   largest difference of the coefficients
+    """
+
+    import time
+    import fields
+    import kernels
+
+    def stored(array):
+        # bytes actually held, broadcast views only once per stride
+        array = np.asarray(array)
+        return array.itemsize*int(np.prod([size for size, stride in zip(array.shape,array.strides) if stride]))
+
+    results = {}
+    coefficients = {}
+    for label, uniform in (("full",False),("uniform",True)):
+        start = time.perf_counter()
+        block = grid(n,n,uniform=uniform)
+        tables = block.faces
+        built = time.perf_counter() - start
+
+        solution = fields.fields(block).solution
+        solution[:,:,0:2] = -1.0
+        start = time.perf_counter()
+        coefficients[label] = kernels.assemble\
+            (
+                block,solution,0.01,diffusion=True,backend="numpy"
+            )
+        assembled = time.perf_counter() - start
+
+        geometry = sum(stored(block.__dict__[name]) for name in ("planes","points") if name in block.__dict__)
+        for table in tables.values():
+            for name in ("area","ownerWidth","neighborWidth","distance","upwind1Width","upwind2Width"):
+                geometry += stored(getattr(table,name))
+        results[label] = {"build": built, "assemble": assembled, "geometryBytes": geometry}
+
+    results["difference"] = max\
+        (
+            float(np.abs(full - uniform).max())
+            for full, uniform in zip(coefficients["full"],coefficients["uniform"])
+        )
+    return results
+
+if __name__ == "__main__":
+    result = uniformCheck()
+    for label in ("full","uniform"):
+        print\
+            (
+                "{0:<8} build {1:.3f}s  assemble {2:.3f}s  geometry {3:>12,d} bytes".format
+                    (
+                        label,result[label]["build"],result[label]["assemble"],
+                        result[label]["geometryBytes"]
+                    )
+            )
+    print("largest coefficient difference {:.1e}".format(result["difference"]))
+    for clustering, result in clusteringCheck().items():
+        print\
+            (
+                "{0:<8} {1:>5}x{2} cells  error {3:.2e}{4}  {5:.4f}s  saving {6:6.1%} cells "
+                "{7:6.1%} time".format
+                    (
+                        clustering,result["nx"],result["cells"]//result["nx"],
+                        result["error"],"" if result["converged"] else " (not within tol)",
+                        result["seconds"],result["cellSaving"],result["timeSaving"]
+                    )
+            )
@@ -0,0 +1,363 @@
+"""
+    acceleration of the outer fixed-point iteration
+
+    the outer loop of run_CD_test maps the interior phi of one iteration to
+    that of the next, x -> G(x), through assembly and a smoother sweep (or
+    a direct solve, when a deferred correction makes the coefficients
+    depend on phi). Its plain form takes x = G(x), which stalls when
+    convection dominates. The accelerators here wrap any such sweep
+    function, working on the flat vector of interior cells:
+
+        fixedPoint      -x + omega (G(x) - x), the baseline
+        adaptive        -the same with omega adapted every iteration by
+                         Aitken's rule from the last two residuals
+        anderson        -Anderson mixing, combining the last depth
+                         iterates to minimize the linearized residual
+        newtonKrylov    -Jacobian-free Newton-Krylov on G(x) - x = 0,
+                         GMRES with finite-difference Jacobian products
+
+    the first three take one sweep per iteration and plug into the loop of
+    run_CD_test through update(x,G(x)); Newton-Krylov calls the sweep
+    function itself. compare() reports the sweeps and wall time each needs
+    against the fixed-point loop.
+"""
+
+import time
+import numpy as np
+import scipy.sparse.linalg as spla
+
+class fixedPoint:
+
+    def __init__(self,relaxation=1.0):
+
+        """
+        relaxed fixed-point update, x + relaxation (G(x) - x)
+        """
+
+        self.relaxation = relaxation
+
+    def reset(self):
+        pass
+
+    def update(self,x,gx):
+
+        """
+        next iterate from the current one and its sweep
+
+        inputs:
+            x         (ndarray)   -flat interior values before the sweep
+            gx        (ndarray)   -the same after the sweep
+        returns:
+            x         (ndarray)   -flat interior values to continue from
+        """
+
+        return x + self.relaxation * (gx - x)
+
+class adaptive(fixedPoint):
+
+    def __init__(self,relaxation=1.0,minRelaxation=0.1,maxRelaxation=2.0):
+
+        """
+        Aitken relaxation, updating omega from the change of the residual
+        r = G(x) - x between iterations,
+            omega_k = -omega_k-1 r_k-1.(r_k - r_k-1) / |r_k - r_k-1|^2
+        kept within [minRelaxation, maxRelaxation]
+        """
+
+        fixedPoint.__init__(self,relaxation)
+        self.initial = relaxation
+        self.minRelaxation = minRelaxation
+        self.maxRelaxation = maxRelaxation
+        self.reset()
+
+    def reset(self):
+        self.relaxation = self.initial
+        self.previous = None
+        self.history = []
+
+    def update(self,x,gx):
+        r = gx - x
+        if self.previous is not None:
+            change = r - self.previous
+            denominator = np.dot(change,change)
+            if denominator > 0.0:
+                self.relaxation = np.clip\
+                    (
+                        -self.relaxation * np.dot(self.previous,change) / denominator,
+                        self.minRelaxation,self.maxRelaxation
+                    )
+        self.previous = r
+        self.history.append(float(self.relaxation))
+        return x + self.relaxation * r
+
+class anderson(fixedPoint):
+
+    def __init__(self,depth=5,relaxation=1.0):
+
+        """
+        Anderson mixing of the last depth iterates: with F and G the
+        differences of the residuals and sweeps, gamma minimizes
+        |r - F gamma| and
+            x_new = G(x) - G gamma - (1 - relaxation) (r - F gamma)
+
+        inputs:
+            depth     (int)       -iterates kept, 0 is the fixed point
+            relaxation(float)     -mixing factor of the residual
+        """
+
+        fixedPoint.__init__(self,relaxation)
+        self.depth = depth
+        self.reset()
+
+    def reset(self):
+        self.residuals = []
+        self.sweeps = []
+
+    def update(self,x,gx):
+        r = gx - x
+        self.residuals.append(r)
+        self.sweeps.append(gx)
+        if len(self.residuals) > self.depth + 1:
+            self.residuals.pop(0)
+            self.sweeps.pop(0)
+
+        if len(self.residuals) == 1:
+            return x + self.relaxation * r
+
+        F = np.diff(np.array(self.residuals),axis=0).T
+        G = np.diff(np.array(self.sweeps),axis=0).T
+        gamma = np.linalg.lstsq(F,r,rcond=None)[0]
+        return gx - G @ gamma - (1 - self.relaxation) * (r - F @ gamma)
+
+accelerators = {
+    "fixedPoint": fixedPoint,
+    "adaptive": adaptive,
+    "anderson": anderson,
+}
+
+def iterate(sweep,x0,accelerator=None,tol=1e-8,maxSweeps=1000):
+
+    """
+        runs x = accelerator.update(x,sweep(x)) until the largest change a
+        sweep makes is below tol
+
+        inputs:
+            sweep     (callable)  -the map G on flat interior values
+            x0        (ndarray)   -starting values
+            accelerator           -fixedPoint, adaptive or anderson, the
+                                   plain fixed point when None
+            tol       (float)     -largest change |G(x) - x| to stop at
+            maxSweeps (int)       -maximum number of sweeps
+        returns:
+            x         (ndarray)   -final values
+            info      (dict)      -sweeps, convergence, seconds and the
+                                   change history
+    """
+
+    if accelerator is None:
+        accelerator = fixedPoint()
+    accelerator.reset()
+
+    start = time.perf_counter()
+    x = np.array(x0,dtype=float)
+    changes = []
+    converged = False
+    while len(changes) < maxSweeps:
+        gx = sweep(x)
+        changes.append(float(np.abs(gx - x).max()))
+        if changes[-1] < tol:
+            x = gx
+            converged = True
+            break
+        x = accelerator.update(x,gx)
+
+    return x, {"sweeps": len(changes), "converged": converged,
+               "seconds": time.perf_counter() - start, "changes": changes}
+
+def newtonKrylov(sweep,x0,tol=1e-8,maxSweeps=1000,forcing=0.1,restart=30,
+                 maxBacktracks=4):
+
+    """
+        Jacobian-free Newton-Krylov solve of F(x) = G(x) - x = 0. Each
+        Newton step solves J dx = -F(x) by GMRES to a relative tolerance
+        forcing, with the products J v taken as finite differences of
+        sweeps, and is halved while it does not reduce |F|
+
+        inputs:
+            sweep     (callable)  -the map G on flat interior values
+            x0        (ndarray)   -starting values
+            tol       (float)     -largest change |G(x) - x| to stop at
+            maxSweeps (int)       -maximum number of sweeps
+            forcing   (float)     -relative tolerance of the linear solves
+            restart   (int)       -GMRES restart length
+            maxBacktracks (int)   -step halvings per Newton step
+        returns:
+            x         (ndarray)   -final values
+            info      (dict)      -sweeps, Newton steps, convergence,
+                                   seconds and the change history
+    """
+
+    start = time.perf_counter()
+    counter = {"sweeps": 0}
+    changes = []
+
+    def residual(x):
+        counter["sweeps"] += 1
+        return sweep(x) - x
+
+    x = np.array(x0,dtype=float)
+    F = residual(x)
+    changes.append(float(np.abs(F).max()))
+    steps = 0
+    while changes[-1] >= tol and counter["sweeps"] < maxSweeps:
+        scale = np.sqrt(np.finfo(float).eps) * (1 + np.linalg.norm(x))
+
+        def product(v,x=x,F=F):
+            norm = np.linalg.norm(v)
+            if norm == 0.0:
+                return np.zeros_like(v)
+            epsilon = scale / norm
+            return (residual(x + epsilon * v) - F) / epsilon
+
+        J = spla.LinearOperator((x.size,x.size),matvec=product)
+        dx, flag = spla.gmres\
+            (
+                J,-F,rtol=forcing,atol=0.0,restart=restart,maxiter=1
+            )
+        steps += 1
+
+        norm = np.linalg.norm(F)
+        for backtrack in range(maxBacktracks + 1):
+            trial = x + dx
+            trialF = residual(trial)
+            if np.linalg.norm(trialF) < norm or backtrack == maxBacktracks:
+                break
+            dx = dx / 2
+        x, F = trial, trialF
+        changes.append(float(np.abs(F).max()))
+
+    return x + F, {"sweeps": counter["sweeps"], "steps": steps,
+                   "converged": changes[-1] < tol,
+                   "seconds": time.perf_counter() - start, "changes": changes}
+
+def caseSweep(n=32,solver="multicolor",relaxation=0.9,deferredScheme=None,
+              kinVisc=1/40,backend="numpy"):
+
+    """
+        the run_CD_test loop as a sweep function: set the interior of phi,
+        assemble, and take one smoother sweep or solve
+
+        inputs:
+            n         (int)       -cells in each direction
+            solver    (string)    -"GS", one of smoothers.smoothers or one of
+                                   linearSolver.methods
+            relaxation(float)     -relaxation of the smoother
+            deferredScheme(string)-optional scheme of deferred.py
+            kinVisc   (float)     -kinematic viscosity
+            backend   (string)    -"numpy" or "numba"
+        returns:
+            sweep     (callable)  -G on flat interior values of phi
+            x0        (ndarray)   -initial interior values
+    """
+
+    import deferred
+    import kernels
+    import linearSolver
+    import smoothers
+    import run_CD_test
+
+    grid, solution, bcs = run_CD_test.testCase(n,n)
+    phi = solution[:,:,2]
+    interior = grid.interior(phi)
+    boundary = bcs.updater(solution,field=2)
+    structure = linearSolver.sparsity()
+
+    def sweep(x):
+        interior[:] = x.reshape(grid.nx,grid.ny)
+        bcs.apply(solution)
+        source = None
+        if deferredScheme is None:
+            Apx, Apy = run_CD_test.assemble(grid,solution,kinVisc,backend=backend)
+        else:
+            Apx, Apy, source = deferred.assemble\
+                (
+                    grid,solution,deferredScheme,kinVisc,backend=backend
+                )
+        if solver == "GS":
+            kernels.gaussSeidel\
+                (
+                    grid,Apx,Apy,phi,relaxation=relaxation,source=source,
+                    backend=backend
+                )
+        elif solver in smoothers.smoothers:
+            smoothers.smoothers[solver]\
+                (
+                    grid,Apx,Apy,phi,relaxation=relaxation,source=source,
+                    boundary=boundary
+                )
+        else:
+            linearSolver.solve\
+                (
+                    grid,Apx,Apy,solution,field=2,method=solver,source=source,
+                    boundary=bcs,structure=structure
+                )
+        return interior.ravel().copy()
+
+    return sweep, interior.ravel().copy()
+
+def compare(n=32,solver="multicolor",relaxation=0.9,deferredScheme=None,
+            tol=1e-8,maxSweeps=1500,depth=5):
+
+    """
+        solves one case with the fixed-point loop and every accelerator
+
+        returns:
+            results   (dict)      -per method the sweeps, seconds and
+                                   convergence, with the savings in sweeps
+                                   and time relative to the fixed point
+    """
+
+    methods = \
+        {
+            "fixedPoint": fixedPoint(),
+            "adaptive": adaptive(),
+            "anderson": anderson(depth),
+            "newtonKrylov": None,
+        }
+
+    results = {}
+    for name, accelerator in methods.items():
+        sweep, x0 = caseSweep(n,solver,relaxation,deferredScheme)
+        if name == "newtonKrylov":
+            x, info = newtonKrylov(sweep,x0,tol=tol,maxSweeps=maxSweeps)
+        else:
+            x, info = iterate(sweep,x0,accelerator,tol=tol,maxSweeps=maxSweeps)
+        del info["changes"]
+        results[name] = info
+
+    baseline = results["fixedPoint"]
+    for info in results.values():
+        info["sweepSaving"] = 1 - info["sweeps"] / baseline["sweeps"]
+        info["timeSaving"] = 1 - info["seconds"] / baseline["seconds"]
+    return results
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    cases = \
+        (
+            ("multicolor",None),("lu","secondOrderUpwind"),("lu","vanLeer"),
+            ("GS","QUICK")
+        )
+    for solver, deferredScheme in cases:
+        print("{0} {1}".format(solver,deferredScheme or ""))
+        for name, info in compare(n,solver=solver,deferredScheme=deferredScheme).items():
+            print\
+                (
+                    "    {0:<14}{1:>6} sweeps{2}  {3:8.3f}s  saving {4:6.1%} sweeps "
+                    "{5:6.1%} time".format
+                        (
+                            name,info["sweeps"],"" if info["converged"] else " (not converged)",
+                            info["seconds"],info["sweepSaving"],info["timeSaving"]
+                        )
+                )
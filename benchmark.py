@@ -0,0 +1,399 @@
+"""
+    throughput benchmarks of the solver stages on the convected step test
+    case of run_CD_test, over a ladder of grid sizes
+
+    every stage is timed as the best of a few repeats of a fixed number of
+    calls, and its memory high-water mark is measured with tracemalloc in a
+    separate untimed call. Per stage the results are cells/second, peak
+    memory, and the scaling exponent p of time ~ cells^p fitted over the
+    ladder. Results are written as JSON and can be compared with an
+    earlier run to flag regressions:
+
+        python benchmark.py --output new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+import Grid
+import interpolate
+import fvSchemes
+import incremental
+import kernels
+import output
+import smoothers
+import convergence
+import run_CD_test
+
+ladder = (11, 16, 32, 64, 128, 256, 512, 1024)
+
+# the per-cell reference routines are only run up to this many cells
+cellLimit = 64*64
+
+# fast stages repeat their call until about this many cells are processed
+# per timing, so small grids are not dominated by timer resolution
+targetCells = 1 << 16
+
+kinVisc = 1/40
+
+class case:
+
+    def __init__(self,n,solver="multicolor",backend="numpy",precision="double"):
+
+        """
+        state shared by the stages at one grid size
+
+        inputs:
+            n         (int)       -cells in each direction
+            solver    (string)    -smoother of the sweep and iteration stages,
+                                   "GS" or one of smoothers.smoothers
+            backend   (string)    -kernel backend, "numpy" or "numba"
+            precision (string)    -solution storage, "double" or "single"
+        """
+
+        self.n = n
+        self.solver = solver
+        self.backend = backend
+        self.grid, self.solution, self.bcs = run_CD_test.testCase(n,n,precision=precision)
+        self.Apx, self.Apy = run_CD_test.assemble\
+            (
+                self.grid,self.solution,kinVisc,backend=backend
+            )
+        self.incremental = incremental.assembler(self.grid,convection="secondOrderUpwind")
+        self.monitor = convergence.monitor(self.grid,backend=backend)
+        self.boundary = self.bcs.updater(self.solution,field=2)
+        self.directory = tempfile.mkdtemp(prefix="benchmark")
+
+    def close(self):
+        shutil.rmtree(self.directory,ignore_errors=True)
+
+    def sweep(self):
+        phi = self.solution[:,:,2]
+        if self.solver == "GS":
+            kernels.gaussSeidel\
+                (
+                    self.grid,self.Apx,self.Apy,phi,relaxation=0.9,
+                    backend=self.backend
+                )
+            self.bcs.apply(self.solution)
+        elif self.solver == "multicolor":
+            kernels.multicolorGaussSeidel\
+                (
+                    self.grid,self.Apx,self.Apy,phi,relaxation=0.9,
+                    boundary=self.boundary,backend=self.backend
+                )
+        else:
+            smoothers.smoothers[self.solver]\
+                (
+                    self.grid,self.Apx,self.Apy,phi,relaxation=0.9,
+                    boundary=self.boundary
+                )
+
+def gridStage(c):
+    Grid.grid(c.n,c.n)
+
+def interpolateStage(c):
+    interpolate.linearField(c.grid,c.solution,neighbor="T",field=1)
+    interpolate.linearField(c.grid,c.solution,neighbor="B",field=1)
+    interpolate.linearField(c.grid,c.solution,neighbor="L",field=0)
+    interpolate.linearField(c.grid,c.solution,neighbor="R",field=0)
+
+def interpolateCellStage(c):
+    for i in range(2,c.n+2):
+        for j in range(2,c.n+2):
+            for neighbor, field in (("T",1),("B",1),("L",0),("R",0)):
+                interpolate.linear(i,j,c.grid,c.solution,neighbor=neighbor,field=field)
+
+def fvSchemesStage(c):
+    velocity = c.solution[:,:,0:2]
+    for facename in "TBLR":
+        fvSchemes.secondOrderUpwindField(c.grid,velocity=velocity,facename=facename)
+        fvSchemes.centralDifferenceField(c.grid,facename=facename)
+
+def fvSchemesCellStage(c):
+    for i in range(2,c.n+2):
+        for j in range(2,c.n+2):
+            velocity = c.solution[i,j,0:2]
+            for facename in "TBLR":
+                fvSchemes.secondOrderUpwind(i,j,c.grid,velocity=velocity,facename=facename)
+                fvSchemes.centralDifference(i,j,c.grid,facename=facename)
+
+def assemblyStage(c):
+    run_CD_test.assemble(c.grid,c.solution,kinVisc,backend=c.backend)
+
+def incrementalStage(c):
+    # after the warm-up call no face flips, as in the late iterations of
+    # a steady run
+    c.incremental.assemble(c.solution)
+
+def sweepStage(c):
+    c.sweep()
+
+def residualStage(c):
+    c.monitor.measure("phi",c.Apx,c.Apy,c.solution[:,:,2])
+
+def outputStage(c):
+    output.saveField\
+        (
+            np.copy(c.solution[1:-1,1:-1,2]),
+            os.path.join(c.directory,"sol.npy")
+        )
+
+def iterationStage(c):
+    # one iteration of the run_CD_test loop, without the plotting
+    c.Apx, c.Apy = run_CD_test.assemble(c.grid,c.solution,kinVisc,backend=c.backend)
+    c.sweep()
+    c.monitor.measure("phi",c.Apx,c.Apy,c.solution[:,:,2])
+
+# name: (function, per-cell reference)
+stages = {
+    "grid": (gridStage, False),
+    "interpolate": (interpolateStage, False),
+    "interpolateCell": (interpolateCellStage, True),
+    "fvSchemes": (fvSchemesStage, False),
+    "fvSchemesCell": (fvSchemesCellStage, True),
+    "assembly": (assemblyStage, False),
+    "incremental": (incrementalStage, False),
+    "sweep": (sweepStage, False),
+    "residual": (residualStage, False),
+    "output": (outputStage, False),
+    "iteration": (iterationStage, False),
+}
+
+def measure(function,c,repeats=3):
+
+    """
+        times one stage at one grid size
+
+        inputs:
+            function  (callable)  -stage taking the case
+            c         (case)      -state at this grid size
+            repeats   (int)       -timings to take the best of
+        returns:
+            result    (dict)      -seconds per call, calls per timing,
+                                   cells/second and peak bytes
+    """
+
+    cells = c.n * c.n
+    calls = max(1,targetCells // cells)
+
+    # warm up, this also compiles the numba kernels
+    function(c)
+
+    best = np.inf
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        for call in range(calls):
+            function(c)
+        best = min(best,(time.perf_counter() - start) / calls)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    function(c)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return {
+        "seconds": best,
+        "calls": calls,
+        "cellsPerSecond": cells / best,
+        "peakBytes": peak,
+    }
+
+def scalingExponent(sizes,seconds):
+
+    """
+        fits time ~ cells^p over the larger sizes of a ladder, where the
+        per-call overhead no longer dominates
+
+        inputs:
+            sizes     (list)      -cells in each direction
+            seconds   (list)      -time per call at each size
+        returns:
+            p         (float)     -fitted exponent, None with under two sizes
+    """
+
+    cells = np.array(sizes,dtype=float)**2
+    seconds = np.array(seconds)
+    large = cells >= 4096
+    if np.count_nonzero(large) >= 2:
+        cells, seconds = cells[large], seconds[large]
+    if len(cells) < 2:
+        return None
+    return float(np.polyfit(np.log(cells),np.log(seconds),1)[0])
+
+def environment(solver,backend,precision="double"):
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "numba": kernels.available,
+        "solver": solver,
+        "backend": backend,
+        "precision": precision,
+    }
+
+def run(sizes=ladder,names=None,solver="multicolor",backend="numpy",repeats=3,
+        verbose=True,precision="double"):
+
+    """
+        runs the benchmark stages over a ladder of grid sizes
+
+        inputs:
+            sizes     (list)      -cells in each direction, one case per size
+            names     (list)      -stages to run, all by default
+            solver    (string)    -smoother of the sweep and iteration stages
+            backend   (string)    -kernel backend, "numpy" or "numba"
+            repeats   (int)       -timings to take the best of
+            verbose   (bool)      -print every result as it is measured
+            precision (string)    -solution storage, "double" or "single"
+        returns:
+            results   (dict)      -environment, and per stage the results of
+                                   every size and the scaling exponent
+    """
+
+    if names is None:
+        names = list(stages)
+    for name in names:
+        if name not in stages:
+            print("ERROR: Not a benchmark stage: {}".format(name))
+            return
+
+    results = {"environment": environment(solver,backend,precision), "sizes": list(sizes),
+               "stages": {name: {"sizes": {}} for name in names}}
+
+    for n in sizes:
+        c = case(n,solver=solver,backend=backend,precision=precision)
+        for name in names:
+            function, perCell = stages[name]
+            if perCell and n*n > cellLimit:
+                continue
+            result = measure(function,c,repeats=repeats)
+            results["stages"][name]["sizes"][str(n)] = result
+            if verbose:
+                print\
+                    (
+                        "{0:<16}{1:>6}{2:>14.4g} cells/s{3:>12.1f} kB".format
+                            (name,n,result["cellsPerSecond"],result["peakBytes"]/1024)
+                    )
+        c.close()
+
+    for name in names:
+        measured = results["stages"][name]["sizes"]
+        results["stages"][name]["exponent"] = scalingExponent\
+            (
+                [int(n) for n in measured],
+                [entry["seconds"] for entry in measured.values()]
+            )
+
+    return results
+
+def compare(baseline,current,tolerance=0.2):
+
+    """
+        flags the stages and sizes that are slower or use more memory than
+        in a baseline run
+
+        inputs:
+            baseline  (dict)      -results of an earlier run
+            current   (dict)      -results of this run
+            tolerance (float)     -allowed relative loss before flagging
+        returns:
+            regressions (list)    -one message per flagged stage and size
+    """
+
+    # runs from before the precision option stored double precision
+    for key, default in (("solver",None),("backend",None),("precision","double")):
+        old = baseline["environment"].get(key,default)
+        if old != current["environment"].get(key,default):
+            print\
+                (
+                    "WARNING: baseline {0} {1} differs from {2}".format
+                        (key,old,current["environment"][key])
+                )
+
+    regressions = []
+    for name, stage in current["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+        old = baseline["stages"][name]["sizes"]
+        for n, entry in stage["sizes"].items():
+            if n not in old:
+                continue
+            ratio = entry["cellsPerSecond"] / old[n]["cellsPerSecond"]
+            if ratio < 1 - tolerance:
+                regressions.append\
+                    (
+                        "{0} at {1}x{1}: {2:.1%} of the baseline throughput".format
+                            (name,n,ratio)
+                    )
+            if entry["peakBytes"] > (1 + tolerance) * old[n]["peakBytes"] + 4096:
+                regressions.append\
+                    (
+                        "{0} at {1}x{1}: peak memory {2} kB, baseline {3} kB".format
+                            (
+                                name,n,entry["peakBytes"]//1024,
+                                old[n]["peakBytes"]//1024
+                            )
+                    )
+    return regressions
+
+def report(results):
+    # scaling exponent of every stage, as a text table
+    lines = ["{0:<16}{1:>10}".format("stage","exponent")]
+    for name, stage in results["stages"].items():
+        exponent = stage["exponent"]
+        lines.append\
+            (
+                "{0:<16}{1:>10}".format
+                    (name,"-" if exponent is None else "{0:.3f}".format(exponent))
+            )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes",type=int,nargs="+",default=list(ladder))
+    parser.add_argument("--stages",nargs="+",default=None,choices=list(stages))
+    parser.add_argument("--solver",default="multicolor")
+    parser.add_argument("--backend",default="numpy",choices=kernels.backends)
+    parser.add_argument("--precision",default="double",choices=["double","single"])
+    parser.add_argument("--repeats",type=int,default=3)
+    parser.add_argument("--output",default="benchmark.json")
+    parser.add_argument("--compare",default=None,help="baseline JSON to compare with")
+    parser.add_argument("--tolerance",type=float,default=0.2)
+    args = parser.parse_args()
+
+    results = run\
+        (
+            sizes=args.sizes,names=args.stages,solver=args.solver,
+            backend=args.backend,repeats=args.repeats,precision=args.precision
+        )
+    if results is None:
+        return 2
+    print(report(results))
+
+    with open(args.output,"w") as f:
+        json.dump(results,f,indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline,results,tolerance=args.tolerance)
+        for message in regressions:
+            print("REGRESSION: " + message)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
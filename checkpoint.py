@@ -0,0 +1,303 @@
+"""
+    checkpoint and restart of the relaxation loop
+
+    a checkpoint file holds the solution, Ap and the grid's val and points
+    arrays, plus the iteration state, as
+
+        magic "FVCK" | version (uint32) | header length (uint64)
+        JSON header: state, and per array its dtype, shape, offset, crc32
+        raw C-ordered array data, each array aligned to 64 bytes
+
+    so it can be opened with np.memmap for zero-copy post-processing of
+    large grids. Files are written to a temporary name in the same
+    directory, fsynced and moved into place with os.replace, so a crash
+    while writing leaves the previous checkpoint untouched.
+"""
+
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+magic = b"FVCK"
+version = 1
+alignment = 64
+prefixFormat = "<4sIQ"
+
+def align(offset):
+    return -(-offset // alignment) * alignment
+
+def write(filename,grid,solution,Ap=None,state=None,arrays=None):
+
+    """
+        atomically writes a checkpoint
+
+        inputs:
+            filename  (string)    -checkpoint file name
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            Ap        (ndarray)   -optional Ap array of the driver
+            state     (dict)      -JSON serializable iteration state
+            arrays    (dict)      -optional further named arrays
+    """
+
+    stored = {"solution": solution, "val": grid.val, "points": grid.points}
+    if Ap is not None:
+        stored["Ap"] = Ap
+    if arrays is not None:
+        stored.update(arrays)
+
+    header = {"nx": grid.nx, "ny": grid.ny, "state": state or {}, "arrays": {}}
+
+    # offsets depend on the header length, which depends on the offsets,
+    # so lay the arrays out after a generous estimate of the header size
+    entries = {}
+    for name, array in stored.items():
+        array = np.ascontiguousarray(array)
+        entries[name] = array
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": 0,
+            "crc32": zlib.crc32(array.data) & 0xffffffff,
+        }
+    prefixSize = struct.calcsize(prefixFormat)
+    estimate = len(json.dumps(header)) + 32 * len(entries) + 256
+    offset = align(prefixSize + estimate)
+    for name, array in entries.items():
+        header["arrays"][name]["offset"] = offset
+        offset = align(offset + array.nbytes)
+
+    encoded = json.dumps(header).encode("utf-8")
+    if prefixSize + len(encoded) > header["arrays"][next(iter(entries))]["offset"]:
+        print("ERROR: checkpoint header overflow")
+        return
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    temporary = filename + ".tmp"
+    with open(temporary,"wb") as f:
+        f.write(struct.pack(prefixFormat,magic,version,len(encoded)))
+        f.write(encoded)
+        for name, array in entries.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(array.data)
+        f.truncate(offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary,filename)
+
+    # make the rename itself durable
+    try:
+        descriptor = os.open(directory,os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+def readHeader(filename):
+
+    """
+        reads and checks the header of a checkpoint
+
+        returns:
+            header    (dict)      -nx, ny, state and the array table,
+                                   None if the file is not a checkpoint
+    """
+
+    prefixSize = struct.calcsize(prefixFormat)
+    try:
+        with open(filename,"rb") as f:
+            prefix = f.read(prefixSize)
+            if len(prefix) < prefixSize:
+                return None
+            fileMagic, fileVersion, length = struct.unpack(prefixFormat,prefix)
+            if fileMagic != magic or fileVersion > version:
+                return None
+            header = json.loads(f.read(length).decode("utf-8"))
+            size = os.fstat(f.fileno()).st_size
+    except (OSError, ValueError):
+        return None
+
+    # a truncated file cannot hold every array
+    for entry in header["arrays"].values():
+        nbytes = np.dtype(entry["dtype"]).itemsize * int(np.prod(entry["shape"]))
+        if entry["offset"] + nbytes > size:
+            return None
+    return header
+
+class checkpoint:
+
+    def __init__(self,filename,mmap=False,verify=True):
+
+        """
+        an opened checkpoint file
+
+        inputs:
+            filename  (string)    -checkpoint file name
+            mmap      (bool)      -map the arrays read-only instead of
+                                   reading them into memory
+            verify    (bool)      -check the crc32 of every array, which
+                                   reads the whole file
+        """
+
+        self.filename = filename
+        self.header = readHeader(filename)
+        self.arrays = {}
+        if self.header is None:
+            print("ERROR: Not a valid checkpoint: {}".format(filename))
+            return
+        self.nx = self.header["nx"]
+        self.ny = self.header["ny"]
+        self.state = self.header["state"]
+
+        for name, entry in self.header["arrays"].items():
+            dtype = np.dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            if mmap:
+                array = np.memmap\
+                    (
+                        filename,dtype=dtype,mode="r",
+                        offset=entry["offset"],shape=shape
+                    )
+            else:
+                with open(filename,"rb") as f:
+                    f.seek(entry["offset"])
+                    array = np.fromfile(f,dtype=dtype,count=int(np.prod(shape)))
+                array = array.reshape(shape)
+            if verify and zlib.crc32(np.ascontiguousarray(array).data) & 0xffffffff != entry["crc32"]:
+                print("ERROR: checkpoint array {0} is corrupt: {1}".format(name,filename))
+                self.header = None
+                self.arrays = {}
+                return
+            self.arrays[name] = array
+
+    @property
+    def valid(self):
+        return self.header is not None
+
+    def __getitem__(self,name):
+        return self.arrays[name]
+
+    def restoreGrid(self,grid=None):
+
+        """
+        returns a Grid.grid with the checkpoint's geometry, copied into
+        grid when given, with the face tables rebuilt. Evenly spaced
+        geometry stays on the uniform path, so a restarted run takes the
+        same steps as an uninterrupted one
+        """
+
+        import Grid
+
+        if grid is None:
+            grid = Grid.grid(self.nx,self.ny)
+        elif (grid.nx,grid.ny) != (self.nx,self.ny):
+            print("ERROR: grid is {0}x{1}, checkpoint is {2}x{3}".format
+                (grid.nx,grid.ny,self.nx,self.ny))
+            return
+
+        points = self.arrays["points"]
+        x, y = np.array(points[:,0,0]), np.array(points[0,:,1])
+        if Grid.isUniform(x) and Grid.isUniform(y):
+            grid.setCoordinates(x,y,uniform=True)
+            if np.array_equal(grid.val,self.arrays["val"]):
+                # the arrays were only built for the comparison
+                grid.setCoordinates(x,y,uniform=True)
+                return grid
+
+        grid.val[:] = self.arrays["val"]
+        grid.points = np.array(self.arrays["points"])
+        grid.buildFaceTables()
+        return grid
+
+def filename(directory,it,prefix="checkpoint"):
+    return os.path.join(directory,"{0}_{1:08d}.fvck".format(prefix,it))
+
+def checkpoints(directory,prefix="checkpoint"):
+
+    """
+        returns the (iteration, filename) of every checkpoint file in a
+        directory, oldest first, without opening them
+    """
+
+    found = []
+    if not os.path.isdir(directory):
+        return found
+    for name in os.listdir(directory):
+        stem, extension = os.path.splitext(name)
+        if extension != ".fvck" or not stem.startswith(prefix + "_"):
+            continue
+        number = stem[len(prefix)+1:]
+        if number.isdigit():
+            found.append((int(number),os.path.join(directory,name)))
+    return sorted(found)
+
+def latest(directory,prefix="checkpoint",mmap=False):
+
+    """
+        opens the newest valid checkpoint in a directory, skipping any
+        that fail their checks
+
+        returns:
+            checkpoint            -opened checkpoint, None if there is none
+    """
+
+    for it, name in reversed(checkpoints(directory,prefix)):
+        if readHeader(name) is None:
+            continue
+        opened = checkpoint(name,mmap=mmap)
+        if opened.valid:
+            return opened
+    return None
+
+class checkpointer:
+
+    def __init__(self,directory,interval=100,keep=2,prefix="checkpoint"):
+
+        """
+        periodic checkpoints of a relaxation loop
+
+        inputs:
+            directory (string)    -where the checkpoints are written
+            interval  (int)       -checkpoint every interval-th iteration
+            keep      (int)       -number of newest checkpoints kept
+            prefix    (string)    -checkpoint file name prefix
+        """
+
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.prefix = prefix
+        os.makedirs(directory,exist_ok=True)
+
+    def due(self,it):
+        return self.interval > 0 and it % self.interval == 0
+
+    def save(self,it,grid,solution,Ap=None,state=None):
+
+        """
+        writes the checkpoint of iteration it and removes the old ones
+        beyond keep
+        """
+
+        state = dict(state or {})
+        state["iteration"] = it
+        write(filename(self.directory,it,self.prefix),grid,solution,Ap=Ap,state=state)
+
+        # only readable checkpoints count towards keep, so a torn file never
+        # pushes out the last good one
+        found = checkpoints(self.directory,self.prefix)
+        readable = [old for old, name in found if readHeader(name) is not None]
+        if len(readable) > self.keep:
+            oldest = readable[-self.keep]
+            for old, name in found:
+                if old < oldest:
+                    os.remove(name)
+
+    def latest(self,mmap=False):
+        return latest(self.directory,self.prefix,mmap=mmap)
@@ -0,0 +1,212 @@
+"""
+    convergence monitoring of the relaxation loop by the residual of the
+    discrete equation Ap*phi_p = sum(An*phi_n) + source, rather than the
+    change of the solution between iterations
+
+    the residual of each field is scaled as in standard finite volume codes,
+        R = sum|sum(An*phi_n) + source - Ap*phi_p| / sum|Ap*phi_p|
+    and a field has converged when R falls below an absolute tolerance or
+    R / R_first (the residual of the first iteration) below a relative one.
+"""
+
+import csv
+import json
+import numpy as np
+
+def residualNorms(grid,Apx,Apy,phi,source=None,work=None):
+
+    """
+        computes the norms of the residual of every non-BC cell without
+        full-field temporaries, accumulating in two (nx,ny) work arrays
+        that can be kept between calls
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            work      (ndarray)   -optional (2,nx,ny) work arrays
+        returns:
+            L1        (float)     -sum of |r|
+            L2        (float)     -sqrt of the sum of r^2
+            largest   (float)     -largest |r|
+            scale     (float)     -sum of |Ap*phi_p|
+    """
+
+    import smoothers
+
+    if work is None:
+        work = np.empty((2,grid.nx,grid.ny))
+    r, t = work[0], work[1]
+
+    r[:] = 0.0 if source is None else source
+    for direction, slot, shift in smoothers.stencilShifts:
+        if direction == "x":
+            np.multiply(Apx[:,:,slot],grid.interior(phi,shift,0),out=t)
+        else:
+            np.multiply(Apy[:,:,slot],grid.interior(phi,0,shift),out=t)
+        r += t
+
+    np.add(Apx[:,:,2],Apy[:,:,2],out=t)
+    t *= grid.interior(phi)
+    r -= t
+
+    np.abs(t,out=t)
+    scale = t.sum()
+    L2 = np.sqrt(np.vdot(r,r))
+    np.abs(r,out=r)
+
+    return r.sum(), L2, r.max(), scale
+
+class monitor:
+
+    def __init__(self,grid,fields=("phi",),absTol=1e-6,relTol=None,
+                 minIterations=1,backend="numpy"):
+
+        """
+        residual history and convergence test of one or more fields
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            fields    (tuple)     -names of the monitored fields
+            absTol    (float)     -tolerance on the scaled residual, None
+                                   to disable
+            relTol    (float)     -tolerance on the scaled residual relative
+                                   to the first iteration, None to disable
+            minIterations (int)   -iterations before convergence is allowed
+            backend   (string)    -"numpy" or "numba" for the reduction
+        """
+
+        self.grid = grid
+        self.fields = tuple(fields)
+        self.absTol = absTol
+        self.relTol = relTol
+        self.minIterations = minIterations
+        self.backend = backend
+
+        self.work = np.empty((2,grid.nx,grid.ny))
+        self.first = {}
+        self.current = {}
+        self.history = []
+
+    def measure(self,field,Apx,Apy,phi,source=None):
+
+        """
+        computes and stores the residual of one field for this iteration
+
+        inputs:
+            field     (string)    -name of the field
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field
+            source    (ndarray)   -optional (nx,ny) explicit source term
+        returns:
+            scaled    (float)     -scaled residual of the field
+        """
+
+        import kernels
+
+        if field not in self.fields:
+            print("ERROR: Not a monitored field: {}".format(field))
+            return
+        L1, L2, largest, scale = kernels.residualNorms\
+            (
+                self.grid,Apx,Apy,phi,source=source,work=self.work,
+                backend=self.backend
+            )
+        # a zero field has no magnitude to scale by, use the coefficients
+        if scale == 0.0:
+            scale = np.abs(Apx[:,:,2] + Apy[:,:,2]).sum()
+        return self.record(field,L1,L2,largest,scale)
+
+    def record(self,field,L1,L2,largest,scale):
+
+        """
+        stores residual norms computed elsewhere, such as the global
+        reduction of the decomposed solver, for this iteration
+
+        inputs:
+            field     (string)    -name of the field
+            L1        (float)     -sum of |r|
+            L2        (float)     -sqrt of the sum of r^2
+            largest   (float)     -largest |r|
+            scale     (float)     -sum of |Ap*phi_p|
+        returns:
+            scaled    (float)     -scaled residual of the field
+        """
+
+        if field not in self.fields:
+            print("ERROR: Not a monitored field: {}".format(field))
+            return
+        scaled = L1 / scale if scale > 0 else L1
+
+        self.current[field] = {"scaled": scaled, "L1": L1, "L2": L2, "max": largest}
+        self.first.setdefault(field,scaled)
+        return scaled
+
+    def relative(self,field):
+        first = self.first.get(field,0.0)
+        if first == 0.0:
+            return 0.0
+        return self.current[field]["scaled"] / first
+
+    def update(self,it):
+
+        """
+        closes iteration it, appending the residuals measured since the
+        previous update to the history
+
+        returns:
+            converged (bool)      -whether every field meets a tolerance
+        """
+
+        entry = {"iteration": it}
+        for field in self.fields:
+            if field not in self.current:
+                continue
+            for norm, value in self.current[field].items():
+                entry["{0}:{1}".format(field,norm)] = value
+            entry["{0}:relative".format(field)] = self.relative(field)
+        self.history.append(entry)
+        return self.converged(it)
+
+    def converged(self,it):
+        if it < self.minIterations:
+            return False
+        for field in self.fields:
+            if field not in self.current:
+                return False
+            scaled = self.current[field]["scaled"]
+            absolute = self.absTol is not None and scaled <= self.absTol
+            relative = self.relTol is not None and self.relative(field) <= self.relTol
+            if not (absolute or relative):
+                return False
+        return True
+
+    def state(self):
+        # JSON serializable state for checkpoints
+        return {"first": dict(self.first), "history": list(self.history)}
+
+    def restore(self,state):
+        self.first = dict(state.get("first",{}))
+        self.history = list(state.get("history",[]))
+
+    def export(self,filename):
+
+        """
+        writes the residual history, as CSV when the file name ends in .csv
+        and as JSON otherwise
+        """
+
+        if filename.endswith(".csv"):
+            columns = []
+            for entry in self.history:
+                columns += [key for key in entry if key not in columns]
+            with open(filename,"w",newline="") as f:
+                writer = csv.DictWriter(f,fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(self.history)
+        else:
+            with open(filename,"w") as f:
+                json.dump(self.history,f,indent=2)
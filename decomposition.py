@@ -0,0 +1,444 @@
+"""
+    domain decomposed relaxation, running the assembly and smoothing of
+    rectangular blocks of the grid in separate worker processes
+
+    the solution lives in one shared memory array. Every worker copies its
+    block with the two-deep halo the second-order stencils need into a
+    private padded array (a Grid.subgrid of the block), assembles and
+    smooths it, and after every sweep
+        1. waits for all workers to finish reading halos
+        2. writes its block's non-BC cells back to the shared array
+        3. waits, while worker 0 applies the boundary conditions
+        4. reads the four two-deep halo strips of its block again
+    so the result does not depend on process timing. Each worker then
+    reduces the equation residual of its block and the master combines
+    them into the global residual that decides convergence.
+
+    the blocks see each other's updates once per sweep (block Jacobi
+    between blocks, the chosen smoother within), so more blocks can need
+    more sweeps than the serial solver.
+
+    run this file to measure the scaling efficiency on this machine:
+        python decomposition.py [n] [workers...]
+"""
+
+import multiprocessing
+import time
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+import Boundary
+
+ITERATE = 1
+STOP = 2
+
+def split(n,parts):
+
+    """
+        splits n cells into parts contiguous ranges of near equal size
+
+        returns:
+            ranges    (list)      -(start, stop) of every part
+    """
+
+    edges = np.linspace(0,n,parts+1).round().astype(int)
+    return [(int(a),int(b)) for a, b in zip(edges[:-1],edges[1:])]
+
+def blockLayout(workers,nx,ny):
+
+    """
+        returns the (px,py) blocks per direction for a number of workers,
+        choosing the factor pair whose blocks are closest to square
+    """
+
+    best = None
+    for px in range(1,workers+1):
+        if workers % px:
+            continue
+        py = workers // px
+        if px > nx or py > ny:
+            continue
+        aspect = abs(np.log((nx / px) / (ny / py)))
+        if best is None or aspect < best[0]:
+            best = (aspect,px,py)
+    if best is None:
+        print("ERROR: cannot split {0}x{1} cells into {2} blocks".format(nx,ny,workers))
+        return
+    return best[1], best[2]
+
+def localBoundaries(grid,block,bcs,i0,i1,j0,j1):
+    # conditions of the physical sides a block touches. Periodic sides are
+    # left to worker 0, their partner cells belong to other blocks.
+    local = Boundary.boundaries(block)
+    touches = {"L": i0 == 0, "R": i1 == grid.nx, "B": j0 == 0, "T": j1 == grid.ny}
+    for (field, side), condition in bcs.conditions.items():
+        if touches[side] and not isinstance(condition,Boundary.periodic):
+            local.set(side,condition,field=field)
+    return local
+
+class sharedArray:
+
+    # a numpy array in shared memory, attached by name in the workers
+
+    def __init__(self,shape,dtype=float,name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1,int(np.prod(self.shape)) * self.dtype.itemsize)
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True,size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(self.shape,dtype=self.dtype,buffer=self.memory.buf)
+
+    def __getstate__(self):
+        return {"shape": self.shape, "dtype": self.dtype.str, "name": self.memory.name}
+
+    def __setstate__(self,state):
+        self.__init__(state["shape"],state["dtype"],state["name"])
+
+def startContext(method=None):
+
+    """
+        returns the multiprocessing context worker processes are started
+        from, "forkserver" where available and "spawn" otherwise. Workers
+        are never forked from the caller: once numba's parallel kernels
+        have started their thread pool, a forked child inherits its held
+        locks and the parent hangs at exit. Scripts starting workers
+        therefore need the if __name__ == "__main__" guard
+
+        inputs:
+            method    (string)    -optional start method overriding the
+                                   default
+    """
+
+    if method is None:
+        methods = multiprocessing.get_all_start_methods()
+        method = "forkserver" if "forkserver" in methods else "spawn"
+    return multiprocessing.get_context(method)
+
+def smooth(block,Apx,Apy,phi,smoother,relaxation,local,backend):
+    # one sweep of the block's smoother on the private padded field
+    import kernels
+    import smoothers
+
+    boundary = lambda: local.applyField(phi,2)
+    if smoother == "GS":
+        kernels.gaussSeidel(block,Apx,Apy,phi,relaxation=relaxation,backend=backend)
+        boundary()
+    elif smoother == "multicolor":
+        kernels.multicolorGaussSeidel\
+            (
+                block,Apx,Apy,phi,relaxation=relaxation,boundary=boundary,
+                backend=backend
+            )
+    else:
+        smoothers.smoothers[smoother]\
+            (
+                block,Apx,Apy,phi,relaxation=relaxation,boundary=boundary
+            )
+
+def worker(rank,ranges,grid,bcs,assembler,smoother,relaxation,sweeps,backend,
+           shared,control,reduction,timings,start,exchange,done,timeout=None):
+
+    """
+        body of one worker process, serving iterate requests until stopped
+
+        inputs:
+            rank      (int)       -worker number, 0 applies the global BCs
+            ranges    (list)      -((i0,i1),(j0,j1)) of every worker's block
+            grid      (Grid)      -grid object of the whole domain
+            bcs       (boundaries)-Boundary.boundaries of the whole domain
+            assembler (callable)  -assembler(grid,solution) -> Apx, Apy
+            shared, control, reduction, timings (sharedArray)
+                                  -solution, command, residual sums and
+                                   seconds spent per phase of each worker
+            start, exchange, done (Barrier)
+                                  -master and workers, workers only, and
+                                   master and workers again
+            timeout   (float)     -seconds to wait at the halo exchange for
+                                   the other workers
+    """
+
+    import convergence
+
+    solution = shared.array
+    (i0,i1), (j0,j1) = ranges[rank]
+    block = grid.subgrid(i0,i1,j0,j1)
+    local = localBoundaries(grid,block,bcs,i0,i1,j0,j1)
+
+    # field-major so the smoothed field is contiguous for the kernels
+    fields = solution.shape[2]
+    store = np.empty((fields,i1-i0+4,j1-j0+4))
+    localSolution = store.transpose(1,2,0)
+    phi = store[2]
+    work = np.empty((2,i1-i0,j1-j0))
+
+    def pullHalo():
+        halo = solution[i0:i1+4,j0:j1+4,2]
+        phi[:2,:] = halo[:2,:]
+        phi[-2:,:] = halo[-2:,:]
+        phi[:,:2] = halo[:,:2]
+        phi[:,-2:] = halo[:,-2:]
+
+    try:
+        while True:
+            start.wait()
+            if control.array[0] == STOP:
+                return
+
+            clock = time.perf_counter()
+            localSolution[:] = solution[i0:i1+4,j0:j1+4]
+            Apx, Apy = assembler(block,localSolution)
+            timings.array[rank,0] += time.perf_counter() - clock
+
+            for sweep in range(sweeps):
+                clock = time.perf_counter()
+                smooth(block,Apx,Apy,phi,smoother,relaxation,local,backend)
+                timings.array[rank,1] += time.perf_counter() - clock
+
+                clock = time.perf_counter()
+                exchange.wait(timeout)
+                solution[i0+2:i1+2,j0+2:j1+2,2] = phi[2:-2,2:-2]
+                exchange.wait(timeout)
+                if rank == 0:
+                    bcs.apply(solution)
+                exchange.wait(timeout)
+                pullHalo()
+                timings.array[rank,2] += time.perf_counter() - clock
+
+            clock = time.perf_counter()
+            reduction.array[rank] = convergence.residualNorms\
+                (
+                    block,Apx,Apy,phi,work=work
+                )
+            timings.array[rank,3] += time.perf_counter() - clock
+            done.wait()
+    except threading.BrokenBarrierError:
+        return
+    except Exception as error:
+        print("ERROR: worker {0} failed: {1}".format(rank,error))
+        for barrier in (start,exchange,done):
+            barrier.abort()
+
+class decomposition:
+
+    def __init__(self,grid,solution,bcs,assembler,workers=2,blocks=None,
+                 smoother="GS",relaxation=1.0,sweeps=1,backend="numpy",
+                 timeout=300.0,context=None):
+
+        """
+        worker processes relaxing blocks of the grid in shared memory
+
+        the solution is copied into shared memory, and the solution
+        attribute is the shared array, which the caller should use in
+        place of its own between iterations
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            bcs       (boundaries)-Boundary.boundaries of the whole domain
+            assembler (callable)  -assembler(grid,solution) -> Apx, Apy, called
+                                   with each block's subgrid and padded solution
+            workers   (int)       -number of worker processes
+            blocks    (tuple)     -optional (px,py) blocks per direction,
+                                   chosen from workers by default
+            smoother  (string)    -"GS" or one of smoothers.smoothers
+            relaxation(float)     -under-relaxation factor
+            sweeps    (int)       -sweeps per iteration, each followed by a
+                                   halo exchange
+            backend   (string)    -"numpy" or "numba" for the kernels
+            timeout   (float)     -seconds to wait for the workers before
+                                   giving up on a stuck or failed one, None
+                                   waits forever
+            context   (string)    -multiprocessing start method, see
+                                   startContext
+        """
+
+        if blocks is None:
+            blocks = blockLayout(workers,grid.nx,grid.ny)
+            if blocks is None:
+                raise ValueError("no block layout for {} workers".format(workers))
+        px, py = blocks
+        self.grid = grid
+        self.blocks = (px,py)
+        self.workers = px * py
+        self.timeout = timeout
+
+        self.ranges = [(ri,rj) for ri in split(grid.nx,px) for rj in split(grid.ny,py)]
+
+        ctx = startContext(context)
+
+        self.shared = sharedArray(solution.shape,dtype=solution.dtype)
+        self.shared.array[:] = solution
+        self.solution = self.shared.array
+        self.control = sharedArray((1,),dtype=np.int64)
+        self.reduction = sharedArray((self.workers,4))
+        self.timings = sharedArray((self.workers,4))
+        self.timings.array[:] = 0.0
+
+        self.start = ctx.Barrier(self.workers + 1)
+        self.exchange = ctx.Barrier(self.workers)
+        self.done = ctx.Barrier(self.workers + 1)
+
+        self.processes = []
+        for rank in range(self.workers):
+            process = ctx.Process\
+                (
+                    target=worker,
+                    args=\
+                        (
+                            rank,self.ranges,grid,bcs,assembler,smoother,
+                            relaxation,sweeps,backend,self.shared,self.control,
+                            self.reduction,self.timings,self.start,
+                            self.exchange,self.done,timeout
+                        ),
+                    daemon=True
+                )
+            process.start()
+            self.processes.append(process)
+
+    def iterate(self):
+
+        """
+        runs one iteration, assembly and sweeps, on every block
+
+        returns:
+            norms     (tuple)     -global L1, L2, max and scale of the
+                                   residual as convergence.residualNorms,
+                                   None if a worker failed
+        """
+
+        self.control.array[0] = ITERATE
+        try:
+            self.start.wait(self.timeout)
+            self.done.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            print("ERROR: a decomposition worker failed or timed out")
+            self.abort()
+            self.close()
+            return None
+
+        sums = self.reduction.array
+        return \
+            (
+                sums[:,0].sum(),
+                np.sqrt((sums[:,1]**2).sum()),
+                sums[:,2].max(),
+                sums[:,3].sum()
+            )
+
+    def phaseTimes(self):
+
+        """
+        returns the seconds spent so far in assembly, smoothing, halo
+        exchange and residual, summed over the workers
+        """
+
+        names = ("assembly","smoothing","exchange","residual")
+        timings = self.timings.array if self.processes else self.seconds
+        return dict(zip(names,timings.sum(axis=0)))
+
+    def abort(self):
+        # breaks every barrier, so no worker stays blocked in one
+        for barrier in (self.start,self.exchange,self.done):
+            barrier.abort()
+
+    def close(self):
+        # stops the workers and releases the shared memory, leaving private
+        # copies of the solution and timings in the solution and seconds
+        # attributes. Safe to call again once closed
+        if not self.processes:
+            return
+        self.control.array[0] = STOP
+        try:
+            self.start.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            self.abort()
+        for process in self.processes:
+            process.join(self.timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+        self.solution = np.copy(self.shared.array)
+        self.seconds = np.copy(self.timings.array)
+        for shared in (self.shared,self.control,self.reduction,self.timings):
+            shared.array = None
+            shared.memory.close()
+            shared.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def scaling(n=256,workers=(1,2,4),iterations=10,sweeps=4,smoother="GS",
+            backend="numpy"):
+
+    """
+        times the decomposed solve of the run_CD_test case for several
+        worker counts, with the speedup and parallel efficiency
+        T(1) / (p * T(p)) relative to one worker
+
+        inputs:
+            n         (int)       -cells in each direction
+            workers   (tuple)     -worker counts to time
+            iterations(int)       -iterations timed per worker count
+            sweeps    (int)       -sweeps per iteration
+            smoother  (string)    -"GS" or one of smoothers.smoothers
+            backend   (string)    -"numpy" or "numba"
+        returns:
+            results   (list)      -per worker count a dict of the timings
+    """
+
+    import functools
+    import run_CD_test
+
+    assembler = functools.partial(run_CD_test.assemble,kinVisc=1/40,backend=backend)
+    results = []
+    for count in workers:
+        grid, solution, bcs = run_CD_test.testCase(n,n)
+        dd = decomposition\
+            (
+                grid,solution,bcs,assembler,workers=count,smoother=smoother,
+                sweeps=sweeps,relaxation=0.9,backend=backend
+            )
+        # the first iteration includes process start up and compilation
+        dd.iterate()
+        clock = time.perf_counter()
+        for it in range(iterations):
+            norms = dd.iterate()
+        seconds = (time.perf_counter() - clock) / iterations
+        phases = dd.phaseTimes()
+        dd.close()
+
+        result = {"workers": count, "blocks": dd.blocks, "seconds": seconds,
+                  "cellsPerSecond": n * n * sweeps / seconds,
+                  "scaledResidual": norms[0] / norms[3]}
+        result.update(phases)
+        results.append(result)
+
+    serial = results[0]["seconds"] * results[0]["workers"]
+    for result in results:
+        result["speedup"] = serial / result["seconds"]
+        result["efficiency"] = result["speedup"] / result["workers"]
+    return results
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    counts = tuple(int(a) for a in sys.argv[2:]) or (1,2,4)
+    print("{0} cpus, {1}x{1} cells".format(os.cpu_count(),n))
+    print("{0:>8}{1:>10}{2:>12}{3:>14}{4:>10}{5:>12}".format
+        ("workers","blocks","s/iter","cells/s","speedup","efficiency"))
+    for result in scaling(n,counts):
+        print("{0:>8}{1:>10}{2:>12.4f}{3:>14.4g}{4:>10.2f}{5:>12.2f}".format
+            (
+                result["workers"],"{0}x{1}".format(*result["blocks"]),
+                result["seconds"],result["cellsPerSecond"],result["speedup"],
+                result["efficiency"]
+            ))
@@ -0,0 +1,239 @@
+"""
+    deferred-correction higher-order and TVD convection schemes
+
+    the higher-order upwind stencils are wider than five cells in the flow
+    direction (QUICK) or not linear in phi at all (the limited schemes),
+    so rather than being put in the matrix they are split as
+
+        F phi_f = F phi_U + F (phi_f - phi_U)
+
+    the first-order upwind part stays implicit in the coefficients, which
+    keeps the matrix diagonally dominant for every smoother and solver,
+    and the difference to the higher-order face value is evaluated with
+    the current phi and moved to the RHS as an explicit source. Once the
+    outer iterations have converged the solution is that of the
+    higher-order scheme.
+
+    face values use the connectivity of the grid's face tables, for all
+    faces of one side at once:
+
+        phi_U, phi_UU   -the first and second upwind cells of the face
+        phi_D           -the cell across the face from phi_U
+
+    schemes:
+        secondOrderUpwind   -linear extrapolation from U and UU, weighted
+                             by the cell widths as in fvSchemes
+        QUICK               -quadratic through the UU, U and D centers
+        vanLeer, MUSCL, superbee, minmod
+                            -phi_U + psi(r)/2 (phi_D - phi_U) with
+                             r = (phi_U - phi_UU) / (phi_D - phi_U)
+"""
+
+import numpy as np
+
+import kernels
+
+def vanLeer(r):
+    return (r + np.abs(r)) / (1 + np.abs(r))
+
+def MUSCL(r):
+    return np.maximum(0.0,np.minimum(np.minimum(2*r,(r + 1)/2),2.0))
+
+def superbee(r):
+    return np.maximum(np.maximum(0.0,np.minimum(2*r,1.0)),np.minimum(r,2.0))
+
+def minmod(r):
+    return np.maximum(0.0,np.minimum(r,1.0))
+
+# flux limiters psi(r) of the TVD schemes
+limiters = {
+    "vanLeer": vanLeer,
+    "MUSCL": MUSCL,
+    "superbee": superbee,
+    "minmod": minmod,
+}
+
+schemes = ("secondOrderUpwind", "QUICK") + tuple(limiters)
+
+def faceValues(grid,phi,table,upstream,scheme):
+
+    """
+        upwind and higher-order values of phi on one face of every non-BC
+        cell
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            phi       (ndarray)   -(nx+4,ny+4) padded field
+            table     (faceTable) -face table from grid.faces
+            upstream  (ndarray)   -(nx,ny) upstream direction + 1 of the
+                                   cells, from fvSchemes.upstreamIndex
+            scheme    (string)    -one of schemes
+        returns:
+            upwind    (ndarray)   -(nx,ny) first-order upwind face values
+            value     (ndarray)   -(nx,ny) higher-order face values
+    """
+
+    def pick(array):
+        return np.take_along_axis(array,upstream[np.newaxis],0)[0]
+
+    flat = np.ravel(phi)
+    upwind1 = pick(table.upwind1)
+    # the downstream cell is whichever of owner and neighbor is not upwind
+    downwind = table.owner + table.neighbor - upwind1
+
+    U = flat[upwind1]
+    UU = flat[pick(table.upwind2)]
+    D = flat[downwind]
+
+    if scheme == "secondOrderUpwind" and grid.uniform:
+        return U, 1.5 * U - 0.5 * UU
+
+    if scheme == "QUICK" and grid.uniform:
+        # the weights of equally spaced centers
+        return U, 0.75 * U + 0.375 * D - 0.125 * UU
+
+    if scheme == "secondOrderUpwind":
+        size1 = pick(table.upwind1Width)
+        size2 = pick(table.upwind2Width)
+        weight = size1 / (size1 + size2)
+        return U, (1 + weight) * U - weight * UU
+
+    if scheme == "QUICK":
+        # cell center positions along the flow direction, face at zero
+        sizeU = pick(table.upwind1Width)
+        sizeD = np.where(downwind == table.owner,table.ownerWidth,table.neighborWidth)
+        xU = -sizeU / 2
+        xUU = -sizeU - pick(table.upwind2Width) / 2
+        xD = sizeD / 2
+        value = \
+            (
+                UU * xU * xD / ((xUU - xU) * (xUU - xD)) + \
+                U * xUU * xD / ((xU - xUU) * (xU - xD)) + \
+                D * xUU * xU / ((xD - xUU) * (xD - xU))
+            )
+        return U, value
+
+    if scheme in limiters:
+        downGradient = D - U
+        # a flat downstream gradient gives no correction whatever psi is
+        r = np.divide\
+            (
+                U - UU,downGradient,out=np.zeros_like(downGradient),
+                where=np.abs(downGradient) > 1e-30
+            )
+        return U, U + 0.5 * limiters[scheme](r) * downGradient
+
+    print("ERROR: deferred correction scheme not known: {}".format(scheme))
+    return
+
+def correction(grid,solution,scheme,field=2):
+
+    """
+        explicit source that turns first-order upwind convection of one
+        field into the chosen higher-order scheme,
+            source = -sum_faces F_out (phi_f - phi_U)
+        with F_out the outward face velocity times area
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            scheme    (string)    -one of schemes
+            field     (int)       -convected field of the solution
+        returns:
+            source    (ndarray)   -(nx,ny) explicit source term
+    """
+
+    from interpolate import linearField as linInterp
+    from fvSchemes import upstreamIndex
+
+    if scheme not in schemes:
+        print("ERROR: deferred correction scheme not known: {}".format(scheme))
+        return
+
+    source = np.zeros((grid.nx,grid.ny))
+    velocity = solution[:,:,0:2]
+    phi = solution[:,:,field]
+
+    d_X, d_Y = grid.cellWidths()
+
+    for name, width in (("T",d_X),("B",d_X),("L",d_Y),("R",d_Y)):
+        table = grid.faces[name]
+        upstream = upstreamIndex(grid,velocity,table)
+        upwind, value = faceValues(grid,phi,table,upstream,scheme)
+        flux = linInterp(grid,solution,neighbor=name,field=table.axis) * width
+        source -= table.sign * flux * (value - upwind)
+
+    return source
+
+def assemble(grid,solution,scheme,kinVisc=0.0,diffusion=False,backend="numpy"):
+
+    """
+        first-order upwind coefficients and the deferred correction of the
+        chosen scheme, the arguments otherwise as kernels.assemble
+
+        returns:
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            source    (ndarray)   -(nx,ny) explicit source term
+    """
+
+    source = correction(grid,solution,scheme)
+    if source is None:
+        return
+
+    Apx, Apy = kernels.assemble\
+        (
+            grid,solution,kinVisc,convection="firstOrderUpwind",
+            diffusion=diffusion,backend=backend
+        )
+    return Apx, Apy, source
+
+def boundednessCheck(n=32,iterations=200,relaxation=0.8,tol=1e-10):
+
+    """
+        solves the run_CD_test step case with every scheme by outer
+        iterations of a direct solve of the first-order upwind matrix plus
+        the deferred correction, under-relaxed by relaxation
+
+        returns:
+            results   (dict)      -per scheme the outer iterations taken,
+                                   the last change of phi and the phi range,
+                                   which stays within [0,1] for TVD schemes
+    """
+
+    import linearSolver
+    import run_CD_test
+
+    results = {}
+    for scheme in schemes:
+        grid, solution, bcs = run_CD_test.testCase(n,n)
+        structure = linearSolver.sparsity()
+        for it in range(1,iterations+1):
+            Apx, Apy, source = assemble(grid,solution,scheme)
+            previous = solution[:,:,2].copy()
+            linearSolver.solve\
+                (
+                    grid,Apx,Apy,solution,field=2,method="lu",source=source,
+                    boundary=bcs,structure=structure
+                )
+            solution[:,:,2] = previous + relaxation * (solution[:,:,2] - previous)
+            change = np.abs(solution[:,:,2] - previous).max()
+            if change < tol:
+                break
+        phi = grid.interior(solution[:,:,2])
+        results[scheme] = {"iterations": it, "change": float(change),
+                           "min": float(phi.min()), "max": float(phi.max())}
+    return results
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    for scheme, result in boundednessCheck(n).items():
+        print\
+            (
+                "{0:<18} {1:>3} iterations  change {2:.1e}  phi in [{3:+.4f}, {4:+.4f}]".format
+                    (
+                        scheme,result["iterations"],result["change"],
+                        result["min"],result["max"]
+                    )
+            )
@@ -0,0 +1,356 @@
+"""
+    batched ensembles of the run_CD_test case for parameter studies
+
+    N members are stacked along a leading batch axis of the solution,
+        solution[member,x,y,(u,v,phi)]
+    and share one Grid.grid with its face tables. Assembly, the multicolor
+    Gauss-Seidel sweep and the residual are vectorized over the batch, so
+    the per-call Python overhead is paid once per iteration for all
+    members instead of once per member.
+
+    every member has its own kinVisc, rho, relaxation and boundary values
+    (Boundary conditions accept one value per member) and converges on its
+    own: members whose scaled residual meets the tolerance drop out of the
+    active mask and are no longer assembled or swept.
+"""
+
+import time
+import numpy as np
+
+import Boundary
+import kernels
+import operators
+import smoothers
+
+class ensemble:
+
+    def __init__(self,grid,size,kinVisc=0.0,rho=1.0,relaxation=0.9,
+                 convection="secondOrderUpwind",diffusion=True,bcs=None):
+
+        """
+        a batch of cases on one grid
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py, shared by all
+            size      (int)       -number of members N
+            kinVisc   (float)     -kinematic viscosity, scalar or (N,)
+            rho       (float)     -density, scalar or (N,). Convection is
+                                   weighted by rho and diffusion by rho*kinVisc,
+                                   so without sources it cancels out
+            relaxation(float)     -under-relaxation factor, scalar or (N,)
+            convection(string)    -"firstOrderUpwind", "secondOrderUpwind"
+                                   or None
+            diffusion (bool)      -add central difference diffusion
+            bcs       (boundaries)-Boundary.boundaries of the batch, with
+                                   scalar or (N,) values; an empty set is
+                                   created when None
+        """
+
+        if convection not in kernels.convectionSchemes:
+            print("ERROR: convection scheme not known: {}".format(convection))
+            return
+
+        self.grid = grid
+        self.size = size
+        self.kinVisc = np.broadcast_to(np.asarray(kinVisc,dtype=float),(size,)).copy()
+        self.rho = np.broadcast_to(np.asarray(rho,dtype=float),(size,)).copy()
+        self.relaxation = np.broadcast_to(np.asarray(relaxation,dtype=float),(size,)).copy()
+        self.convection = convection
+        self.diffusion = diffusion
+        self.bcs = Boundary.boundaries(grid) if bcs is None else bcs
+
+        self.solution = np.zeros((size,grid.nx+4,grid.ny+4,3))
+        self.active = np.ones(size,dtype=bool)
+        self.iterations = np.zeros(size,dtype=int)
+        self.residuals = np.full(size,np.nan)
+        self.first = np.full(size,np.nan)
+        self.history = []
+
+        # geometry shared by every member, built once
+        self.I, self.J = np.ogrid[0:grid.nx,0:grid.ny]
+        self.weights = {}
+        for name, table in grid.faces.items():
+            total = table.neighborWidth + table.ownerWidth
+            self.weights[name] = (table.neighborWidth / total, table.ownerWidth / total)
+
+        # the upwind coefficients of a face only depend on the geometry and
+        # on the upstream direction, so the three cases (indexed by
+        # upstream + 1 like the face tables) are built once with fvSchemes
+        import fvSchemes
+        self.upwindTables = {}
+        if convection is not None:
+            scheme = fvSchemes.firstOrderUpwindField
+            if convection == "secondOrderUpwind":
+                scheme = fvSchemes.secondOrderUpwindField
+            for name in grid.faces:
+                cases = []
+                for upstream in (0,1,2):
+                    velocity = np.full((grid.nx+4,grid.ny+4,2),1.0 - upstream)
+                    cases.append(scheme(grid,velocity=velocity,facename=name))
+                self.upwindTables[name] = np.stack(cases)
+
+        # unit diffusion from the operator cache, scaled per member
+        if diffusion:
+            unit = operators.shared.diffusion(grid,1.0)
+            self.diffusionX, self.diffusionY = unit.Apx, unit.Apy
+
+    def interior(self,array,di=0,dj=0):
+        # grid.interior after the batch axis
+        return array[:,2+di:self.grid.nx+2+di,2+dj:self.grid.ny+2+dj]
+
+    def faceFlux(self,solution,name):
+        # linearly interpolated face velocity times face area of every
+        # member, as interpolate.linearField
+        table = self.grid.faces[name]
+        velocity = solution[...,table.axis]
+        owner, neighbor = self.weights[name]
+        value = self.interior(velocity) * owner + \
+            self.interior(velocity,*table.normal) * neighbor
+        return value * table.area
+
+    def upwind(self,solution,name):
+
+        """
+        convection coefficients of one face for every member, gathered
+        from the precomputed upstream cases of the face
+        """
+
+        table = self.grid.faces[name]
+        upstream = 1 - np.sign(self.interior(solution[...,table.axis])).astype(int)
+        return self.upwindTables[name][upstream,self.I,self.J]
+
+    def assemble(self,solution,members=slice(None)):
+
+        """
+        coefficients of the given members
+
+        inputs:
+            solution  (ndarray)   -(M,nx+4,ny+4,3) solution of the members
+            members               -index of the members in the batch
+        returns:
+            Apx       (ndarray)   -(M,nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(M,nx,ny,5) coefficients ordered BB B P T TT
+        """
+
+        shape = (solution.shape[0],self.grid.nx,self.grid.ny,5)
+        Apx = np.zeros(shape)
+        Apy = np.zeros(shape)
+
+        if self.convection is not None:
+            rho = self.rho[members][:,np.newaxis,np.newaxis,np.newaxis]
+            for name, Apn in (("T",Apy),("B",Apy),("L",Apx),("R",Apx)):
+                flux = self.faceFlux(solution,name)[...,np.newaxis]
+                Apn += rho * flux * self.upwind(solution,name)
+
+        if self.diffusion:
+            gamma = (self.rho * self.kinVisc)[members][:,np.newaxis,np.newaxis,np.newaxis]
+            Apx += gamma * self.diffusionX
+            Apy += gamma * self.diffusionY
+
+        return Apx, Apy
+
+    def neighborSum(self,Apx,Apy,phi,si=slice(None),sj=slice(None)):
+        # smoothers.neighborSum for a block of cells of every member
+        istart, istop, istep = si.indices(self.grid.nx)
+        jstart, jstop, jstep = sj.indices(self.grid.ny)
+        total = np.zeros_like(Apx[:,si,sj,2])
+        for direction, slot, shift in smoothers.stencilShifts:
+            coefficient = Apx[:,si,sj,slot] if direction == "x" else Apy[:,si,sj,slot]
+            di, dj = (shift,0) if direction == "x" else (0,shift)
+            total += coefficient * phi\
+                [
+                    :,
+                    2+istart+di:2+istop+di:istep,
+                    2+jstart+dj:2+jstop+dj:jstep
+                ]
+        return total
+
+    def sweep(self,Apx,Apy,phi,relaxation,bcs,sweeps=1):
+
+        """
+        multicolor Gauss-Seidel over every member at once, as
+        smoothers.multicolorGaussSeidel
+
+        inputs:
+            Apx, Apy  (ndarray)   -(M,nx,ny,5) coefficients
+            phi       (ndarray)   -(M,nx+4,ny+4) padded fields, updated in place
+            relaxation(ndarray)   -(M,) under-relaxation factors
+            bcs       (boundaries)-conditions of these members
+            sweeps    (int)       -number of sweeps
+        """
+
+        A_P = Apx[...,2] + Apy[...,2]
+        reach = smoothers.stencilReach(Apx,Apy)
+        colors = smoothers.colorBlocks(self.grid,reach + 1)
+        inner = self.interior(phi)
+        w = relaxation[:,np.newaxis,np.newaxis]
+
+        for sweep in range(sweeps):
+            for blocks in colors:
+                for si, sj in blocks:
+                    total = self.neighborSum(Apx,Apy,phi,si,sj)
+                    inner[:,si,sj] = inner[:,si,sj] * (1 - w) + \
+                        w * total / A_P[:,si,sj]
+                bcs.applyField(phi,2)
+
+    def residual(self,Apx,Apy,phi):
+
+        """
+        scaled equation residual of every member, as convergence.monitor
+
+        returns:
+            scaled    (ndarray)   -(M,) sum|r| / sum|Ap*phi_p|
+        """
+
+        r = self.neighborSum(Apx,Apy,phi)
+        diagonal = (Apx[...,2] + Apy[...,2]) * self.interior(phi)
+        r -= diagonal
+        L1 = np.abs(r).sum(axis=(1,2))
+        scale = np.abs(diagonal).sum(axis=(1,2))
+        zero = scale == 0.0
+        scale[zero] = np.abs(Apx[...,2] + Apy[...,2]).sum(axis=(1,2))[zero]
+        return np.where(scale > 0,L1 / np.where(scale > 0,scale,1.0),L1)
+
+    def iterate(self,sweeps=1):
+
+        """
+        one iteration, assembly, sweeps and residual, of the active members
+
+        returns:
+            scaled    (ndarray)   -(M,) scaled residual of the active members
+        """
+
+        members = np.flatnonzero(self.active)
+        if len(members) == 0:
+            return np.zeros(0)
+        # every member active keeps views, otherwise work on a compacted copy
+        if len(members) == self.size:
+            members = slice(None)
+        solution = self.solution[members]
+
+        Apx, Apy = self.assemble(solution,members)
+        bcs = self.bcs if isinstance(members,slice) else self.bcs.select(members)
+        self.sweep(Apx,Apy,solution[...,2],self.relaxation[members],bcs,sweeps)
+        scaled = self.residual(Apx,Apy,solution[...,2])
+
+        if not isinstance(members,slice):
+            self.solution[members] = solution
+        self.iterations[members] += 1
+        self.residuals[members] = scaled
+        return scaled
+
+    def solve(self,maxIterations=100,absTol=1e-6,relTol=None,sweeps=1):
+
+        """
+        iterates until every member has converged or reached maxIterations
+
+        inputs:
+            maxIterations (int)   -iteration limit per member
+            absTol    (float)     -tolerance on the scaled residual, None
+                                   to disable
+            relTol    (float)     -tolerance relative to the member's first
+                                   residual, None to disable
+            sweeps    (int)       -sweeps per iteration
+        returns:
+            info      (dict)      -iterations, final residual and converged
+                                   flag per member, and the wall time
+        """
+
+        start = time.perf_counter()
+        self.bcs.apply(self.solution,fields=[2])
+        converged = np.zeros(self.size,dtype=bool)
+
+        for it in range(maxIterations):
+            if not self.active.any():
+                break
+            members = np.flatnonzero(self.active)
+            scaled = self.iterate(sweeps)
+
+            fresh = np.isnan(self.first[members])
+            self.first[members[fresh]] = scaled[fresh]
+            done = np.zeros(len(members),dtype=bool)
+            if absTol is not None:
+                done |= scaled <= absTol
+            if relTol is not None:
+                done |= scaled <= relTol * self.first[members]
+
+            entry = np.full(self.size,np.nan)
+            entry[members] = scaled
+            self.history.append(entry)
+
+            converged[members[done]] = True
+            self.active[members[done]] = False
+
+        self.active[:] = False
+        return {
+            "iterations": self.iterations.copy(),
+            "residuals": self.residuals.copy(),
+            "converged": converged,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def exportHistory(self,filename):
+        # residual history as an (iterations, members) array, NaN once a
+        # member has converged
+        np.save(filename,np.array(self.history))
+
+def throughput(n=16,size=64,maxIterations=400,absTol=1e-6):
+
+    """
+        compares cases per hour of a kinVisc sweep of the run_CD_test case
+        run as one batch against the same members run one at a time. Only
+        members that converged count as cases, those stopped at
+        maxIterations are reported separately
+
+        inputs:
+            n         (int)       -cells in each direction
+            size      (int)       -number of members
+            maxIterations (int)   -iteration limit per member
+            absTol    (float)     -tolerance on the scaled residual
+        returns:
+            results   (dict)      -seconds, converged cases and cases per
+                                   hour of both runs
+    """
+
+    import run_CD_test
+
+    grid, solution, bcs = run_CD_test.testCase(n,n)
+    kinVisc = np.linspace(1/400,1/10,size)
+
+    batch = ensemble(grid,size,kinVisc=kinVisc,relaxation=0.9,bcs=bcs)
+    batch.solution[:] = solution
+    info = batch.solve(maxIterations=maxIterations,absTol=absTol)
+    batchSeconds = info["seconds"]
+    batchConverged = int(info["converged"].sum())
+
+    serialSeconds = 0.0
+    serialConverged = 0
+    for member in range(size):
+        single = ensemble(grid,1,kinVisc=kinVisc[member],relaxation=0.9,bcs=bcs)
+        single.solution[:] = solution
+        singleInfo = single.solve(maxIterations=maxIterations,absTol=absTol)
+        serialSeconds += singleInfo["seconds"]
+        serialConverged += int(singleInfo["converged"].sum())
+
+    return {
+        "batchSeconds": batchSeconds,
+        "serialSeconds": serialSeconds,
+        "batchConverged": batchConverged,
+        "serialConverged": serialConverged,
+        "batchCasesPerHour": batchConverged * 3600 / batchSeconds,
+        "serialCasesPerHour": serialConverged * 3600 / serialSeconds,
+        "iterations": info["iterations"],
+        "unconverged": np.flatnonzero(~info["converged"]).tolist(),
+    }
+
+if __name__ == "__main__":
+    results = throughput()
+    print("iterations per member: {}".format(results["iterations"]))
+    if results["unconverged"]:
+        print("WARNING: members {0} stopped at the iteration limit without "
+              "converging and are not counted".format(results["unconverged"]))
+    print("batch  {0:.2f}s, {1} converged, {2:.0f} cases/hour".format
+        (results["batchSeconds"],results["batchConverged"],results["batchCasesPerHour"]))
+    print("serial {0:.2f}s, {1} converged, {2:.0f} cases/hour".format
+        (results["serialSeconds"],results["serialConverged"],results["serialCasesPerHour"]))
+    print("speedup {0:.1f}x".format(results["serialSeconds"] / results["batchSeconds"]))
@@ -0,0 +1,180 @@
+"""
+    structure-of-arrays storage of the solution fields
+
+    the solution of run_CD_test is indexed [x,y,(u,v,phi)], so stored
+    interleaved every read of one field, such as solution[:,:,2], strides
+    over the other two. fields keeps each variable in its own contiguous
+    padded (nx+4,ny+4) plane of one (nfields,nx+4,ny+4) block and hands
+    out
+
+        fields.solution          -an [x,y,field] view of the planes, taken
+                                  everywhere the interleaved array is, whose
+                                  solution[:,:,k] are the contiguous planes
+        fields["phi"]            -one plane by name or number
+        fields.interior("phi")   -its non-BC cells, shifted as grid.interior
+        fields.halo("phi","T")   -its two ghost layers on one side
+
+    Grid.grid stores val the same way, one plane per geometric quantity.
+
+    storage is float64 ("double") or float32 ("single"). Geometry and
+    coefficients stay float64, so the smoother sums and the residual norms
+    accumulate in float64 and only the stored field values are rounded.
+"""
+
+import numpy as np
+
+import Boundary
+
+precisions = {"double": np.float64, "single": np.float32}
+
+# fields of the run_CD_test solution, in order
+names = ("u", "v", "phi")
+
+def planar(array):
+
+    """
+        returns the [field,x,y] view of an [x,y,field] array, whose planes
+        are contiguous when the array is a fields.solution or a grid.val
+    """
+
+    return np.moveaxis(array,-1,0)
+
+class fields:
+
+    def __init__(self,grid,names=names,precision="double"):
+
+        """
+        zeroed padded fields of a grid
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            names     (tuple)     -names of the fields, in solution order
+            precision (string)    -"double" or "single" storage
+        """
+
+        if precision not in precisions:
+            print("ERROR: precision not known: {}".format(precision))
+            return
+
+        self.grid = grid
+        self.names = tuple(names)
+        self.precision = precision
+        self.dtype = np.dtype(precisions[precision])
+        self.data = np.zeros((len(self.names),grid.nx+4,grid.ny+4),dtype=self.dtype)
+        self.solution = np.moveaxis(self.data,0,-1)
+
+    def index(self,name):
+        # position of a field given by name or number
+        if isinstance(name,str):
+            return self.names.index(name)
+        return name
+
+    def __getitem__(self,name):
+        return self.data[self.index(name)]
+
+    def interior(self,name,di=0,dj=0):
+        return self.grid.interior(self[name],di,dj)
+
+    def halo(self,name,side):
+
+        """
+        returns views of the two ghost layers of one side of a field,
+        nearest first, without the corners
+
+        inputs:
+            name      (string)    -field name or number
+            side      (string)    -side of the domain (TBLR)
+        returns:
+            layers    (tuple)     -two views along the side
+        """
+
+        found = Boundary.ghostLayers(self.grid,side)
+        if found is None:
+            return
+        axis, layers, inner = found
+        return tuple(Boundary.layer(self[name],axis,index) for index in layers)
+
+    def load(self,solution):
+        # copies an [x,y,field] array, interleaved or not, into the planes
+        self.solution[:] = solution
+        return self
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+def fromSolution(grid,solution,precision="double"):
+
+    """
+        returns a fields holding a copy of an [x,y,field] solution array
+        with the run_CD_test field names
+    """
+
+    stored = fields(grid,names=names[:solution.shape[-1]],precision=precision)
+    return stored.load(solution)
+
+def trafficCheck(n=512,precision="single",sweeps=5,backend="numpy"):
+
+    """
+        times the assembly and multicolor sweeps of the run_CD_test case
+        with an interleaved float64 solution and with planar storage of
+        the chosen precision
+
+        inputs:
+            n         (int)       -cells in each direction
+            precision (string)    -precision of the planar run
+            sweeps    (int)       -timed assemblies and sweeps
+            backend   (string)    -"numpy" or "numba"
+        returns:
+            results   (dict)      -seconds per assembly and per sweep, field
+                                   bytes, and the largest difference of phi
+    """
+
+    import time
+    import kernels
+    import run_CD_test
+
+    grid, planarSolution, bcs = run_CD_test.testCase(n,n,precision=precision)
+    interleaved = np.array(planarSolution,dtype=np.float64,order="C")
+
+    results = {}
+    for layout, solution in (("interleaved",interleaved),("planar",planarSolution)):
+        boundary = bcs.updater(solution,field=2)
+        Apx, Apy = run_CD_test.assemble(grid,solution,1/40,backend=backend)
+        start = time.perf_counter()
+        for sweep in range(sweeps):
+            Apx, Apy = run_CD_test.assemble(grid,solution,1/40,backend=backend)
+        assembly = (time.perf_counter() - start) / sweeps
+        # the first sweep also compiles the numba kernels for this dtype
+        for sweep in range(sweeps + 1):
+            if sweep == 1:
+                start = time.perf_counter()
+            kernels.multicolorGaussSeidel\
+                (
+                    grid,Apx,Apy,solution[:,:,2],relaxation=0.9,
+                    boundary=boundary,backend=backend
+                )
+        smoothing = (time.perf_counter() - start) / sweeps
+        results[layout] = {"assembly": assembly, "sweep": smoothing,
+                           "bytes": solution.nbytes}
+    results["difference"] = float(np.abs(interleaved[:,:,2] - planarSolution[:,:,2]).max())
+    return results
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    backend = sys.argv[2] if len(sys.argv) > 2 else "numpy"
+    for precision in precisions:
+        results = trafficCheck(n,precision=precision,backend=backend)
+        layouts = ("interleaved","planar") if precision == "double" else ("planar",)
+        for layout in layouts:
+            print\
+                (
+                    "{0:<12}{1:<8}assembly {2:.4f}s  sweep {3:.4f}s  {4:.1f} MB".format
+                        (
+                            layout,"double" if layout == "interleaved" else precision,
+                            results[layout]["assembly"],results[layout]["sweep"],
+                            results[layout]["bytes"]/2**20
+                        )
+                )
+        print("{0:<20}max phi difference {1:.3e}".format("",results["difference"]))
@@ -4,6 +4,7 @@
 
 import numpy as np
 import Face
+from instrumentation import logger, debugEnabled
 
 def firstOrderUpwind(i,j,grid,velocity=None,facename="Z"):
 
@@ -29,10 +30,18 @@ def firstOrderUpwind(i,j,grid,velocity=None,facename="Z"):
     # create a face object
     face = Face.face(i,j,grid,facename,velocity=velocity)
 
-    # set the two Ap coefficients we wish to upstream
-    Apn[face.neighbor1Apn] = 1
+    # create a negative sign if the face normal is against 1,1, as in
+    # secondOrderUpwind, so that outflow lands on P and inflow on the RHS
+    # with the right sign for either flow direction
+    negative = np.dot(np.array([1,1]),face.normal)
 
-    #print(str(Apn) + " " + facename)
+    # set the Ap coefficient we wish to upstream
+    Apn[face.neighbor1Apn] = negative
+
+    # flip all non-P coefficients, as for convection they are put on the RHS
+    Apn = Apn * np.array([-1,-1,1,-1,-1])
+    if debugEnabled():
+        logger.debug(str(Apn) + " " + facename)
 
     return Apn
 
@@ -83,7 +92,8 @@ def secondOrderUpwind(i,j,grid,velocity=None,facename="Z"):
      
     # flip all non-P coefficients, as for convection they are put on the RHS
     Apn = Apn * np.array([-1,-1,1,-1,-1])
-    print(str(Apn) + " " + facename)
+    if debugEnabled():
+        logger.debug(str(Apn) + " " + facename)
 
     return Apn
 
@@ -123,16 +133,16 @@ def linear(i,j,grid,facename="Z"):
             face.sizeDirection
         )
     
-    # TODO: debug this, it totally doesn't work.
-
-    #negative = np.dot(np.array([1,1]),face.normal)
-    negative = 1
+    # the sign of the outward normal ensures usage of the conservation principle
+    negative = np.dot(np.array([1,1]),face.normal)
 
     Apn[face.neighbor1Apn] = cellSize     / (cellSize + neighborSize) * negative
     Apn[face.cellApn]      = neighborSize / (cellSize + neighborSize) * negative
 
-    #Apn = Apn * np.array([-1,-1,1,-1,-1])
-    print(str(Apn) + " " + facename)
+    # flip all non-P coefficients, as for convection they are put on the RHS
+    Apn = Apn * np.array([-1,-1,1,-1,-1])
+    if debugEnabled():
+        logger.debug(str(Apn) + " " + facename)
 
     return Apn
 
@@ -175,8 +185,256 @@ def centralDifference(i,j,grid,facename="Z"):
     Apn[face.neighbor1Apn] = 2 * face.area / (cellSize + neighborSize)
     Apn[face.cellApn]      = 2 * face.area / (cellSize + neighborSize)
 
-    print(str(Apn) + " " + facename)
+    if debugEnabled():
+        logger.debug(str(Apn) + " " + facename)
+
+    return Apn
+
+########## whole-grid schemes below ##########
+#
+# the functions below return the same coefficients as their per-cell
+# counterparts above, but for every non-BC cell at once. They return
+# (nx,ny,5) arrays where Apn[i-2,j-2] is the 5x1 Ap array of cell i,j.
+# All connectivity and geometry is read from the grid's face tables
+
+def upstreamIndex(grid,velocity,table):
+
+    """
+        returns the upstream direction + 1 of every non-BC cell along the
+        face normal, which indexes the upwind arrays of the face table.
+        With no velocity the upstream direction is the face normal itself.
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            velocity  (ndarray)   -(nx+4,ny+4,2) array of cell velocities
+            table     (faceTable) -face table from grid.faces
+        returns:
+            upstream  (ndarray)   -(nx,ny) int array of 0, 1 or 2
+    """
+
+    if velocity is None:
+        return np.full((grid.nx,grid.ny),table.sign+1,dtype=int)
+    return 1 - np.sign(grid.interior(velocity[:,:,table.axis])).astype(int)
+
+def lookupFace(grid,facename):
+    # face table lookup with the same error reporting as Face.face
+    if facename not in grid.faces:
+        print("ERROR: Not a face name: {}".format(facename))
+        return
+    return grid.faces[facename]
+
+def firstOrderUpwindField(grid,velocity=None,facename="Z"):
+
+    """
+        whole-grid version of firstOrderUpwind
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            velocity  (ndarray)   -(nx+4,ny+4,2) array of cell velocities
+            facename  (string)    -name of face for differencing over (TBLR)
+        returns:
+            Apn       (ndarray)   -(nx,ny,5) array of the Ap coefficients
+    """
+
+    table = lookupFace(grid,facename)
+    if table is None:
+        return
+
+    Apn = np.zeros((grid.nx,grid.ny,5))
+    upstream = upstreamIndex(grid,velocity,table)
+
+    # set the Ap coefficient we wish to upstream, signed by the outward
+    # normal as in secondOrderUpwindField
+    np.put_along_axis\
+        (
+            Apn,table.upwind1Apn[upstream][:,:,np.newaxis],float(table.sign),axis=2
+        )
+
+    # flip all non-P coefficients, as for convection they are put on the RHS
+    Apn = Apn * np.array([-1,-1,1,-1,-1])
 
     return Apn
 
+def secondOrderUpwindField(grid,velocity=None,facename="Z"):
+
+    """
+        whole-grid version of secondOrderUpwind
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            velocity  (ndarray)   -(nx+4,ny+4,2) array of cell velocities
+            facename  (string)    -name of face for differencing over (TBLR)
+        returns:
+            Apn       (ndarray)   -(nx,ny,5) array of the Ap coefficients
+    """
+
+    table = lookupFace(grid,facename)
+    if table is None:
+        return
+
+    Apn = np.zeros((grid.nx,grid.ny,5))
+    upstream = upstreamIndex(grid,velocity,table)
+
+    if grid.uniform:
+        # equal widths make the extrapolation weight a constant
+        weight = np.full(upstream.shape,0.5)
+    else:
+        neighbor1Size = np.take_along_axis(table.upwind1Width,upstream[np.newaxis],0)[0]
+        neighbor2Size = np.take_along_axis(table.upwind2Width,upstream[np.newaxis],0)[0]
+        weight = neighbor1Size / (neighbor1Size + neighbor2Size)
+
+    # the sign of the outward normal ensures usage of the conservation principle
+    negative = table.sign
+
+    # set the two Ap coefficients we wish to upstream. With no velocity normal
+    # to the face both neighbors are the same cell, and the second
+    # coefficient overwrites the first just as in secondOrderUpwind
+    np.put_along_axis(
+        Apn,
+        table.upwind1Apn[upstream][:,:,np.newaxis],
+        ((1 + weight) * negative)[:,:,np.newaxis],
+        axis=2
+    )
+    np.put_along_axis(
+        Apn,
+        table.upwind2Apn[upstream][:,:,np.newaxis],
+        (-weight * negative)[:,:,np.newaxis],
+        axis=2
+    )
+
+    # flip all non-P coefficients, as for convection they are put on the RHS
+    Apn = Apn * np.array([-1,-1,1,-1,-1])
+
+    return Apn
+
+def linearField(grid,facename="Z"):
+
+    """
+        whole-grid version of linear
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            facename  (string)    -name of face for differencing over (TBLR)
+        returns:
+            Apn       (ndarray)   -(nx,ny,5) array of the Ap coefficients
+    """
+
+    table = lookupFace(grid,facename)
+    if table is None:
+        return
+
+    Apn = np.zeros((grid.nx,grid.ny,5))
+
+    cellSize = table.ownerWidth
+    neighborSize = table.neighborWidth
+
+    # the sign of the outward normal ensures usage of the conservation principle
+    negative = table.sign
+
+    Apn[:,:,table.neighborApn] = cellSize     / (cellSize + neighborSize) * negative
+    Apn[:,:,2]                 = neighborSize / (cellSize + neighborSize) * negative
+
+    # flip all non-P coefficients, as for convection they are put on the RHS
+    Apn = Apn * np.array([-1,-1,1,-1,-1])
+
+    return Apn
+
+def centralDifferenceField(grid,facename="Z"):
+
+    """
+        whole-grid version of centralDifference
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            facename  (string)    -name of face for differencing over (TBLR)
+        returns:
+            Apn       (ndarray)   -(nx,ny,5) array of the Ap coefficients
+    """
+
+    table = lookupFace(grid,facename)
+    if table is None:
+        return
+
+    Apn = np.zeros((grid.nx,grid.ny,5))
+
+    cellSize = table.ownerWidth
+    neighborSize = table.neighborWidth
+
+    Apn[:,:,table.neighborApn] = 2 * table.area / (cellSize + neighborSize)
+    Apn[:,:,2]                 = 2 * table.area / (cellSize + neighborSize)
+
+    return Apn
+
+#
+# named schemes, so a case can choose its discretization by name and a
+# driver looks each one up once rather than per cell or per iteration
+
+class scheme:
+
+    def __init__(self,name,cellFunction,fieldFunction,upwind,order):
+
+        """
+        one named scheme with its per-cell and whole-grid functions
+
+        inputs:
+            name      (string)    -registry name
+            cellFunction          -per-cell function, such as linear
+            fieldFunction         -its whole-grid version, such as linearField
+            upwind    (bool)      -the functions take the cell velocity
+            order     (int)       -design order of accuracy, checked by
+                                   verification.py
+        """
+
+        self.name = name
+        self.cellFunction = cellFunction
+        self.fieldFunction = fieldFunction
+        self.upwind = upwind
+        self.order = order
+
+    def cellCoefficients(self,i,j,grid,velocity,facename):
+        if self.upwind:
+            return self.cellFunction(i,j,grid,velocity=velocity,facename=facename)
+        return self.cellFunction(i,j,grid,facename=facename)
+
+    def coefficients(self,grid,velocity,facename):
+        if self.upwind:
+            return self.fieldFunction(grid,velocity=velocity,facename=facename)
+        return self.fieldFunction(grid,facename=facename)
+
+registry = {
+    "convection": {
+        "firstOrderUpwind":
+            scheme("firstOrderUpwind",firstOrderUpwind,firstOrderUpwindField,True,1),
+        "secondOrderUpwind":
+            scheme("secondOrderUpwind",secondOrderUpwind,secondOrderUpwindField,True,2),
+        "linear":
+            scheme("linear",linear,linearField,False,2),
+    },
+    "diffusion": {
+        "centralDifference":
+            scheme("centralDifference",centralDifference,centralDifferenceField,False,2),
+    },
+}
+
+def lookup(kind,name):
+
+    """
+        returns the registered scheme of a kind by name, passing through
+        schemes that were already looked up
+
+        inputs:
+            kind      (string)    -"convection" or "diffusion"
+            name      (string)    -name in registry[kind], a scheme or None
+        returns:
+            scheme    (scheme)    -the scheme, None for no term or if unknown
+    """
 
+    if name is None or isinstance(name,scheme):
+        return name
+    if kind not in registry:
+        print("ERROR: Not a kind of scheme: {}".format(kind))
+        return
+    if name not in registry[kind]:
+        print("ERROR: {0} scheme not known: {1}".format(kind,name))
+        return
+    return registry[kind][name]
@@ -0,0 +1,233 @@
+"""
+    incremental assembly of the upwind convection coefficients
+
+    the upwind schemes pick their two upstream cells from the sign of the
+    cell velocity alone, so once the flow has settled the stencil of almost
+    every face stays the same from one iteration to the next. An assembler
+    keeps the scheme coefficients of every face (the stencil without the
+    flux) together with the upstream direction they were built for, and on
+    each assembly
+
+        recomputes the stencil of the faces whose upstream direction flipped
+        multiplies every stencil by the new face flux
+
+    which gives the same coefficients, bit for bit, as a full assembly with
+    kernels.assemble on the numpy backend. The number of faces re-assembled
+    per call is kept in history, and stats holds the totals.
+"""
+
+import time
+import numpy as np
+
+import kernels
+
+# sign of each slot once the scheme coefficients are moved to the RHS
+flip = np.array([-1,-1,1,-1,-1])
+
+class assembler:
+
+    def __init__(self,grid,convection="secondOrderUpwind",kinVisc=0.0,
+                 diffusion=False):
+
+        """
+        incremental convection (and optionally diffusion) assembly on one
+        grid, taking the arguments of kernels.assemble
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            convection(string)    -"firstOrderUpwind" or "secondOrderUpwind"
+            kinVisc   (float)     -kinematic viscosity
+            diffusion (bool)      -add central difference diffusion * kinVisc
+                                   from the operator cache
+        """
+
+        if convection not in ("firstOrderUpwind","secondOrderUpwind"):
+            print("ERROR: incremental assembly needs an upwind scheme: {}".format(convection))
+            return
+
+        self.grid = grid
+        self.convection = convection
+        self.kinVisc = kinVisc
+        self.diffusion = diffusion
+
+        # per face, the upstream direction + 1 and the stencil built for it
+        self.upstream = {}
+        self.stencils = {}
+        self.history = []
+        self.stats = {"calls": 0, "faces": 0, "reassembled": 0, "time": 0.0}
+
+    def reset(self):
+        # forget every stencil, for after the grid geometry changed
+        self.upstream = {}
+        self.stencils = {}
+
+    def stencil(self,table,upstream,I,J):
+
+        """
+        scheme coefficients of some cells of one face, computed as the
+        whole-grid schemes in fvSchemes do
+
+        inputs:
+            table     (faceTable) -face table from grid.faces
+            upstream  (ndarray)   -upstream direction + 1 of the cells
+            I, J      (ndarray)   -non-BC cell indices, counted from 0
+        returns:
+            Apn       (ndarray)   -(cells,5) coefficients
+        """
+
+        Apn = np.zeros((len(upstream),5))
+        cells = np.arange(len(upstream))
+        if self.convection == "firstOrderUpwind":
+            Apn[cells,table.upwind1Apn[upstream]] = float(table.sign)
+            return Apn * flip
+
+        if self.grid.uniform:
+            weight = 0.5
+        else:
+            neighbor1Size = table.upwind1Width[upstream,I,J]
+            neighbor2Size = table.upwind2Width[upstream,I,J]
+            weight = neighbor1Size / (neighbor1Size + neighbor2Size)
+        negative = table.sign
+        # the second coefficient overwrites the first when both are the
+        # same cell, as in fvSchemes
+        Apn[cells,table.upwind1Apn[upstream]] = (1 + weight) * negative
+        Apn[cells,table.upwind2Apn[upstream]] = -weight * negative
+        return Apn * flip
+
+    def update(self,solution,name):
+
+        """
+        brings the stencil of one face up to date with the velocity of the
+        solution, returning how many cells had to be re-assembled
+        """
+
+        import fvSchemes
+
+        table = self.grid.faces[name]
+        upstream = fvSchemes.upstreamIndex(self.grid,solution[:,:,0:2],table)
+
+        if name not in self.stencils:
+            scheme = getattr(fvSchemes,self.convection + "Field")
+            self.stencils[name] = scheme(self.grid,velocity=solution[:,:,0:2],facename=name)
+            self.upstream[name] = upstream
+            return upstream.size
+
+        I, J = np.nonzero(upstream != self.upstream[name])
+        if len(I) > 0:
+            self.stencils[name][I,J] = self.stencil(table,upstream[I,J],I,J)
+            self.upstream[name] = upstream
+        return len(I)
+
+    def assemble(self,solution):
+
+        """
+        coefficients of every non-BC cell for the velocity in solution
+
+        inputs:
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+        returns:
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+        """
+
+        from interpolate import linearField as linInterp
+
+        start = time.perf_counter()
+        grid = self.grid
+        Apx = np.zeros((grid.nx,grid.ny,5))
+        Apy = np.zeros((grid.nx,grid.ny,5))
+
+        d_X, d_Y = grid.cellWidths()
+
+        reassembled = 0
+        for name, Apn, field, width in (("T",Apy,1,d_X),("B",Apy,1,d_X),
+                                        ("L",Apx,0,d_Y),("R",Apx,0,d_Y)):
+            reassembled += self.update(solution,name)
+            flux = (linInterp(grid,solution,neighbor=name,field=field) * width)[:,:,np.newaxis]
+            Apn += flux * self.stencils[name]
+
+        if self.diffusion:
+            import operators
+            constant = operators.shared.diffusion(grid,self.kinVisc)
+            Apx += constant.Apx
+            Apy += constant.Apy
+
+        self.history.append(reassembled)
+        self.stats["calls"] += 1
+        self.stats["faces"] += 4 * grid.ncells
+        self.stats["reassembled"] += reassembled
+        self.stats["time"] += time.perf_counter() - start
+        return Apx, Apy
+
+    @property
+    def last(self):
+        # faces re-assembled by the latest call
+        return self.history[-1] if self.history else 0
+
+def flipCheck(n=256,calls=20,fraction=0.01,seed=0,convection="secondOrderUpwind"):
+
+    """
+        times full and incremental assembly over a run of calls in which a
+        small fraction of the cell velocities flip sign each call, checking
+        the coefficients agree
+
+        returns:
+            results   (dict)      -seconds per call of both, faces
+                                   re-assembled per call and the largest
+                                   coefficient difference
+    """
+
+    import run_CD_test
+
+    rng = np.random.default_rng(seed)
+    grid, solution, bcs = run_CD_test.testCase(n,n)
+    incremental = assembler(grid,convection=convection,kinVisc=0.1,diffusion=True)
+    incremental.assemble(solution)
+
+    full = 0.0
+    partial = 0.0
+    difference = 0.0
+    for call in range(calls):
+        flipped = rng.random((n+4,n+4,2)) < fraction
+        solution[:,:,0:2][flipped] *= -1
+
+        start = time.perf_counter()
+        Apx, Apy = kernels.assemble\
+            (
+                grid,solution,0.1,convection=convection,diffusion=True,
+                backend="numpy"
+            )
+        full += time.perf_counter() - start
+
+        start = time.perf_counter()
+        incrementalApx, incrementalApy = incremental.assemble(solution)
+        partial += time.perf_counter() - start
+
+        difference = max\
+            (
+                difference,
+                np.abs(Apx - incrementalApx).max(),
+                np.abs(Apy - incrementalApy).max()
+            )
+
+    return {
+        "full": full / calls,
+        "incremental": partial / calls,
+        "reassembled": incremental.history[1:],
+        "difference": float(difference),
+    }
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    for fraction in (0.0,0.001,0.01,0.1):
+        results = flipCheck(n,fraction=fraction)
+        print\
+            (
+                "flipping {0:>5.1%}: full {1:.4f}s  incremental {2:.4f}s  "
+                "faces re-assembled {3:>7.0f} of {4}  max difference {5:.1e}".format
+                    (
+                        fraction,results["full"],results["incremental"],
+                        np.mean(results["reassembled"]),4*n*n,results["difference"]
+                    )
+            )
@@ -0,0 +1,382 @@
+"""
+    logging and timing for the solvers and drivers
+
+    logging goes through the standard logging module under one logger,
+    which stays at WARNING unless setLevel is called, so the per-cell
+    debug output of fvSchemes and run_CD_test costs one level check when
+    it is off.
+
+    timers accumulate the wall time spent in named phases of a run
+    (assembly, BC application, smoothing, residual, output) together with
+    the number of cells each phase processed, and report a run summary as
+    text or JSON that can be compared across releases.
+
+    profiled wraps a run in either cProfile, deterministic but slowing
+    every Python call, or a sampler that records the main thread's stack
+    at a fixed interval from a background thread, and writes the profile
+    to a directory.
+"""
+
+import cProfile
+import collections
+import io
+import json
+import logging
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("FV_laminar_NS")
+logger.addHandler(logging.NullHandler())
+logger.setLevel(logging.WARNING)
+
+# phases timed by the drivers, in report order
+phases = ("assembly", "boundary", "smoothing", "residual", "output")
+
+levels = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "off": logging.CRITICAL + 1,
+}
+
+def setLevel(level="info",stream=None):
+
+    """
+        sets the logging level and, the first time, attaches a handler
+        writing plain messages to stream (stderr by default)
+
+        inputs:
+            level     (string)    -"debug", "info", "warning", "error" or "off"
+            stream                -optional file-like object for the messages
+    """
+
+    if level not in levels:
+        print("ERROR: Not a logging level: {}".format(level))
+        return
+    logger.setLevel(levels[level])
+
+    if not any(isinstance(h,logging.StreamHandler) for h in logger.handlers):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+def debugEnabled():
+    # guard for debug messages that are expensive to format
+    return logger.isEnabledFor(logging.DEBUG)
+
+class timers:
+
+    def __init__(self,enabled=True):
+
+        """
+        accumulated wall time and cell counts per named phase
+
+        inputs:
+            enabled   (bool)      -False makes every method a no-op
+        """
+
+        self.enabled = enabled
+        self.totals = {}
+        self.calls = {}
+        self.cells = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+
+    def add(self,name,seconds,cells=0):
+
+        """
+        records one timed call of a phase
+
+        inputs:
+            name      (string)    -phase name
+            seconds   (float)     -wall time of the call
+            cells     (int)       -cells processed by the call
+        """
+
+        if not self.enabled:
+            return
+        self.totals[name] = self.totals.get(name,0.0) + seconds
+        self.calls[name] = self.calls.get(name,0) + 1
+        self.cells[name] = self.cells.get(name,0) + cells
+
+    @contextmanager
+    def phase(self,name,cells=0):
+
+        """
+        times the enclosed block as one call of a phase
+
+            with timer.phase("assembly",cells=grid.ncells):
+                Apx, Apy = assemble(...)
+        """
+
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name,time.perf_counter() - start,cells)
+
+    def timed(self,name,function,cells=0):
+
+        """
+        wraps a callable, such as a boundary updater handed to a smoother,
+        so every call is counted towards a phase
+        """
+
+        if not self.enabled or function is None:
+            return function
+
+        def wrapper(*args,**kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                self.add(name,time.perf_counter() - start,cells)
+
+        return wrapper
+
+    def count(self,name,amount=1):
+        # free-standing counters, e.g. iterations or linear solver steps
+        if self.enabled:
+            self.counters[name] = self.counters.get(name,0) + amount
+
+    def summary(self,**metadata):
+
+        """
+        returns the run summary as a dictionary
+
+        inputs:
+            metadata              -extra entries stored under "run", such as
+                                   the grid size or solver name
+        returns:
+            summary   (dict)      -run metadata, wall time, counters and per
+                                   phase seconds, calls, cells and cells/s
+        """
+
+        wallTime = time.perf_counter() - self.start
+        named = [p for p in phases if p in self.totals]
+        named += sorted(p for p in self.totals if p not in phases)
+
+        report = {}
+        for name in named:
+            seconds = self.totals[name]
+            report[name] = {
+                "seconds": seconds,
+                "calls": self.calls[name],
+                "cells": self.cells[name],
+                "cellsPerSecond": self.cells[name] / seconds if seconds > 0 else 0.0,
+                "fraction": seconds / wallTime if wallTime > 0 else 0.0,
+            }
+
+        run = {"python": platform.python_version(), "time": time.time()}
+        run.update(metadata)
+
+        return {
+            "run": run,
+            "wallTime": wallTime,
+            "counters": dict(self.counters),
+            "phases": report,
+        }
+
+    def report(self,**metadata):
+
+        """
+        returns the run summary as a text table
+        """
+
+        summary = self.summary(**metadata)
+        lines = ["wall time {0:.4f}s".format(summary["wallTime"])]
+        for key, value in summary["run"].items():
+            if key not in ("python","time"):
+                lines.append("{0}: {1}".format(key,value))
+        for key, value in summary["counters"].items():
+            lines.append("{0}: {1}".format(key,value))
+        lines.append\
+            (
+                "{0:<12}{1:>10}{2:>8}{3:>8}{4:>14}".format
+                    ("phase","seconds","calls","%","cells/s")
+            )
+        for name, entry in summary["phases"].items():
+            # phases that do not process cells, like output, have no rate
+            rate = "{0:.4g}".format(entry["cellsPerSecond"]) if entry["cells"] else "-"
+            lines.append\
+                (
+                    "{0:<12}{1:>10.4f}{2:>8}{3:>8.1f}{4:>14}".format
+                        (
+                            name,entry["seconds"],entry["calls"],
+                            100*entry["fraction"],rate
+                        )
+                )
+        return "\n".join(lines)
+
+    def write(self,filename,**metadata):
+
+        """
+        writes the run summary to a JSON file
+
+        inputs:
+            filename  (string)    -path of the JSON file
+            metadata              -extra entries stored under "run"
+        """
+
+        with open(filename,"w") as f:
+            json.dump(self.summary(**metadata),f,indent=2)
+
+profilers = ("cProfile", "sampling")
+
+class sampler:
+
+    def __init__(self,interval=0.005,thread=None):
+
+        """
+        statistical profiler counting the stacks of one thread
+
+        inputs:
+            interval  (float)     -seconds between samples
+            thread    (int)       -ident of the sampled thread, the calling
+                                   thread when None
+        """
+
+        self.interval = interval
+        self.thread = threading.get_ident() if thread is None else thread
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.running = False
+        self.worker = None
+
+    def start(self):
+        self.running = True
+        self.worker = threading.Thread(target=self.sample,daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.running = False
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def sample(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append\
+                    (
+                        "{0}:{1}".format(os.path.basename(code.co_filename),code.co_name)
+                    )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def functions(self):
+
+        """
+        returns the samples per function
+
+        returns:
+            own       (Counter)   -samples with the function on top of the stack
+            total     (Counter)   -samples with the function anywhere on it
+        """
+
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            names = stack.split(";")
+            own[names[-1]] += count
+            for name in set(names):
+                total[name] += count
+        return own, total
+
+    def write(self,prefix,lines=30):
+
+        """
+        writes the collapsed stacks to prefix.folded, one "a;b;c count" line
+        per stack as read by flame graph tools, and the functions with the
+        most samples to prefix.txt
+        """
+
+        with open(prefix + ".folded","w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{0} {1}\n".format(stack,count))
+
+        own, total = self.functions()
+        samples = max(self.samples,1)
+        with open(prefix + ".txt","w") as f:
+            f.write\
+                (
+                    "{0} samples every {1:g}s\n{2:>8}{3:>8}  function\n".format
+                        (self.samples,self.interval,"own %","total %")
+                )
+            for name, count in total.most_common(lines):
+                f.write\
+                    (
+                        "{0:>8.1f}{1:>8.1f}  {2}\n".format
+                            (
+                                100*own[name]/samples,100*count/samples,name
+                            )
+                    )
+
+@contextmanager
+def profiled(kind,directory=".",prefix="profile",interval=0.005,lines=30):
+
+    """
+        profiles the enclosed block, writing the profile to directory on
+        exit
+
+            with profiled("cProfile","results"):
+                main()
+
+        cProfile writes prefix.prof, readable with pstats or snakeviz, and
+        the functions of largest cumulative time to prefix.txt. sampling
+        writes prefix.folded and prefix.txt, see sampler.write.
+
+        inputs:
+            kind      (string)    -one of profilers, None does not profile
+            directory (string)    -directory of the profile files
+            prefix    (string)    -file name prefix
+            interval  (float)     -seconds between samples of sampling
+            lines     (int)       -functions listed in prefix.txt
+    """
+
+    if kind is None:
+        yield
+        return
+    if kind not in profilers:
+        print("ERROR: Not a profiler: {}".format(kind))
+        yield
+        return
+
+    filename = os.path.join(directory,prefix)
+    if kind == "cProfile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(filename + ".prof")
+            text = io.StringIO()
+            pstats.Stats(profile,stream=text).sort_stats("cumulative").print_stats(lines)
+            with open(filename + ".txt","w") as f:
+                f.write(text.getvalue())
+            logger.info("profile written to {}.prof".format(filename))
+    else:
+        profile = sampler(interval)
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            profile.write(filename,lines)
+            logger.info("profile written to {}.folded".format(filename))
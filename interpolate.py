@@ -52,4 +52,43 @@ def linear(i, j, grid, sol, neighbor="Z", field=99):
                 sol[i,j,field] * neighborw + \
                 sol[neighbori,neighborj,field] * width \
             ) / (neighborw + width)
-    return value
\ No newline at end of file
+    return value
+
+def linearField(grid, sol, neighbor="Z", field=99):
+
+    """
+    whole-grid version of linear, interpolating onto the chosen face of
+    every non-BC cell at once
+
+    inputs:
+        grid      (Grid)      -grid object from Grid.py
+        sol       (ndarray)   -numpy array with solution data [x,y,field]
+        neighbor  (string)    -name of face to interpolate over (TBLR)
+        field     (int)       -field from solution to interpolate
+
+    returns:
+        value     (ndarray)   -(nx,ny) array of interpolated face values
+    """
+
+    #the face tables hold the cell and neighbor distances across the face
+    if neighbor not in grid.faces:
+        print("ERROR: interpolation neighbor not understood: {}".format(neighbor))
+        return 0
+    table = grid.faces[neighbor]
+
+    if field > 2 or field < 0:
+        print("ERROR: field not known: {}".format(field))
+        return 0
+
+    if grid.uniform:
+        #equal widths weight both cells by a half
+        return 0.5 * (grid.interior(sol[:,:,field]) + grid.interior(sol[:,:,field],*table.normal))
+
+    neighborw = table.neighborWidth
+    width = table.ownerWidth
+
+    value = (
+                grid.interior(sol[:,:,field]) * neighborw + \
+                grid.interior(sol[:,:,field],*table.normal) * width \
+            ) / (neighborw + width)
+    return value
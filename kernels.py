@@ -0,0 +1,570 @@
+"""
+    numba compiled kernels for the coefficient assembly of run_CD_test, the
+    Gauss-Seidel updates and the residual norms, with the numpy
+    implementations as fallback
+
+    the backend is chosen at run time with the backend argument, "numpy"
+    or "numba". When numba is not installed "numba" falls back to numpy.
+    Kernels are compiled on first use and cached to disk in __pycache__,
+    so later runs skip the compilation.
+
+    run this file to check the compiled kernels against the reference
+    implementations:
+        python kernels.py
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+available = numba is not None
+backends = ("numpy", "numba")
+
+if available:
+    prange = numba.prange
+
+    def jit(parallel=False):
+        return numba.njit(cache=True,parallel=parallel)
+else:
+    prange = range
+
+    def jit(parallel=False):
+        return lambda function: function
+
+# convection schemes understood by assembleKernel
+NOCONVECTION = 0
+FIRSTORDERUPWIND = 1
+SECONDORDERUPWIND = 2
+
+convectionSchemes = {
+    None: NOCONVECTION,
+    "firstOrderUpwind": FIRSTORDERUPWIND,
+    "secondOrderUpwind": SECONDORDERUPWIND,
+}
+
+def useNumba(backend):
+
+    """
+        returns True if the numba kernels should run for this backend,
+        warning once when numba was asked for but is not installed
+    """
+
+    if backend not in backends:
+        print("ERROR: backend not known: {}".format(backend))
+        return False
+    if backend == "numba" and not available:
+        if not useNumba.warned:
+            print("WARNING: numba is not installed, using the numpy backend")
+            useNumba.warned = True
+        return False
+    return backend == "numba"
+
+useNumba.warned = False
+
+@jit(parallel=True)
+def assembleKernel(geometry,velocity,scheme,Apx,Apy):
+
+    """
+        fills Apx and Apy for every non-BC cell with the convection scheme
+        weighted by the linearly interpolated face flux. Faces are added in
+        the order T, B, L, R, matching run_CD_test.assemble. Diffusion is
+        added from the operator cache by assemble.
+
+        inputs:
+            geometry  (ndarray)   -fields.planar(grid.val), [quantity,x,y]
+            velocity  (ndarray)   -fields.planar of the solution, [field,x,y]
+            scheme    (int)       -NOCONVECTION, FIRSTORDERUPWIND or SECONDORDERUPWIND
+            Apx       (ndarray)   -(nx,ny,5) output, ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) output, ordered BB B P T TT
+    """
+
+    nx = geometry.shape[1] - 4
+    ny = geometry.shape[2] - 4
+
+    for ii in prange(nx):
+        i = ii + 2
+        for j in range(2,ny+2):
+            for f in range(5):
+                Apx[ii,j-2,f] = 0.0
+                Apy[ii,j-2,f] = 0.0
+
+            # faces T B L R as (normal axis, outward sign)
+            for face in range(4):
+                if face < 2:
+                    axis = 1
+                else:
+                    axis = 0
+                if face == 0 or face == 3:
+                    negative = 1
+                else:
+                    negative = -1
+
+                di = negative if axis == 0 else 0
+                dj = negative if axis == 1 else 0
+
+                # widths across the face and along it
+                width = geometry[2+axis,i,j]
+                neighborWidth = geometry[2+axis,i+di,j+dj]
+                area = geometry[3-axis,i,j]
+
+                # velocity * area through the face from interpolate.linear
+                faceVelocity = \
+                    (
+                        velocity[axis,i,j] * neighborWidth + \
+                        velocity[axis,i+di,j+dj] * width
+                    ) / (neighborWidth + width)
+                flux = faceVelocity * area
+
+                if scheme != NOCONVECTION:
+                    # upstream direction from the cell velocity, as in Face.face
+                    cellVelocity = velocity[axis,i,j]
+                    if cellVelocity > 0:
+                        upstream = -1
+                    elif cellVelocity < 0:
+                        upstream = 1
+                    else:
+                        upstream = 0
+                    offset1 = int(np.floor(0.5 * negative + 0.5 * upstream))
+                    offset2 = offset1 + upstream
+
+                    # the only non-zero coefficients are at the two
+                    # upwind slots, the second overwriting the first when
+                    # they are the same cell
+                    if scheme == FIRSTORDERUPWIND:
+                        coefficient1 = 1.0 * negative
+                        coefficient2 = 0.0
+                        offset2 = 3
+                    else:
+                        size1 = geometry[2+axis,i+offset1*(1-axis),j+offset1*axis]
+                        size2 = geometry[2+axis,i+offset2*(1-axis),j+offset2*axis]
+                        coefficient1 = (1 + size1 / (size1 + size2)) * negative
+                        coefficient2 = (-size1 / (size1 + size2)) * negative
+                    # flip all non-P coefficients onto the RHS
+                    if offset1 != 0:
+                        coefficient1 = coefficient1 * -1
+                    if offset2 != 0:
+                        coefficient2 = coefficient2 * -1
+
+                    if offset1 != offset2:
+                        if axis == 0:
+                            Apx[ii,j-2,2+offset1] += flux * coefficient1
+                        else:
+                            Apy[ii,j-2,2+offset1] += flux * coefficient1
+                    if -2 <= offset2 <= 2:
+                        if axis == 0:
+                            Apx[ii,j-2,2+offset2] += flux * coefficient2
+                        else:
+                            Apy[ii,j-2,2+offset2] += flux * coefficient2
+
+@jit()
+def gaussSeidelKernel(Apx,Apy,phi,source,relaxation):
+
+    """
+        lexicographic point Gauss-Seidel sweep with under-relaxation, the
+        update of the GS loop in run_CD_test.main
+    """
+
+    nx = Apx.shape[0]
+    ny = Apx.shape[1]
+    for i in range(2,nx+2):
+        for j in range(2,ny+2):
+            A_P = Apy[i-2,j-2,2] + Apx[i-2,j-2,2]
+            value = \
+                (
+                    Apx[i-2,j-2,0] * phi[i-2,j] + \
+                    Apx[i-2,j-2,1] * phi[i-1,j] + \
+                    Apx[i-2,j-2,3] * phi[i+1,j] + \
+                    Apx[i-2,j-2,4] * phi[i+2,j] + \
+                    Apy[i-2,j-2,4] * phi[i,j+2] + \
+                    Apy[i-2,j-2,3] * phi[i,j+1] + \
+                    Apy[i-2,j-2,1] * phi[i,j-1] + \
+                    Apy[i-2,j-2,0] * phi[i,j-2] + \
+                    source[i-2,j-2]
+                ) / A_P
+            phi[i,j] = phi[i,j] * (1 - relaxation) + relaxation * value
+
+@jit(parallel=True)
+def colorKernel(Apx,Apy,phi,source,relaxation,ncolors,color):
+
+    """
+        updates the cells with (i+j) % ncolors == color, in the same
+        operation order as smoothers.multicolorGaussSeidel
+    """
+
+    nx = Apx.shape[0]
+    ny = Apx.shape[1]
+    for ii in prange(nx):
+        i = ii + 2
+        for jj in range((color - ii) % ncolors,ny,ncolors):
+            j = jj + 2
+            total = 0.0
+            total += Apx[ii,jj,0] * phi[i-2,j]
+            total += Apx[ii,jj,1] * phi[i-1,j]
+            total += Apx[ii,jj,3] * phi[i+1,j]
+            total += Apx[ii,jj,4] * phi[i+2,j]
+            total += Apy[ii,jj,0] * phi[i,j-2]
+            total += Apy[ii,jj,1] * phi[i,j-1]
+            total += Apy[ii,jj,3] * phi[i,j+1]
+            total += Apy[ii,jj,4] * phi[i,j+2]
+            total += source[ii,jj]
+            A_P = Apx[ii,jj,2] + Apy[ii,jj,2]
+            phi[i,j] = phi[i,j] * (1 - relaxation) + relaxation * total / A_P
+
+@jit(parallel=True)
+def residualKernel(Apx,Apy,phi,source,rows):
+
+    """
+        one pass over the equation residual
+            r = sum(An*phi_n) + source - Ap*phi_p
+        of every non-BC cell, storing per x row the sum of |r|, the sum of
+        r^2, the largest |r| and the sum of |Ap*phi_p| in rows
+    """
+
+    nx = Apx.shape[0]
+    ny = Apx.shape[1]
+    for ii in prange(nx):
+        i = ii + 2
+        sumAbs = 0.0
+        sumSquares = 0.0
+        largest = 0.0
+        scale = 0.0
+        for jj in range(ny):
+            j = jj + 2
+            total = 0.0
+            total += Apx[ii,jj,0] * phi[i-2,j]
+            total += Apx[ii,jj,1] * phi[i-1,j]
+            total += Apx[ii,jj,3] * phi[i+1,j]
+            total += Apx[ii,jj,4] * phi[i+2,j]
+            total += Apy[ii,jj,0] * phi[i,j-2]
+            total += Apy[ii,jj,1] * phi[i,j-1]
+            total += Apy[ii,jj,3] * phi[i,j+1]
+            total += Apy[ii,jj,4] * phi[i,j+2]
+            total += source[ii,jj]
+            diagonal = (Apx[ii,jj,2] + Apy[ii,jj,2]) * phi[i,j]
+            r = abs(total - diagonal)
+            sumAbs += r
+            sumSquares += r * r
+            if r > largest:
+                largest = r
+            scale += abs(diagonal)
+        rows[ii,0] = sumAbs
+        rows[ii,1] = sumSquares
+        rows[ii,2] = largest
+        rows[ii,3] = scale
+
+def assemble(grid,solution,kinVisc=0.0,convection="secondOrderUpwind",
+             diffusion=False,backend="numba"):
+
+    """
+        whole-grid assembly of convection (and optionally diffusion)
+        coefficients with the chosen backend
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            kinVisc   (float)     -kinematic viscosity
+            convection(string)    -"firstOrderUpwind", "secondOrderUpwind" or None
+            diffusion (bool)      -add central difference diffusion * kinVisc
+            backend   (string)    -"numba" or "numpy"
+        returns:
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+    """
+
+    if convection not in convectionSchemes:
+        print("ERROR: convection scheme not known: {}".format(convection))
+        return
+
+    if useNumba(backend):
+        from fields import planar
+        Apx = np.empty((grid.nx,grid.ny,5))
+        Apy = np.empty((grid.nx,grid.ny,5))
+        # the kernel reads [field,x,y] planes, contiguous when the solution
+        # and grid are stored as in fields.py
+        assembleKernel\
+            (
+                planar(grid.val),planar(solution[:,:,0:2]),
+                convectionSchemes[convection],
+                Apx,Apy
+            )
+    else:
+        Apx, Apy = assembleConvection(grid,solution,convection)
+
+    # diffusion only depends on the geometry and kinVisc, so it is built
+    # once and added to the freshly assembled convection
+    if diffusion:
+        import operators
+        constant = operators.shared.diffusion(grid,kinVisc)
+        Apx += constant.Apx
+        Apy += constant.Apy
+
+    return Apx, Apy
+
+def assembleConvection(grid,solution,convection):
+
+    """
+        numpy assembly of the convection coefficients alone, the fallback
+        of assemble
+    """
+
+    from interpolate import linearField as linInterp
+    import fvSchemes
+
+    Apx = np.zeros((grid.nx,grid.ny,5))
+    Apy = np.zeros((grid.nx,grid.ny,5))
+
+    if convection is not None:
+        scheme = getattr(fvSchemes,convection + "Field")
+        velocity = solution[:,:,0:2]
+        d_X, d_Y = grid.cellWidths()
+        Ft = (linInterp(grid,solution,neighbor="T",field=1) * d_X)[:,:,np.newaxis]
+        Fb = (linInterp(grid,solution,neighbor="B",field=1) * d_X)[:,:,np.newaxis]
+        Fl = (linInterp(grid,solution,neighbor="L",field=0) * d_Y)[:,:,np.newaxis]
+        Fr = (linInterp(grid,solution,neighbor="R",field=0) * d_Y)[:,:,np.newaxis]
+        Apy += Ft * scheme(grid,velocity=velocity,facename="T")
+        Apy += Fb * scheme(grid,velocity=velocity,facename="B")
+        Apx += Fl * scheme(grid,velocity=velocity,facename="L")
+        Apx += Fr * scheme(grid,velocity=velocity,facename="R")
+
+    return Apx, Apy
+
+def gaussSeidel(grid,Apx,Apy,phi,relaxation=1.0,source=None,backend="numba"):
+
+    """
+        one lexicographic point Gauss-Seidel sweep over a padded phi array
+        in place, identical to the loop in run_CD_test.main
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field, updated in place
+            relaxation(float)     -under-relaxation factor
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            backend   (string)    -"numba" or "numpy"
+    """
+
+    if useNumba(backend):
+        if source is None:
+            source = np.zeros((grid.nx,grid.ny))
+        # the kernel needs a contiguous array, so work on a copy if needed
+        work = np.ascontiguousarray(phi)
+        gaussSeidelKernel(Apx,Apy,work,source,relaxation)
+        if work is not phi:
+            phi[:] = work
+        return
+
+    for i in range(2,grid.nx+2):
+        for j in range(2,grid.ny+2):
+            A_P = Apy[i-2,j-2,2] + Apx[i-2,j-2,2]
+            value = \
+                (
+                    Apx[i-2,j-2,0] * phi[i-2,j] + \
+                    Apx[i-2,j-2,1] * phi[i-1,j] + \
+                    Apx[i-2,j-2,3] * phi[i+1,j] + \
+                    Apx[i-2,j-2,4] * phi[i+2,j] + \
+                    Apy[i-2,j-2,4] * phi[i,j+2] + \
+                    Apy[i-2,j-2,3] * phi[i,j+1] + \
+                    Apy[i-2,j-2,1] * phi[i,j-1] + \
+                    Apy[i-2,j-2,0] * phi[i,j-2]
+                )
+            if source is not None:
+                value += source[i-2,j-2]
+            value /= A_P
+            phi[i,j] = phi[i,j] * (1 - relaxation) + relaxation * value
+
+def multicolorGaussSeidel(grid,Apx,Apy,phi,relaxation=1.0,source=None,
+                          boundary=None,sweeps=1,backend="numba"):
+
+    """
+        smoothers.multicolorGaussSeidel with the chosen backend, taking the
+        same arguments
+    """
+
+    import smoothers
+
+    if not useNumba(backend):
+        smoothers.multicolorGaussSeidel\
+            (
+                grid,Apx,Apy,phi,relaxation=relaxation,source=source,
+                boundary=boundary,sweeps=sweeps
+            )
+        return
+
+    ncolors = smoothers.stencilReach(Apx,Apy) + 1
+    if source is None:
+        source = np.zeros((grid.nx,grid.ny))
+
+    work = np.ascontiguousarray(phi)
+    for sweep in range(sweeps):
+        for color in range(ncolors):
+            colorKernel(Apx,Apy,work,source,relaxation,ncolors,color)
+            if boundary is not None:
+                if work is not phi:
+                    phi[:] = work
+                boundary()
+                if work is not phi:
+                    work[:] = phi
+    if work is not phi:
+        phi[:] = work
+
+def residualNorms(grid,Apx,Apy,phi,source=None,work=None,backend="numba"):
+
+    """
+        convergence.residualNorms with the chosen backend, taking the same
+        arguments. The numba kernel needs no work arrays.
+    """
+
+    import convergence
+
+    if not useNumba(backend):
+        return convergence.residualNorms\
+            (
+                grid,Apx,Apy,phi,source=source,work=work
+            )
+
+    if source is None:
+        source = np.zeros((grid.nx,grid.ny))
+    rows = np.empty((grid.nx,4))
+    residualKernel(Apx,Apy,phi,source,rows)
+    return \
+        (
+            rows[:,0].sum(),
+            np.sqrt(rows[:,1].sum()),
+            rows[:,2].max(),
+            rows[:,3].sum()
+        )
+
+# largest difference between the backends checkParity accepts
+parityTolerance = 1e-12
+
+def checkParity(nx=17,ny=17,seed=0):
+
+    """
+        compares every numba kernel with its reference implementation on a
+        random non-uniform grid and velocity field, including cells with
+        zero velocity, and returns the largest differences found
+    """
+
+    import Grid
+    import fvSchemes
+    import smoothers
+
+    rng = np.random.default_rng(seed)
+    grid = Grid.grid(nx,ny)
+    grid.val[:,:,2:4] *= rng.uniform(0.5,1.5,size=grid.val[:,:,2:4].shape)
+    grid.buildFaceTables()
+
+    solution = rng.uniform(-1,1,(nx+4,ny+4,3))
+    solution[:,:,0:2][rng.random((nx+4,ny+4,2)) < 0.1] = 0.0
+    kinVisc = 0.05
+
+    differences = {}
+
+    # assembly against the per-cell reference in run_CD_test.solve
+    Apx, Apy = assemble(grid,solution,kinVisc,backend="numba")
+    reference = np.zeros((nx,ny,2,5))
+    for i in range(2,nx+2):
+        for j in range(2,ny+2):
+            reference[i-2,j-2] = referenceCoefficients(i,j,grid,solution)
+    differences["assemble SOU"] = max\
+        (
+            np.abs(Apx - reference[:,:,0]).max(),
+            np.abs(Apy - reference[:,:,1]).max()
+        )
+
+    for convection in ("firstOrderUpwind","secondOrderUpwind",None):
+        numbaApx, numbaApy = assemble\
+            (
+                grid,solution,kinVisc,convection=convection,diffusion=True,
+                backend="numba"
+            )
+        numpyApx, numpyApy = assemble\
+            (
+                grid,solution,kinVisc,convection=convection,diffusion=True,
+                backend="numpy"
+            )
+        differences["assemble {} + diffusion".format(convection)] = max\
+            (
+                np.abs(numbaApx - numpyApx).max(),
+                np.abs(numbaApy - numpyApy).max()
+            )
+
+    # smoother updates on a diagonally dominant system
+    Apx, Apy = assemble\
+        (
+            grid,solution,1.0,convection="secondOrderUpwind",diffusion=True,
+            backend="numpy"
+        )
+    Apx[:,:,2] += np.abs(Apx).sum(axis=2) + np.abs(Apy).sum(axis=2)
+    phi = rng.uniform(0,1,(nx+4,ny+4))
+
+    numbaPhi = phi.copy()
+    numpyPhi = phi.copy()
+    gaussSeidel(grid,Apx,Apy,numbaPhi,relaxation=0.9,backend="numba")
+    gaussSeidel(grid,Apx,Apy,numpyPhi,relaxation=0.9,backend="numpy")
+    differences["gaussSeidel"] = np.abs(numbaPhi - numpyPhi).max()
+
+    source = rng.uniform(0,1,(nx,ny))
+    gaussSeidel(grid,Apx,Apy,numbaPhi,relaxation=0.9,source=source,backend="numba")
+    gaussSeidel(grid,Apx,Apy,numpyPhi,relaxation=0.9,source=source,backend="numpy")
+    differences["gaussSeidel + source"] = np.abs(numbaPhi - numpyPhi).max()
+
+    numbaPhi = phi.copy()
+    numpyPhi = phi.copy()
+    source = rng.uniform(0,1,(nx,ny))
+    multicolorGaussSeidel(grid,Apx,Apy,numbaPhi,0.9,source,sweeps=3,backend="numba")
+    smoothers.multicolorGaussSeidel(grid,Apx,Apy,numpyPhi,0.9,source,sweeps=3)
+    differences["multicolorGaussSeidel"] = np.abs(numbaPhi - numpyPhi).max()
+
+    # reductions sum in a different order, so compare relative differences
+    numbaNorms = residualNorms(grid,Apx,Apy,phi,source,backend="numba")
+    numpyNorms = residualNorms(grid,Apx,Apy,phi,source,backend="numpy")
+    differences["residualNorms (relative)"] = max\
+        (
+            abs(a - b) / abs(b) for a, b in zip(numbaNorms,numpyNorms)
+        )
+
+    return differences
+
+def referenceCoefficients(i,j,grid,solution):
+    # per-cell SOU convection plus CD diffusion built like run_CD_test.solve
+    import fvSchemes
+    from interpolate import linear as linInterp
+
+    Apx = np.zeros(5)
+    Apy = np.zeros(5)
+    d_X = grid.width(i,j,'x')
+    d_Y = grid.width(i,j,'y')
+    velocity = solution[i,j,0:2]
+    Apy += linInterp(i,j,grid,solution,neighbor="T",field=1) * d_X * \
+        fvSchemes.secondOrderUpwind(i,j,grid,velocity=velocity,facename="T")
+    Apy += linInterp(i,j,grid,solution,neighbor="B",field=1) * d_X * \
+        fvSchemes.secondOrderUpwind(i,j,grid,velocity=velocity,facename="B")
+    Apx += linInterp(i,j,grid,solution,neighbor="L",field=0) * d_Y * \
+        fvSchemes.secondOrderUpwind(i,j,grid,velocity=velocity,facename="L")
+    Apx += linInterp(i,j,grid,solution,neighbor="R",field=0) * d_Y * \
+        fvSchemes.secondOrderUpwind(i,j,grid,velocity=velocity,facename="R")
+    return np.stack((Apx,Apy))
+
+if __name__ == "__main__":
+    if not available:
+        print("numba is not installed, only the numpy backend is in use")
+    import sys
+    failed = []
+    for name, difference in checkParity().items():
+        # written so that a NaN difference fails as well
+        passed = difference <= parityTolerance
+        print\
+            (
+                "{0:40s} max difference {1:.3e}{2}".format
+                    (name,difference,"" if passed else "  FAILED")
+            )
+        if not passed:
+            failed.append(name)
+    if failed:
+        print("ERROR: {0} kernels differ by more than {1:g}".format(len(failed),parityTolerance))
+        sys.exit(1)
@@ -0,0 +1,386 @@
+"""
+    assembles the Ap coefficients from fvSchemes into a sparse matrix and
+    solves it with a direct or Krylov method, as an alternative to the
+    point Gauss-Seidel loop in run_CD_test
+
+    unknowns are the non-BC cells, numbered in the same order as
+    solution[2:-2,2:-2,field].ravel(). Coefficients reaching into the two
+    ghost layers are moved to the right hand side using the ghost values
+    currently stored in the solution array, unless a Boundary.boundaries
+    set is given, in which case ghost cells tied to non-BC cells (zero
+    gradient, periodic) are folded into the matrix.
+"""
+
+import time
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as spla
+
+# (di,dj) shift of each Apx and Apy slot, ordered LL L P R RR and BB B P T TT
+stencilShifts = (
+    ("x", 0, (-2,0)),
+    ("x", 1, (-1,0)),
+    ("x", 3, (1,0)),
+    ("x", 4, (2,0)),
+    ("y", 0, (0,-2)),
+    ("y", 1, (0,-1)),
+    ("y", 3, (0,1)),
+    ("y", 4, (0,2)),
+)
+
+methods = ("lu", "bicgstab", "gmres")
+
+def cellNumbers(grid):
+
+    """
+        returns the unknown number of every cell in the padded grid,
+        -1 for the ghost and boundary cells
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+        returns:
+            number    (ndarray)   -(nx+4,ny+4) int array
+    """
+
+    number = np.full((grid.nx+4,grid.ny+4),-1,dtype=int)
+    grid.interior(number)[:] = np.arange(grid.ncells).reshape(grid.nx,grid.ny)
+    return number
+
+def assembleMatrix(grid,Apx,Apy,solution,field=2,source=None,boundary=None):
+
+    """
+        builds the sparse system A*phi = b for the non-BC cells from the
+        discrete equation Ap*phi_p = sum(An*phi_n) + source
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            field     (int)       -field from solution being solved for
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (boundaries)-optional Boundary.boundaries to fold in
+        returns:
+            A         (csr_matrix)-ncells x ncells matrix
+            b         (ndarray)   -ncells right hand side
+    """
+
+    number = cellNumbers(grid)
+    rows = np.arange(grid.ncells)
+
+    if boundary is not None:
+        ghostSource = boundary.ghostMap(field)[0].ravel()
+
+    rowList = [rows]
+    colList = [rows]
+    valList = [(Apx[:,:,2] + Apy[:,:,2]).ravel()]
+
+    for direction, slot, (di,dj) in stencilShifts:
+        if direction == "x":
+            coefficient = Apx[:,:,slot].ravel()
+        else:
+            coefficient = Apy[:,:,slot].ravel()
+        if not coefficient.any():
+            continue
+
+        neighbor = grid.interior(number,di,dj).ravel()
+        inside = neighbor >= 0
+
+        # neighbors coefficients are on the RHS, so reverse them for A
+        rowList.append(rows[inside])
+        colList.append(neighbor[inside])
+        valList.append(-coefficient[inside])
+
+        if boundary is not None:
+            # phi_ghost = phi[ghostSource] + ghostConstant, the tied part
+            # belongs to A and the rest to b
+            outside = ~inside
+            ghost = grid.interior(grid.index,di,dj).ravel()[outside]
+            tied = ghostSource[ghost]
+            folded = tied >= 0
+            rowList.append(rows[outside][folded])
+            colList.append(number.ravel()[tied[folded]])
+            valList.append(-coefficient[outside][folded])
+
+    A = sparse.coo_matrix(
+        (np.concatenate(valList),(np.concatenate(rowList),np.concatenate(colList))),
+        shape=(grid.ncells,grid.ncells)
+    ).tocsr()
+    A.eliminate_zeros()
+
+    b = rightHandSide\
+        (
+            grid,Apx,Apy,solution,field=field,source=source,boundary=boundary
+        )
+
+    return A, b
+
+def rightHandSide(grid,Apx,Apy,solution,field=2,source=None,boundary=None):
+
+    """
+        builds the right hand side b of assembleMatrix on its own, so a
+        matrix whose coefficients have not changed can be reused with new
+        ghost values and sources
+
+        inputs:
+            as assembleMatrix
+        returns:
+            b         (ndarray)   -ncells right hand side
+    """
+
+    number = cellNumbers(grid)
+    phi = solution[:,:,field]
+
+    b = np.zeros(grid.ncells)
+    if source is not None:
+        b += np.ravel(source)
+
+    if boundary is not None:
+        ghostConstant = boundary.ghostMap(field)[1].ravel()
+
+    for direction, slot, (di,dj) in stencilShifts:
+        if direction == "x":
+            coefficient = Apx[:,:,slot].ravel()
+        else:
+            coefficient = Apy[:,:,slot].ravel()
+        if not coefficient.any():
+            continue
+
+        # ghost cells are known, so they stay on the RHS
+        outside = grid.interior(number,di,dj).ravel() < 0
+        value = grid.interior(phi,di,dj).ravel()[outside]
+
+        if boundary is not None:
+            ghost = grid.interior(grid.index,di,dj).ravel()[outside]
+            constant = ghostConstant[ghost]
+            value = np.where(np.isnan(constant),value,constant)
+
+        b[outside] += coefficient[outside] * value
+
+    return b
+
+def coefficientStack(grid,Apx,Apy):
+
+    """
+        returns the (9,ncells) values each coefficient takes in A, the
+        diagonal followed by the negated neighbors in stencilShifts order
+    """
+
+    stack = np.empty((9,grid.ncells))
+    stack[0] = (Apx[:,:,2] + Apy[:,:,2]).ravel()
+    for k, (direction, slot, shift) in enumerate(stencilShifts):
+        coefficient = Apx[:,:,slot] if direction == "x" else Apy[:,:,slot]
+        np.negative(coefficient.ravel(),out=stack[k+1])
+    return stack
+
+class sparsity:
+
+    """
+        the structure of the matrix of assembleMatrix, kept between calls.
+        While the non-zero coefficients and the ghost cells tied by the
+        boundary conditions stay the same, which with upwind schemes is as
+        long as no face flips its upwind direction, the matrix is refilled
+        in place instead of being rebuilt
+    """
+
+    def __init__(self):
+        self.mask = None
+        self.ghostSource = None
+        self.stats = {"builds": 0, "refills": 0}
+
+    def build(self,grid,stack,ghostSource):
+        # every entry of A as a position in stack.ravel(), then CSR
+        # arrays with the duplicate entries mapped onto one
+        number = cellNumbers(grid)
+        rows = np.arange(grid.ncells)
+
+        rowList = [rows[self.mask[0]]]
+        colList = [rows[self.mask[0]]]
+        sourceList = [rows[self.mask[0]]]
+
+        for k, (direction, slot, (di,dj)) in enumerate(stencilShifts):
+            used = self.mask[k+1]
+            if not used.any():
+                continue
+            neighbor = grid.interior(number,di,dj).ravel()
+            inside = (neighbor >= 0) & used
+            rowList.append(rows[inside])
+            colList.append(neighbor[inside])
+            sourceList.append((k+1) * grid.ncells + rows[inside])
+
+            if ghostSource is not None:
+                outside = (neighbor < 0) & used
+                tied = ghostSource[grid.interior(grid.index,di,dj).ravel()[outside]]
+                folded = tied >= 0
+                rowList.append(rows[outside][folded])
+                colList.append(number.ravel()[tied[folded]])
+                sourceList.append((k+1) * grid.ncells + rows[outside][folded])
+
+        rows = np.concatenate(rowList)
+        cols = np.concatenate(colList)
+        self.source = np.concatenate(sourceList)
+        entries, self.inverse = np.unique(rows * grid.ncells + cols,return_inverse=True)
+        self.indices = entries % grid.ncells
+        self.indptr = np.concatenate\
+            (
+                ([0],np.cumsum(np.bincount(entries // grid.ncells,minlength=grid.ncells)))
+            )
+        self.nnz = len(entries)
+
+    def matrix(self,grid,Apx,Apy,field=2,boundary=None):
+
+        """
+        returns the matrix of assembleMatrix for these coefficients,
+        rebuilding the structure only when it changed
+
+        inputs:
+            as assembleMatrix
+        returns:
+            A         (csr_matrix)-ncells x ncells matrix
+        """
+
+        stack = coefficientStack(grid,Apx,Apy)
+        mask = stack != 0
+        ghostSource = None if boundary is None else boundary.ghostMap(field)[0].ravel()
+
+        same = self.mask is not None and np.array_equal(mask,self.mask) and \
+            (
+                (ghostSource is None and self.ghostSource is None) or
+                (
+                    ghostSource is not None and self.ghostSource is not None and
+                    np.array_equal(ghostSource,self.ghostSource)
+                )
+            )
+        if same:
+            self.stats["refills"] += 1
+        else:
+            self.mask = mask
+            self.ghostSource = ghostSource
+            self.build(grid,stack,ghostSource)
+            self.stats["builds"] += 1
+
+        data = np.bincount(self.inverse,weights=stack.ravel()[self.source],minlength=self.nnz)
+        return sparse.csr_matrix\
+            (
+                (data,self.indices,self.indptr),shape=(grid.ncells,grid.ncells)
+            )
+
+def solveMatrix(A,b,x0=None,method="lu",tol=1e-10,maxiter=1000,restart=30,
+                dropTol=1e-4,fillFactor=10,preconditioner=None):
+
+    """
+        solves A*x = b with sparse LU or ILU preconditioned BiCGSTAB/GMRES
+
+        inputs:
+            A         (csr_matrix)-system matrix
+            b         (ndarray)   -right hand side
+            x0        (ndarray)   -initial guess for the Krylov methods
+            method    (string)    -"lu", "bicgstab" or "gmres"
+            tol       (float)     -relative tolerance for the Krylov methods
+            maxiter   (int)       -maximum Krylov iterations
+            restart   (int)       -GMRES restart length
+            dropTol   (float)     -ILU drop tolerance
+            fillFactor(float)     -ILU fill factor
+            preconditioner        -optional LinearOperator replacing the ILU
+                                   preconditioner, e.g. multigrid.asPreconditioner
+        returns:
+            x         (ndarray)   -solution vector
+            info      (dict)      -iterations, setup and solve times, and the
+                                   final relative residual
+    """
+
+    if method not in methods:
+        print("ERROR: linear solver not known: {}".format(method))
+        return None, None
+
+    info = {"method": method, "iterations": 0, "converged": True}
+    counter = {"iterations": 0}
+
+    def count(*args):
+        counter["iterations"] += 1
+
+    start = time.perf_counter()
+    if method == "lu":
+        factor = spla.splu(A.tocsc())
+    elif preconditioner is None:
+        ilu = spla.spilu(A.tocsc(),drop_tol=dropTol,fill_factor=fillFactor)
+        preconditioner = spla.LinearOperator(A.shape,ilu.solve)
+    info["setupTime"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if method == "lu":
+        x = factor.solve(b)
+    elif method == "bicgstab":
+        x, flag = spla.bicgstab\
+            (
+                A, b, x0=x0, rtol=tol, atol=0.0, maxiter=maxiter,
+                M=preconditioner, callback=count
+            )
+        info["converged"] = flag == 0
+    else:
+        x, flag = spla.gmres\
+            (
+                A, b, x0=x0, rtol=tol, atol=0.0, restart=restart,
+                maxiter=maxiter, M=preconditioner, callback=count,
+                callback_type="pr_norm"
+            )
+        info["converged"] = flag == 0
+    info["solveTime"] = time.perf_counter() - start
+    info["iterations"] = counter["iterations"]
+
+    bNorm = np.linalg.norm(b)
+    info["residual"] = np.linalg.norm(b - A @ x) / (bNorm if bNorm > 0 else 1.0)
+
+    return x, info
+
+def solve(grid,Apx,Apy,solution,field=2,method="lu",source=None,
+          boundary=None,structure=None,**kwargs):
+
+    """
+        assembles and solves for one field of the solution, writing the
+        result into the non-BC cells of solution in place. The ghost cells
+        are left alone so boundary conditions can be applied as usual.
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            field     (int)       -field from solution being solved for
+            method    (string)    -"lu", "bicgstab" or "gmres"
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (boundaries)-optional Boundary.boundaries to fold in,
+                                   also applied to the result
+            structure (sparsity)  -optional matrix structure kept between
+                                   calls, refilled while it stays the same
+            kwargs                -passed on to solveMatrix
+        returns:
+            info      (dict)      -iterations, timings and final residual
+    """
+
+    start = time.perf_counter()
+    if structure is None:
+        A, b = assembleMatrix\
+            (
+                grid,Apx,Apy,solution,field=field,source=source,boundary=boundary
+            )
+    else:
+        A = structure.matrix(grid,Apx,Apy,field=field,boundary=boundary)
+        b = rightHandSide\
+            (
+                grid,Apx,Apy,solution,field=field,source=source,boundary=boundary
+            )
+    assembleTime = time.perf_counter() - start
+
+    x0 = grid.interior(solution[:,:,field]).ravel()
+    x, info = solveMatrix(A,b,x0=x0,method=method,**kwargs)
+    if x is None:
+        return
+
+    grid.interior(solution[:,:,field])[:] = x.reshape(grid.nx,grid.ny)
+    if boundary is not None:
+        boundary.apply(solution,fields=[field])
+    info["assembleTime"] = assembleTime
+    info["nonzeros"] = A.nnz
+
+    return info
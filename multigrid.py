@@ -0,0 +1,463 @@
+"""
+    geometric multigrid for the discrete equation Ap*phi_p = sum(An*phi_n)
+    on a hierarchy of coarsened Grid.grid objects
+
+    fine cells are agglomerated 2x2 into coarse cells. Residuals are
+    restricted by summation, since the finite volume equations are already
+    integrated over each cell, and corrections are prolongated bilinearly
+    (or piecewise constant). Coarse operators are either re-discretized with
+    the same assembly used on the fine grid, or built by Galerkin coarsening
+    R*A*P with piecewise constant P, which keeps the cross shaped stencil.
+    Re-discretization gives grid independent convergence. Galerkin needs no
+    assembler, but its aggregated diffusion is twice as stiff as the
+    re-discretized one, so it converges more slowly as the grid is refined.
+
+    coarse levels solve for the error, so their ghost cells are zero. Only
+    the finest level sees the caller's ghost values and boundary updates.
+"""
+
+import time
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as spla
+
+import Grid
+import linearSolver
+import smoothers
+
+cycleTypes = ("V", "W", "F")
+
+def coarsen(grid):
+
+    """
+        returns the grid made by agglomerating 2x2 blocks of cells, with a
+        single leftover row or column of cells when nx or ny is odd
+
+        the ghost widths across each boundary are kept from the fine grid, so
+        boundary values sit at the same distance outside the domain on every
+        level. Without this each coarsening moves them half a coarse cell
+        further out, and V-cycles stop converging on fine grids. Coarse
+        faces are every other fine face, so stretched grids keep their
+        clustering on every level.
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+        returns:
+            coarse    (Grid)      -coarsened grid object
+    """
+
+    def coarseFaces(points):
+        # every other face, plus the last one when the count of cells is odd
+        if (len(points) - 1) % 2:
+            return np.append(points[::2],points[-1])
+        return points[::2]
+
+    if grid.uniform:
+        x = np.linspace(*grid.extents[0],num=grid.nx+1)
+        y = np.linspace(*grid.extents[1],num=grid.ny+1)
+    else:
+        x = grid.points[:,0,0]
+        y = grid.points[0,:,1]
+    coarse = Grid.grid\
+        (
+            (grid.nx+1)//2,(grid.ny+1)//2,x=coarseFaces(x),y=coarseFaces(y)
+        )
+
+    for ghost in (0,1,-2,-1):
+        coarse.val[ghost,2:-2,2] = grid.dx if grid.uniform else grid.val[ghost,2:-2:2,2]
+        coarse.val[2:-2,ghost,3] = grid.dy if grid.uniform else grid.val[2:-2:2,ghost,3]
+    coarse.buildFaceTables()
+
+    return coarse
+
+def restrict(fine,coarseShape):
+
+    """
+        sums each 2x2 block of a fine (nx,ny) array onto the coarse cells
+
+        inputs:
+            fine      (ndarray)   -(nx,ny) fine array
+            coarseShape (tuple)   -(cx,cy) coarse shape
+        returns:
+            coarse    (ndarray)   -(cx,cy) coarse array
+    """
+
+    cx, cy = coarseShape
+    padded = np.zeros((2*cx,2*cy))
+    padded[:fine.shape[0],:fine.shape[1]] = fine
+    return padded.reshape(cx,2,cy,2).sum(axis=(1,3))
+
+def prolongConstant(coarse,fineShape):
+
+    """
+        copies each coarse cell value onto its fine cells
+
+        inputs:
+            coarse    (ndarray)   -(cx,cy) coarse array
+            fineShape (tuple)     -(nx,ny) fine shape
+        returns:
+            fine      (ndarray)   -(nx,ny) fine array
+    """
+
+    nx, ny = fineShape
+    return np.repeat(np.repeat(coarse,2,axis=0),2,axis=1)[:nx,:ny]
+
+def prolongBilinear(coarse,fineShape):
+
+    """
+        bilinear interpolation of coarse cell values onto the fine cell
+        centers, weighting the nearest coarse cells 3/4 and 1/4 in each
+        direction. Falls back to piecewise constant when a fine dimension
+        is odd.
+
+        inputs:
+            coarse    (ndarray)   -(cx,cy) coarse array
+            fineShape (tuple)     -(nx,ny) fine shape
+        returns:
+            fine      (ndarray)   -(nx,ny) fine array
+    """
+
+    nx, ny = fineShape
+    if nx % 2 or ny % 2:
+        return prolongConstant(coarse,fineShape)
+
+    padded = np.pad(coarse,1,mode="edge")
+
+    # interpolate in x onto (nx, cy+2)
+    half = np.empty((nx,padded.shape[1]))
+    half[0::2] = 0.75 * padded[1:-1] + 0.25 * padded[:-2]
+    half[1::2] = 0.75 * padded[1:-1] + 0.25 * padded[2:]
+
+    # then in y onto (nx, ny)
+    fine = np.empty((nx,ny))
+    fine[:,0::2] = 0.75 * half[:,1:-1] + 0.25 * half[:,:-2]
+    fine[:,1::2] = 0.75 * half[:,1:-1] + 0.25 * half[:,2:]
+
+    return fine
+
+def aggregation(fineGrid,coarseGrid):
+
+    """
+        returns the sparse matrix summing fine cells onto coarse cells
+
+        inputs:
+            fineGrid  (Grid)      -fine grid object
+            coarseGrid(Grid)      -coarse grid object from coarsen
+        returns:
+            R         (csr_matrix)-coarse ncells x fine ncells
+    """
+
+    i, j = np.meshgrid\
+        (
+            np.arange(fineGrid.nx),np.arange(fineGrid.ny),indexing="ij"
+        )
+    rows = ((i//2) * coarseGrid.ny + j//2).ravel()
+    cols = np.arange(fineGrid.ncells)
+    return sparse.csr_matrix\
+        (
+            (np.ones(fineGrid.ncells),(rows,cols)),
+            shape=(coarseGrid.ncells,fineGrid.ncells)
+        )
+
+def galerkin(fineGrid,Apx,Apy,coarseGrid):
+
+    """
+        builds the coarse coefficients R*A*P, with P the transpose of the
+        summing restriction R, and returns them in stencil form
+
+        inputs:
+            fineGrid  (Grid)      -fine grid object
+            Apx       (ndarray)   -(nx,ny,5) fine coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) fine coefficients ordered BB B P T TT
+            coarseGrid(Grid)      -coarse grid object from coarsen
+        returns:
+            Apx       (ndarray)   -(cx,cy,5) coarse coefficients
+            Apy       (ndarray)   -(cx,cy,5) coarse coefficients
+    """
+
+    zeros = np.zeros((fineGrid.nx+4,fineGrid.ny+4,1))
+    A, b = linearSolver.assembleMatrix(fineGrid,Apx,Apy,zeros,field=0)
+    R = aggregation(fineGrid,coarseGrid)
+    coarse = (R @ A @ R.T).tocsr()
+
+    # fine couplings reach at most two cells, which is one coarse cell
+    number = linearSolver.cellNumbers(coarseGrid)
+    rows = np.arange(coarseGrid.ncells)
+
+    coarseApx = np.zeros((coarseGrid.nx,coarseGrid.ny,5))
+    coarseApy = np.zeros((coarseGrid.nx,coarseGrid.ny,5))
+    coarseApx[:,:,2] = coarse.diagonal().reshape(coarseGrid.nx,coarseGrid.ny)
+
+    for Apn, slot, (di,dj) in \
+        (
+            (coarseApx,1,(-1,0)),
+            (coarseApx,3,(1,0)),
+            (coarseApy,1,(0,-1)),
+            (coarseApy,3,(0,1)),
+        ):
+        neighbor = coarseGrid.interior(number,di,dj).ravel()
+        inside = neighbor >= 0
+        values = np.zeros(coarseGrid.ncells)
+        values[inside] = -np.asarray(coarse[rows[inside],neighbor[inside]]).ravel()
+        Apn[:,:,slot] = values.reshape(coarseGrid.nx,coarseGrid.ny)
+
+    return coarseApx, coarseApy
+
+def restrictSolution(fineGrid,solution,coarseGrid):
+
+    """
+        volume averages every field of a padded solution onto the coarse
+        grid, filling the coarse ghost cells from the nearest coarse cell.
+        Used to give re-discretization the coarse velocity field.
+
+        inputs:
+            fineGrid  (Grid)      -fine grid object
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            coarseGrid(Grid)      -coarse grid object from coarsen
+        returns:
+            coarse    (ndarray)   -coarse [x,y,field] array
+    """
+
+    shape = (coarseGrid.nx,coarseGrid.ny)
+    d_X, d_Y = fineGrid.cellWidths()
+    volume = np.broadcast_to(d_X * d_Y,(fineGrid.nx,fineGrid.ny))
+    coarseVolume = restrict(volume,shape)
+
+    coarse = np.zeros((coarseGrid.nx+4,coarseGrid.ny+4,solution.shape[2]))
+    for field in range(solution.shape[2]):
+        average = restrict(fineGrid.interior(solution[:,:,field]) * volume,shape)
+        coarse[:,:,field] = np.pad(average / coarseVolume,2,mode="edge")
+
+    return coarse
+
+class level:
+
+    """
+        one level of the multigrid hierarchy: its grid, coefficients and the
+        padded work arrays for its correction and right hand side
+    """
+
+    def __init__(self,grid,Apx,Apy):
+        self.grid = grid
+        self.Apx = Apx
+        self.Apy = Apy
+        self.phi = np.zeros((grid.nx+4,grid.ny+4))
+        self.source = np.zeros((grid.nx,grid.ny))
+
+class multigrid:
+
+    def __init__(self,grid,Apx,Apy,coarsening=None,assembler=None,
+                 solution=None,cycle="V",smoother="multicolor",preSweeps=2,
+                 postSweeps=2,relaxation=None,prolongation=None,
+                 minCells=4,maxLevels=20):
+
+        """
+        builds the grid hierarchy and coarse operators
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            coarsening(string)    -"galerkin" or "rediscretize", defaults to
+                                   "rediscretize" when an assembler is given
+            assembler (callable)  -assembler(grid,solution) returning Apx, Apy,
+                                   needed for "rediscretize", such as
+                                   run_CD_test.assemble with kinVisc bound
+            solution  (ndarray)   -fine solution array whose velocity is
+                                   restricted for "rediscretize"
+            cycle     (string)    -"V", "W" or "F"
+            smoother  (string)    -name from smoothers.smoothers
+            preSweeps (int)       -smoothing sweeps before the coarse correction
+            postSweeps(int)       -smoothing sweeps after the coarse correction
+            relaxation(float)     -smoother relaxation, None for its default
+            prolongation(string)  -"bilinear" or "constant", defaults to
+                                   "constant" for galerkin to match its P
+            minCells  (int)       -stop coarsening below this many cells a side
+            maxLevels (int)       -maximum number of levels
+        """
+
+        if coarsening is None:
+            coarsening = "galerkin" if assembler is None else "rediscretize"
+        if coarsening not in ("galerkin","rediscretize"):
+            print("ERROR: coarsening not known: {}".format(coarsening))
+            coarsening = "galerkin"
+        if coarsening == "rediscretize" and (assembler is None or solution is None):
+            print("ERROR: re-discretization needs an assembler and a solution")
+            coarsening = "galerkin"
+        if cycle not in cycleTypes:
+            print("ERROR: cycle type not known: {}".format(cycle))
+            cycle = "V"
+
+        start = time.perf_counter()
+
+        self.cycleType = cycle
+        self.coarsening = coarsening
+        self.smoother = smoothers.smoothers[smoother]
+        self.smootherOptions = {} if relaxation is None else {"relaxation": relaxation}
+        self.preSweeps = preSweeps
+        self.postSweeps = postSweeps
+        if prolongation is None:
+            prolongation = "constant" if coarsening == "galerkin" else "bilinear"
+        if prolongation == "constant":
+            self.prolong = prolongConstant
+        else:
+            self.prolong = prolongBilinear
+
+        self.levels = [level(grid,Apx,Apy)]
+        while len(self.levels) < maxLevels:
+            fine = self.levels[-1]
+            if min(fine.grid.nx,fine.grid.ny) < 2 * minCells:
+                break
+            # re-discretization needs the coarse cells to match the fine ones
+            if coarsening == "rediscretize" and (fine.grid.nx % 2 or fine.grid.ny % 2):
+                break
+
+            coarseGrid = coarsen(fine.grid)
+            if coarsening == "galerkin":
+                coarseApx, coarseApy = galerkin(fine.grid,fine.Apx,fine.Apy,coarseGrid)
+            else:
+                solution = restrictSolution(fine.grid,solution,coarseGrid)
+                coarseApx, coarseApy = assembler(coarseGrid,solution)
+            self.levels.append(level(coarseGrid,coarseApx,coarseApy))
+
+        # the coarsest level is solved directly
+        coarsest = self.levels[-1]
+        A, b = linearSolver.assembleMatrix\
+            (
+                coarsest.grid,coarsest.Apx,coarsest.Apy,
+                coarsest.phi[:,:,np.newaxis],field=0
+            )
+        self.coarseFactor = spla.splu(A.tocsc())
+
+        self.setupTime = time.perf_counter() - start
+
+    def smooth(self,index,sweeps,boundary):
+        lv = self.levels[index]
+        self.smoother\
+            (
+                lv.grid,lv.Apx,lv.Apy,lv.phi,source=lv.source,
+                boundary=boundary,sweeps=sweeps,**self.smootherOptions
+            )
+
+    def cycle(self,index=0,kind=None,boundary=None):
+
+        """
+        performs one cycle starting at level index, improving that level's
+        phi for its source
+
+        inputs:
+            index     (int)       -level to start from, 0 is the finest
+            kind      (string)    -"V", "W" or "F", defaults to the cycle type
+            boundary  (callable)  -optional ghost update for level 0
+        """
+
+        kind = kind or self.cycleType
+        lv = self.levels[index]
+        grid = lv.grid
+
+        if index == len(self.levels) - 1:
+            if index == 0:
+                # a single level grid keeps the caller's ghost values
+                A, b = linearSolver.assembleMatrix\
+                    (
+                        grid,lv.Apx,lv.Apy,lv.phi[:,:,np.newaxis],
+                        field=0,source=lv.source
+                    )
+            else:
+                b = lv.source.ravel()
+            grid.interior(lv.phi)[:] = self.coarseFactor.solve(b).reshape(grid.nx,grid.ny)
+            if boundary is not None:
+                boundary()
+            return
+
+        if index > 0:
+            boundary = None
+
+        self.smooth(index,self.preSweeps,boundary)
+
+        coarse = self.levels[index+1]
+        r = smoothers.residual(grid,lv.Apx,lv.Apy,lv.phi,lv.source)
+        coarse.source = restrict(r,(coarse.grid.nx,coarse.grid.ny))
+        coarse.phi[:] = 0
+
+        if kind == "V":
+            self.cycle(index+1,"V")
+        elif kind == "W":
+            self.cycle(index+1,"W")
+            self.cycle(index+1,"W")
+        else:
+            self.cycle(index+1,"F")
+            self.cycle(index+1,"V")
+
+        grid.interior(lv.phi)[:] += self.prolong\
+            (
+                coarse.grid.interior(coarse.phi),(grid.nx,grid.ny)
+            )
+        if boundary is not None:
+            boundary()
+
+        self.smooth(index,self.postSweeps,boundary)
+
+    def solve(self,phi,source=None,boundary=None,tol=1e-8,atol=1e-12,maxCycles=50):
+
+        """
+        standalone solve of the finest level, cycling until the residual
+        has dropped by tol
+
+        inputs:
+            phi       (ndarray)   -(nx+4,ny+4) padded field, updated in place
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (callable)  -optional, called to update the ghost cells
+            tol       (float)     -relative residual reduction to reach
+            atol      (float)     -absolute residual norm to stop at
+            maxCycles (int)       -maximum number of cycles
+        returns:
+            info      (dict)      -cycles, residual history, mean convergence
+                                   factor and timings
+        """
+
+        start = time.perf_counter()
+
+        fine = self.levels[0]
+        fine.phi = phi
+        fine.source = np.zeros((fine.grid.nx,fine.grid.ny)) if source is None else source
+
+        residuals = [np.linalg.norm(smoothers.residual(fine.grid,fine.Apx,fine.Apy,phi,fine.source))]
+        cycles = 0
+        while cycles < maxCycles and residuals[-1] > max(tol * residuals[0],atol):
+            self.cycle(0,boundary=boundary)
+            cycles += 1
+            residuals.append(np.linalg.norm(smoothers.residual(fine.grid,fine.Apx,fine.Apy,phi,fine.source)))
+
+        if cycles > 0 and residuals[0] > 0:
+            rate = (residuals[-1] / residuals[0]) ** (1.0 / cycles)
+        else:
+            rate = 0.0
+
+        return {
+            "levels": len(self.levels),
+            "cycles": cycles,
+            "residuals": residuals,
+            "convergenceRate": rate,
+            "setupTime": self.setupTime,
+            "solveTime": time.perf_counter() - start,
+        }
+
+    def asPreconditioner(self):
+
+        """
+        returns one cycle from a zero guess as a scipy LinearOperator on
+        the non-BC cells, for use as the preconditioner of the Krylov
+        methods in linearSolver
+        """
+
+        fine = self.levels[0]
+        shape = (fine.grid.nx,fine.grid.ny)
+
+        def apply(b):
+            fine.phi = np.zeros((fine.grid.nx+4,fine.grid.ny+4))
+            fine.source = np.reshape(b,shape)
+            self.cycle(0)
+            return fine.grid.interior(fine.phi).ravel()
+
+        return spla.LinearOperator((fine.grid.ncells,fine.grid.ncells),apply)
@@ -0,0 +1,414 @@
+"""
+    cache of the operators that stay the same from one iteration to the
+    next
+
+    the diffusion coefficients from fvSchemes.centralDifferenceField only
+    depend on the grid geometry and kinVisc, and a mass (time) term
+    coefficient * volume only on the geometry, yet they used to be rebuilt
+    for every assembly. An operatorCache builds each combination of terms
+    once per grid and keeps, as they are first asked for,
+
+        Apx, Apy              -the coefficient arrays, read-only
+        matrix                -the sparse matrix of linearSolver, per field
+                               and kind of boundary conditions
+        factorization         -its sparse LU, or ILU preconditioner
+        hierarchy             -a multigrid hierarchy re-discretized with the
+                               same terms
+
+    so repeated solves of the same operator only build a right hand side.
+    Entries are keyed by the grid, grid.version and the term parameters:
+    rebuilding the face tables after editing grid.val, or changing kinVisc
+    or the time step, misses the cache, and invalidate() drops entries
+    explicitly. Velocity dependent convection is never cached, so combined
+    convection-diffusion assembly (kernels.assemble with diffusion) adds the
+    cached diffusion to freshly assembled convection.
+
+    the module level cache, shared, is used by kernels and ensemble, so
+    repeated runs in one process reuse it too.
+"""
+
+import collections
+import time
+import numpy as np
+import scipy.sparse.linalg as spla
+
+import Boundary
+import linearSolver
+
+def diffusion(grid,kinVisc):
+
+    """
+        central difference diffusion times kinVisc, summed over the faces
+        in the order of kernels.assemble
+
+        returns:
+            Apx, Apy  (ndarray)   -(nx,ny,5) coefficients
+    """
+
+    import fvSchemes
+
+    Apx = np.zeros((grid.nx,grid.ny,5))
+    Apy = np.zeros((grid.nx,grid.ny,5))
+    Apy += fvSchemes.centralDifferenceField(grid,facename="T") * kinVisc
+    Apy += fvSchemes.centralDifferenceField(grid,facename="B") * kinVisc
+    Apx += fvSchemes.centralDifferenceField(grid,facename="L") * kinVisc
+    Apx += fvSchemes.centralDifferenceField(grid,facename="R") * kinVisc
+    return Apx, Apy
+
+def mass(grid,coefficient):
+
+    """
+        coefficient times the cell volume on A_P, such as 1/dt for the time
+        term of an implicit step, kept in the P slot of Apx
+
+        returns:
+            Apx, Apy  (ndarray)   -(nx,ny,5) coefficients
+    """
+
+    Apx = np.zeros((grid.nx,grid.ny,5))
+    Apy = np.zeros((grid.nx,grid.ny,5))
+    d_X, d_Y = grid.cellWidths()
+    Apx[:,:,2] = coefficient * d_X * d_Y
+    return Apx, Apy
+
+# name: builder(grid,parameter) of every term that can be cached
+terms = {
+    "diffusion": diffusion,
+    "mass": mass,
+}
+
+def assembleTerms(grid,combination):
+    # sum of the coefficients of (name, parameter) terms
+    Apx = np.zeros((grid.nx,grid.ny,5))
+    Apy = np.zeros((grid.nx,grid.ny,5))
+    for name, parameter in combination:
+        termApx, termApy = terms[name](grid,parameter)
+        Apx += termApx
+        Apy += termApy
+    return Apx, Apy
+
+def boundaryKey(boundary,field):
+
+    """
+        the kinds of condition on each side of a field, which is all the
+        matrix depends on: values and gradients only enter the right hand
+        side, while neumann and periodic sides tie ghosts to unknowns
+    """
+
+    if boundary is None:
+        return None
+    return tuple\
+        (
+            (side,type(boundary.conditions[(field,side)]).__name__)
+            for side in Boundary.sides if (field,side) in boundary.conditions
+        )
+
+class operator:
+
+    def __init__(self,grid,combination,coefficients=None,assembler=None):
+
+        """
+        a constant operator of one grid and the structures built from it
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            combination (tuple)   -(name, parameter) pairs of terms
+            coefficients (tuple)  -optional (Apx, Apy) to use instead of
+                                   assembling combination, for operators the
+                                   cache cannot key such as convection at a
+                                   frozen velocity. Kept outside the cache
+            assembler (callable)  -optional assembler(grid,solution) of the
+                                   coarse multigrid levels, assembleTerms of
+                                   combination when None
+        """
+
+        start = time.perf_counter()
+        self.grid = grid
+        self.combination = combination
+        self.assembler = assembler
+        if coefficients is not None:
+            self.Apx, self.Apy = (np.array(array) for array in coefficients)
+        elif len(combination) == 1:
+            name, parameter = combination[0]
+            self.Apx, self.Apy = terms[name](grid,parameter)
+        else:
+            self.Apx, self.Apy = assembleTerms(grid,combination)
+        # shared by every user of the cache, so nobody may change them
+        self.Apx.flags.writeable = False
+        self.Apy.flags.writeable = False
+
+        self.matrices = {}
+        self.factors = {}
+        self.hierarchies = {}
+        self.buildTime = time.perf_counter() - start
+
+    def matrix(self,field=2,boundary=None):
+
+        """
+        returns the sparse matrix of linearSolver.assembleMatrix, with the
+        conditions of boundary folded in
+        """
+
+        key = (field,boundaryKey(boundary,field))
+        if key not in self.matrices:
+            start = time.perf_counter()
+            padded = np.zeros((self.grid.nx+4,self.grid.ny+4,field+1))
+            self.matrices[key] = linearSolver.assembleMatrix\
+                (
+                    self.grid,self.Apx,self.Apy,padded,field=field,
+                    boundary=boundary
+                )[0]
+            self.buildTime += time.perf_counter() - start
+        return self.matrices[key]
+
+    def factor(self,method="lu",field=2,boundary=None,dropTol=1e-4,fillFactor=10):
+
+        """
+        returns the sparse LU of the matrix for method "lu", otherwise its
+        ILU as a preconditioner for the Krylov methods
+        """
+
+        key = (method == "lu",field,boundaryKey(boundary,field),dropTol,fillFactor)
+        if key not in self.factors:
+            A = self.matrix(field,boundary)
+            start = time.perf_counter()
+            if method == "lu":
+                self.factors[key] = spla.splu(A.tocsc())
+            else:
+                ilu = spla.spilu(A.tocsc(),drop_tol=dropTol,fill_factor=fillFactor)
+                self.factors[key] = spla.LinearOperator(A.shape,ilu.solve)
+            self.buildTime += time.perf_counter() - start
+        return self.factors[key]
+
+    def hierarchy(self,solution=None,**options):
+
+        """
+        returns a multigrid.multigrid of the operator, whose coarse levels
+        are re-discretized with the same terms, or the assembler
+
+        inputs:
+            solution  (ndarray)   -solution whose velocity the assembler
+                                   sees restricted, when it was given one.
+                                   Only used when the hierarchy is built
+            options               -passed on to multigrid.multigrid
+        """
+
+        import multigrid
+
+        key = tuple(sorted(options.items()))
+        if key not in self.hierarchies:
+            start = time.perf_counter()
+            assembler = self.assembler
+            if assembler is None:
+                combination = self.combination
+                assembler = lambda coarseGrid,coarseSolution: \
+                    assembleTerms(coarseGrid,combination)
+            if solution is None or self.assembler is None:
+                solution = np.zeros((self.grid.nx+4,self.grid.ny+4,3))
+            self.hierarchies[key] = multigrid.multigrid\
+                (
+                    self.grid,self.Apx,self.Apy,assembler=assembler,
+                    solution=solution,**options
+                )
+            self.buildTime += time.perf_counter() - start
+        return self.hierarchies[key]
+
+    def solve(self,solution,field=2,method="lu",source=None,boundary=None,
+              tol=1e-10,maxiter=1000,**options):
+
+        """
+        solves the operator for one field of the solution in place, as
+        linearSolver.solve, reusing the cached matrix and factorization
+
+        inputs:
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            field     (int)       -field from solution being solved for
+            method    (string)    -"lu", "bicgstab", "gmres" or "multigrid"
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (boundaries)-optional Boundary.boundaries to fold in,
+                                   also applied to the result
+            tol       (float)     -relative tolerance of the iterative methods
+            maxiter   (int)       -maximum iterations of the Krylov methods
+            options               -multigrid.multigrid options for "multigrid"
+        returns:
+            info      (dict)      -iterations, timings and final residual,
+                                   with setupTime the cost of building what
+                                   was not yet cached
+        """
+
+        if method not in linearSolver.methods + ("multigrid",):
+            print("ERROR: linear solver not known: {}".format(method))
+            return
+
+        built = self.buildTime
+        start = time.perf_counter()
+        phi = solution[:,:,field]
+
+        if method == "multigrid":
+            mg = self.hierarchy(solution,**options)
+            update = None if boundary is None else boundary.updater(solution,field=field)
+            info = mg.solve(phi,source=source,boundary=update,tol=tol)
+            info = {"method": method, "iterations": info["cycles"],
+                    "residual": info["residuals"][-1] / max(info["residuals"][0],1e-300)}
+        else:
+            A = self.matrix(field,boundary)
+            factor = self.factor(method,field,boundary)
+            b = linearSolver.rightHandSide\
+                (
+                    self.grid,self.Apx,self.Apy,solution,field=field,
+                    source=source,boundary=boundary
+                )
+            if method == "lu":
+                x = factor.solve(b)
+                bNorm = np.linalg.norm(b)
+                info = {"method": method, "iterations": 0,
+                        "residual": np.linalg.norm(b - A @ x) / (bNorm if bNorm > 0 else 1.0)}
+            else:
+                x0 = self.grid.interior(phi).ravel()
+                x, info = linearSolver.solveMatrix\
+                    (
+                        A,b,x0=x0,method=method,tol=tol,maxiter=maxiter,
+                        preconditioner=factor
+                    )
+            self.grid.interior(phi)[:] = x.reshape(self.grid.nx,self.grid.ny)
+            if boundary is not None:
+                boundary.apply(solution,fields=[field])
+
+        info["setupTime"] = self.buildTime - built
+        info["solveTime"] = time.perf_counter() - start - info["setupTime"]
+        return info
+
+class operatorCache:
+
+    def __init__(self,maxEntries=16):
+
+        """
+        constant operators keyed by grid and term parameters, the least
+        recently used dropped beyond maxEntries
+
+        inputs:
+            maxEntries(int)       -number of operators kept
+        """
+
+        self.maxEntries = maxEntries
+        # entries keep their grid alive, so its id cannot be reused by
+        # another grid while they are cached
+        self.entries = collections.OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "buildTime": 0.0}
+
+    def get(self,grid,combination):
+
+        """
+        returns the operator of a combination of terms on a grid, building
+        it on first use
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            combination (tuple)   -(name, parameter) pairs, such as
+                                   (("mass",1/dt),("diffusion",kinVisc))
+        returns:
+            operator              -the cached operator
+        """
+
+        combination = tuple((name,float(parameter)) for name, parameter in combination)
+        for name, parameter in combination:
+            if name not in terms:
+                print("ERROR: Not a cacheable term: {}".format(name))
+                return
+
+        # entries of an older version of this grid can never be hit again
+        stale = [key for key in self.entries if key[0] == id(grid) and key[1] != grid.version]
+        for key in stale:
+            del self.entries[key]
+
+        key = (id(grid),grid.version,combination)
+        if key in self.entries:
+            self.stats["hits"] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.stats["misses"] += 1
+        entry = operator(grid,combination)
+        self.stats["buildTime"] += entry.buildTime
+        self.entries[key] = entry
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        return entry
+
+    def diffusion(self,grid,kinVisc):
+        return self.get(grid,(("diffusion",kinVisc),))
+
+    def invalidate(self,grid=None):
+
+        """
+        drops the operators of one grid, or of every grid when None, for
+        changes the cache cannot see such as editing grid.val without
+        rebuilding the face tables
+        """
+
+        if grid is None:
+            self.entries.clear()
+        else:
+            for key in [key for key in self.entries if key[0] == id(grid)]:
+                del self.entries[key]
+
+shared = operatorCache()
+
+def reuseCheck(n=128,steps=20,kinVisc=0.01,dt=0.01,method="lu"):
+
+    """
+        times implicit Euler steps of pure diffusion of the run_CD_test
+        step, (1/dt + diffusion) phi_new = phi_old / dt, once rebuilding and
+        factorizing the system every step with linearSolver.solve and once
+        reusing the cached operator
+
+        returns:
+            results   (dict)      -seconds of both runs, the cache stats and
+                                   the largest difference of the results
+    """
+
+    import run_CD_test
+
+    grid, solution, bcs = run_CD_test.testCase(n,n)
+    d_X, d_Y = grid.cellWidths()
+    volume = d_X * d_Y
+    results = {}
+    final = {}
+    for label in ("rebuilt","cached"):
+        phi = np.copy(solution)
+        cache = operatorCache()
+        start = time.perf_counter()
+        for step in range(steps):
+            source = grid.interior(phi[:,:,2]) * volume / dt
+            if label == "rebuilt":
+                Apx, Apy = assembleTerms(grid,(("mass",1/dt),("diffusion",kinVisc)))
+                linearSolver.solve\
+                    (
+                        grid,Apx,Apy,phi,method=method,source=source,boundary=bcs
+                    )
+            else:
+                cache.get(grid,(("mass",1/dt),("diffusion",kinVisc))).solve\
+                    (
+                        phi,method=method,source=source,boundary=bcs
+                    )
+        results[label] = time.perf_counter() - start
+        final[label] = phi
+    results["stats"] = cache.stats
+    results["difference"] = float(np.abs(final["rebuilt"] - final["cached"]).max())
+    return results
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    for method in ("lu","bicgstab"):
+        results = reuseCheck(n,method=method)
+        print\
+            (
+                "{0:<10}rebuilt {1:.3f}s  cached {2:.3f}s  speedup {3:.1f}  "
+                "max difference {4:.2e}".format
+                    (
+                        method,results["rebuilt"],results["cached"],
+                        results["rebuilt"] / results["cached"],results["difference"]
+                    )
+            )
@@ -0,0 +1,233 @@
+"""
+    background output of solution snapshots
+
+    the solve loop hands the solution to a writer, which copies the part it
+    needs into a free snapshot buffer and queues it for a worker thread that
+    renders the contour plot or saves the field. The buffers are allocated
+    once, so there is never more than a fixed number of snapshots in
+    flight. When they are all in use the writer applies backpressure by
+    either skipping the frame ("skip", the default, so the solver never
+    waits) or waiting for a buffer to come back ("block").
+
+    rendering uses matplotlib's object oriented Figure with an Agg canvas
+    rather than pyplot, which keeps global state and is not thread safe.
+"""
+
+import os
+import queue
+import threading
+import time
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+policies = ("skip", "block")
+
+def plotContour(x,y,phi,filename,levels=None,centroids=None):
+
+    """
+        renders the phi contour plot of run_CD_test and saves it
+
+        inputs:
+            x         (ndarray)   -cell centroid x positions
+            y         (ndarray)   -cell centroid y positions
+            phi       (ndarray)   -field values at the centroids
+            filename  (string)    -image file name
+            levels    (ndarray)   -contour levels, 0 to 1 by default
+            centroids (tuple)     -optional (x,y) of the centroids to scatter
+    """
+
+    if levels is None:
+        levels = np.linspace(0, 1.0, 9, endpoint=True)
+    cmap = matplotlib.colormaps["bwr"]
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(1)
+    cs = axs.contourf(x, y, phi, levels, extend='both', cmap=cmap)
+    fig.colorbar(cs, ax=axs, ticks=levels)
+    axs.set_title("phi")
+    if centroids is not None:
+        axs.scatter(centroids[0], centroids[1], c='k', s=2)
+    fig.savefig(filename)
+
+def saveField(phi,filename):
+    # raw field snapshot, written to a temporary name first so readers
+    # never see a partial file
+    temporary = filename + ".tmp"
+    with open(temporary,"wb") as f:
+        np.save(f,phi)
+    os.replace(temporary,filename)
+
+class writer:
+
+    def __init__(self,grid,interval=1,stride=1,kind="plot",prefix="sol",
+                 queueSize=2,workers=1,policy="skip",field=2,centroids=True):
+
+        """
+        asynchronous writer of solution snapshots
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            interval  (int)       -write every interval-th iteration
+            stride    (int)       -spatial decimation, every stride-th cell
+                                   in each direction is kept
+            kind      (string)    -"plot" for png contours, "field" for .npy
+            prefix    (string)    -file name prefix, "sol" gives sol_{it}
+            queueSize (int)       -snapshots that may wait for a worker
+            workers   (int)       -number of background threads
+            policy    (string)    -"skip" or "block" when every buffer is busy
+            field     (int)       -field of the solution array to write
+            centroids (bool)      -scatter the cell centroids on the plots
+        """
+
+        if policy not in policies:
+            print("ERROR: Not an output policy: {}".format(policy))
+            policy = "skip"
+        if kind not in ("plot","field"):
+            print("ERROR: Not an output kind: {}".format(kind))
+            kind = "plot"
+
+        self.interval = max(1,int(interval))
+        self.kind = kind
+        self.prefix = prefix
+        self.policy = policy
+        self.field = field
+
+        # same cells as the original plot, the BC layer included, decimated
+        self.window = (slice(1,-1,stride),slice(1,-1,stride))
+        self.x = np.copy(grid.val[self.window][:,:,0])
+        self.y = np.copy(grid.val[self.window][:,:,1])
+        self.centroids = None
+        if centroids:
+            self.centroids = \
+                (
+                    np.copy(grid.val[::stride,::stride,0]),
+                    np.copy(grid.val[::stride,::stride,1])
+                )
+
+        # one buffer per queued snapshot and per worker rendering one
+        shape = self.x.shape
+        self.free = queue.Queue()
+        for n in range(queueSize + workers):
+            self.free.put(np.empty(shape))
+        self.pending = queue.Queue()
+
+        self.stats = {"submitted": 0, "written": 0, "skipped": 0, "errors": 0,
+                      "copyTime": 0.0, "waitTime": 0.0, "renderTime": 0.0}
+        self.lock = threading.Lock()
+
+        self.threads = []
+        for n in range(workers):
+            thread = threading.Thread(target=self.work,daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def due(self,it):
+        # whether iteration it falls on the output cadence
+        return it % self.interval == 0
+
+    def submit(self,it,solution,force=False,wait=False):
+
+        """
+        snapshots one field of the solution for output, if iteration it is
+        due. Only the copy into a snapshot buffer happens on the calling
+        thread.
+
+        inputs:
+            it        (int)       -iteration number, used in the file name
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            force     (bool)      -write regardless of the cadence
+            wait      (bool)      -wait for a free buffer whatever the
+                                   policy, e.g. for the last iteration
+        returns:
+            queued    (bool)      -whether the snapshot was queued
+        """
+
+        if not force and not self.due(it):
+            return False
+        self.stats["submitted"] += 1
+
+        start = time.perf_counter()
+        try:
+            if wait or self.policy == "block":
+                buffer = self.free.get()
+            else:
+                buffer = self.free.get_nowait()
+        except queue.Empty:
+            self.stats["skipped"] += 1
+            return False
+        self.stats["waitTime"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        np.copyto(buffer,solution[self.window][:,:,self.field])
+        self.stats["copyTime"] += time.perf_counter() - start
+
+        self.pending.put((it,buffer))
+        return True
+
+    def filename(self,it):
+        if self.kind == "plot":
+            return "{0}_{1}.png".format(self.prefix,it)
+        return "{0}_{1}.npy".format(self.prefix,it)
+
+    def write(self,it,phi):
+        if self.kind == "plot":
+            plotContour\
+                (
+                    self.x,self.y,phi,self.filename(it),centroids=self.centroids
+                )
+        else:
+            saveField(phi,self.filename(it))
+
+    def work(self):
+        # worker thread, renders snapshots until it receives None
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            it, buffer = item
+            start = time.perf_counter()
+            try:
+                self.write(it,buffer)
+                with self.lock:
+                    self.stats["written"] += 1
+            except Exception as error:
+                with self.lock:
+                    self.stats["errors"] += 1
+                print("ERROR: output of iteration {0} failed: {1}".format(it,error))
+            finally:
+                with self.lock:
+                    self.stats["renderTime"] += time.perf_counter() - start
+                self.free.put(buffer)
+                self.pending.task_done()
+
+    def flush(self):
+        # waits until every queued snapshot is written
+        self.pending.join()
+
+    def close(self):
+
+        """
+        writes the remaining snapshots and stops the workers
+
+        returns:
+            stats     (dict)      -submitted, written, skipped and error
+                                   counts, and the copy, wait and render times
+        """
+
+        if self.threads:
+            for thread in self.threads:
+                self.pending.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
@@ -2,117 +2,594 @@
     this is a main testing program to do diffusion-only and convection-only
     (and perhaps both combined) tests before moving on to a more full CFD
     method
+
+    a run is described by the options in defaults, any of which a JSON case
+    file replaces, and the schemes are chosen there by their names in
+    fvSchemes.registry:
+
+        python run_CD_test.py case.json --output results --profile sampling --timing
 """
 
+import argparse
+import functools
+import json
+import os
 import numpy as np
+import Grid
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as mpl
+import linearSolver
+import smoothers
+import multigrid
+import Boundary
+import kernels
+import output
+import checkpoint
+import convergence
+import acceleration
+import decomposition
+import deferred
+import fields
+import fvSchemes
+import incremental
+import interpolate
+import operators
+import instrumentation
+from instrumentation import logger
+
+# options of a run, overridden by the entries of a case file (see
+# readCase) or the case argument of main
+defaults = {
+    # x and y gridpoints
+    "nx": 11,
+    "ny": 11,
+    #cell distribution of Grid.clusterings in both directions, smallest
+    #cells at clusteringSide ("start", "end" or "both"), the inflow sides
+    #T and R being the end of y and x. clusteringStrength is the growth
+    #ratio for "geometric" and beta for "tanh" (None for the defaults)
+    "clustering": "uniform",
+    "clusteringSide": "end",
+    "clusteringStrength": None,
+    #maximum number of iterations
+    "iterations": 30,
+    #stop once the scaled phi equation residual is below absTol, or below
+    #relTol times that of the first iteration (None disables either)
+    "absTol": 1e-6,
+    "relTol": None,
+    #optional .json or .csv file for the residual history
+    "historyFile": None,
+
+    "kinVisc": 1/40,
+    "rho": 1.18,
+
+    #uniform (u, v) of the convecting flow, and the conditions on phi per
+    #side as the name of one of Boundary.kinds followed by its arguments
+    "velocity": [-1.0, -1.0],
+    "boundaries": {
+        "T": ["inflow", 1.0],
+        "R": ["inflow", 0.0],
+        "B": ["outflow"],
+        "L": ["outflow"],
+    },
+
+    #names of the convection and diffusion schemes in fvSchemes.registry,
+    #None leaves the term out
+    "convection": "secondOrderUpwind",
+    "diffusion": None,
 
-def main():
-    # x gridpoints
-    nx=11
-    # y gridpoints
-    ny=11
-    #number of iterations
-    iterations = 30
+    #set relaxation factors
+    "relaxation": 0.9,
+
+    #linear solver, "GS" for the point Gauss-Seidel loop, one of
+    #"multicolor", "jacobi", "line" for the vectorized smoothers, one of
+    #"lu", "bicgstab", "gmres" for the sparse solvers in linearSolver or
+    #"multigrid" for multigrid cycles or "decomposed" for point
+    #Gauss-Seidel on blocks of the grid in workers separate processes
+    "solver": "GS",
+    "workers": 2,
+
+    #solution storage, "double" or "single" (float32 fields, with the
+    #coefficients and residual sums kept in float64)
+    "precision": "double",
+
+    #kernel backend for assembly and Gauss-Seidel updates, "numpy" or
+    #"numba" (falls back to numpy when numba is not installed)
+    "backend": "numpy",
+
+    #with the numpy backend, keep the upwind stencils between iterations
+    #and only re-assemble the faces whose flow direction flipped
+    "incrementalAssembly": True,
+
+    #convect phi with first-order upwind in the coefficients and the
+    #difference to one of deferred.schemes ("QUICK", "vanLeer", "MUSCL",
+    #"superbee", ...) as an explicit source, in place of convection, or
+    #None. QUICK weights the downstream cell and needs the line,
+    #multigrid or sparse solvers, single point sweeps of the lagged
+    #correction diverge
+    "deferredScheme": None,
+
+    #accelerate the outer iteration with one of acceleration.accelerators,
+    #"anderson" (mixing the last andersonDepth iterates) or "adaptive"
+    #(Aitken relaxation), or None for the plain loop
+    "accelerator": None,
+    "andersonDepth": 5,
+
+    #logging level of the progress messages, "debug" also prints the
+    #per-cell coefficients of solve, "off" silences everything
+    "logLevel": "info",
+
+    #directory of the plots, the history and summary files and the
+    #profiles, relative file names are taken inside it
+    "outputDirectory": ".",
+
+    #time the phases of the run and report them, writing the summary to
+    #summaryFile (summary.json when None)
+    "timing": False,
+    "summaryFile": None,
+
+    #profile the whole run with one of instrumentation.profilers,
+    #"cProfile" or "sampling" (every sampleInterval seconds), or None
+    "profile": None,
+    "sampleInterval": 0.005,
+
+    #plot the solution every outputInterval iterations, keeping every
+    #outputStride-th cell. Frames are skipped rather than waited for when
+    #outputQueue snapshots are already waiting to be rendered
+    "outputInterval": 1,
+    "outputStride": 1,
+    "outputQueue": 2,
+
+    #write a checkpoint every checkpointInterval iterations to
+    #checkpointDirectory (None for no checkpoints), and with restart
+    #continue from the newest one found there
+    "checkpointDirectory": None,
+    "checkpointInterval": 100,
+    "restart": False,
+}
+
+def readCase(filename):
+
+    """
+    reads a case file, a JSON object with some of the entries of defaults
+
+        {"nx": 64, "ny": 64, "solver": "line", "convection": "firstOrderUpwind",
+         "boundaries": {"T": ["inflow", 1.0], "R": ["inflow", 0.0],
+                        "B": ["outflow"], "L": ["outflow"]}}
+
+    inputs:
+        filename  (string)    -path of the case file
+    returns:
+        case      (dict)      -the options of the file
+    """
+
+    with open(filename) as f:
+        return json.load(f)
+
+def main(case=None):
+
+    """
+    runs the convected step test case
+
+    inputs:
+        case      (dict)      -options replacing those of defaults
+    """
+
+    options = dict(defaults)
+    if case is not None:
+        unknown = [key for key in case if key not in defaults]
+        if unknown:
+            print("ERROR: Not a case option: {}".format(", ".join(unknown)))
+            return
+        options.update(case)
+
+    instrumentation.setLevel(options["logLevel"])
+    os.makedirs(options["outputDirectory"],exist_ok=True)
+
+    with instrumentation.profiled\
+        (
+            options["profile"],options["outputDirectory"],
+            interval=options["sampleInterval"]
+        ):
+        run(options)
+
+def run(options):
+
+    """
+    the iterations of main, with every option merged into options
+    """
+
+    nx = options["nx"]
+    ny = options["ny"]
+    clustering = options["clustering"]
+    clusteringSide = options["clusteringSide"]
+    clusteringStrength = options["clusteringStrength"]
+    iterations = options["iterations"]
+    absTol = options["absTol"]
+    relTol = options["relTol"]
+    kinVisc = options["kinVisc"]
+    convection = options["convection"]
+    diffusion = options["diffusion"]
+    relaxation = options["relaxation"]
+    solver = options["solver"]
+    workers = options["workers"]
+    precision = options["precision"]
+    backend = options["backend"]
+    incrementalAssembly = options["incrementalAssembly"]
+    deferredScheme = options["deferredScheme"]
+    accelerator = options["accelerator"]
+    andersonDepth = options["andersonDepth"]
+    outputInterval = options["outputInterval"]
+    outputStride = options["outputStride"]
+    outputQueue = options["outputQueue"]
+    checkpointDirectory = options["checkpointDirectory"]
+    checkpointInterval = options["checkpointInterval"]
+    restart = options["restart"]
+    timing = options["timing"]
+
+    # every result file is placed in the output directory
+    directory = options["outputDirectory"]
+    historyFile = options["historyFile"]
+    if historyFile is not None:
+        historyFile = os.path.join(directory,historyFile)
+    summaryFile = options["summaryFile"]
+    if timing or summaryFile is not None:
+        summaryFile = os.path.join(directory,summaryFile or "summary.json")
+
+    timer = instrumentation.timers(enabled=summaryFile is not None)
+
+    # the schemes are looked up once and handed to every assembly. Under a
+    # deferred correction the implicit part is first-order upwind
+    if deferredScheme is not None:
+        convection = "firstOrderUpwind"
+    convectionScheme = fvSchemes.lookup("convection",convection)
+    diffusionScheme = fvSchemes.lookup("diffusion",diffusion)
+    if (convectionScheme is None) != (convection is None):
+        return
+    if (diffusionScheme is None) != (diffusion is None):
+        return
+    assembleCase = functools.partial\
+        (
+            assemble,kinVisc=kinVisc,backend=backend,
+            convection=convectionScheme,diffusion=diffusionScheme
+        )
+
+    #build grid, solution and boundary conditions of the test case
+    x = Grid.distribution(nx,clustering=clustering,side=clusteringSide,strength=clusteringStrength)
+    y = Grid.distribution(ny,clustering=clustering,side=clusteringSide,strength=clusteringStrength)
+    if x is None or y is None:
+        return
+    grid, solution, bcs = testCase\
+        (
+            nx,ny,precision=precision,x=x,y=y,
+            boundaries=options["boundaries"],velocity=options["velocity"]
+        )
+    if bcs is None:
+        return
+    #grid.plot()
 
-    kinVisc=1/40
-    rho=1.18
+    solvers = ("GS","multigrid","decomposed") + tuple(smoothers.smoothers) + linearSolver.methods
+    if solver not in solvers:
+        print("ERROR: solver not known: {0}, use one of {1}".format(solver,", ".join(solvers)))
+        return
+    if deferredScheme is not None and solver == "decomposed":
+        print("ERROR: deferred correction is not available to the decomposed solver")
+        return
+    if accelerator is not None and solver == "decomposed":
+        print("ERROR: acceleration is not available to the decomposed solver")
+        return
+    if accelerator is not None and accelerator not in acceleration.accelerators:
+        print("ERROR: accelerator not known: {}".format(accelerator))
+        return
+    if solver == "decomposed" and decomposition.blockLayout(workers,nx,ny) is None:
+        return
+
+    if solver == "decomposed":
+        # workers are started before the output thread, and solve in a
+        # shared copy of the solution that replaces it from here on
+        dd = decomposition.decomposition\
+            (
+                grid,solution,bcs,
+                assembleCase,
+                workers=workers,relaxation=relaxation,backend=backend
+            )
+        solution = dd.solution
 
-    #set relaxation factors
-    relaxation = 0.9
+    Ap = np.zeros(np.shape(solution))
 
-    #build grid
-    import Grid
-    grid=Grid.grid(nx,ny,verbose=False)
-    #grid.plot()
+    # the incremental assembler and the sparse matrix structure are kept
+    # between iterations. Incremental assembly covers the upwind schemes
+    # with central difference diffusion
+    assembler = None
+    if incrementalAssembly and solver != "decomposed" and not kernels.useNumba(backend) \
+            and convection in ("firstOrderUpwind","secondOrderUpwind") \
+            and diffusion in (None,"centralDifference"):
+        assembler = incremental.assembler\
+            (
+                grid,convection=convection,kinVisc=kinVisc,
+                diffusion=diffusion is not None
+            )
+    source = None
 
+    # the accelerator takes the interior phi before and after each iteration
+    outer = None
+    if accelerator == "anderson":
+        outer = acceleration.anderson(andersonDepth)
+    elif accelerator is not None:
+        outer = acceleration.accelerators[accelerator]()
+    structure = linearSolver.sparsity()
 
-    #solution ordered [x,y,(u,v,phi)]
-    solution=np.zeros((nx+4,ny+4,3))
+    # boundary updates handed to the smoothers are timed as they are called
+    boundary = timer.timed("boundary",bcs.updater(solution,field=2))
 
-    Ap = np.zeros(np.shape(solution))
-    #+1, +1
-    # solution[2:-2,0:2,2]=1.0
-    # solution[:,:,0]=1
-    # solution[:,:,1]=1
-    #-1, -1
-    solution[2:-2,-2:,2]=1.0
-    solution[:,:,0]=-1
-    solution[:,:,1]=-1
+    writer = output.writer\
+        (
+            grid,interval=outputInterval,stride=outputStride,
+            prefix=os.path.join(directory,"sol"),queueSize=outputQueue,
+            policy="skip"
+        )
 
-    maxResiduals = np.zeros(3)
+    monitor = convergence.monitor\
+        (
+            grid,fields=("phi",),absTol=absTol,relTol=relTol,backend=backend
+        )
+    first = 1
+
+    if checkpointDirectory is not None:
+        checkpoints = checkpoint.checkpointer\
+            (
+                checkpointDirectory,interval=checkpointInterval
+            )
+        latest = checkpoints.latest() if restart else None
+        if latest is not None and latest.restoreGrid(grid) is not None:
+            solution[:] = latest["solution"]
+            Ap[:] = latest["Ap"]
+            monitor.restore(latest.state["monitor"])
+            first = latest.state["iteration"] + 1
+            logger.info("Restarting from {}".format(latest.filename))
 
     # begin GS relaxation loop
-    for it in range(1,iterations+1):
-        print("Iteration: {}".format(it))
-
-        olditer=np.copy(solution)
-
-        # loop through non-BC cells
-        for i in range(2,grid.nx+2):
-            for j in range(2,grid.ny+2):
-                #print("\t {0} {1}".format(i,j))
-                phi, Ap[i,j,2] = solve(i,j,grid,solution,kinVisc)
-                phi = solution[i,j,2] * (1 - relaxation) + relaxation * phi
-
-                # +1, +1
-                # solution[-2,2:-2,2]=solution[-3,2:-2,2]
-                # solution[-1,2:-2,2]=solution[-3,2:-2,2]
-                # solution[2:-2,-2,2]=solution[2:-2,-3,2]
-                # solution[2:-2,-1,2]=solution[2:-2,-3,2]
-                # -1, -1
-                solution[2:-2,2,2]=solution[2:-2,3,2]
-                solution[2:-2,1,2]=solution[2:-2,3,2]
-                solution[2,2:-2,2]=solution[3,2:-2,2]
-                solution[1,2:-2,2]=solution[3,2:-2,2]
-                
-                solution[i,j,2] = phi
-
-        maxResiduals = residual(olditer, solution, maxResiduals)
-
-        print("\tResiduals: {0:.6f} {1:.6f} {2:.6f}".format(*maxResiduals))
-        print("\tMax: phi:{0:.5f} ".format(solution[5,-5,1]))
-
-        # plot the solution each N iterations
-        if it % 1 == 0:
-            fig,axs = mpl.subplots(1)
-            rangev = np.linspace(0, 1.0, 9, endpoint=True)
-            cs = axs.contourf\
+    failed = False
+    for it in range(first,iterations+1):
+        logger.info("Iteration: {}".format(it))
+        timer.count("iterations")
+        if outer is not None:
+            previous = grid.interior(solution[:,:,2]).ravel().copy()
+
+        # coefficients only depend on the velocity field, so they are
+        # assembled for the whole grid once per iteration
+        if solver != "decomposed":
+            with timer.phase("assembly",cells=grid.ncells):
+                if assembler is not None:
+                    Apx, Apy = assembler.assemble(solution)
+                else:
+                    Apx, Apy = assembleCase(grid,solution)
+                if deferredScheme is not None:
+                    source = deferred.correction(grid,solution,deferredScheme)
+            if assembler is not None:
+                timer.count("faces reassembled",assembler.last)
+                logger.info("\tfaces re-assembled: {}".format(assembler.last))
+
+        if solver == "decomposed":
+            # assembly, sweep, boundaries and residual all run on the workers
+            with timer.phase("smoothing",cells=grid.ncells):
+                norms = dd.iterate()
+            if norms is None:
+                failed = True
+                break
+        elif solver == "GS":
+            # loop through non-BC cells
+            with timer.phase("smoothing",cells=grid.ncells):
+                kernels.gaussSeidel\
+                    (
+                        grid,Apx,Apy,solution[:,:,2],
+                        relaxation=relaxation,source=source,backend=backend
+                    )
+            Ap[2:-2,2:-2,2] = Apx[:,:,2] + Apy[:,:,2]
+            with timer.phase("boundary"):
+                bcs.apply(solution)
+        elif solver == "multicolor":
+            with timer.phase("smoothing",cells=grid.ncells):
+                kernels.multicolorGaussSeidel\
+                    (
+                        grid,Apx,Apy,solution[:,:,2],
+                        relaxation=relaxation,
+                        source=source,
+                        boundary=boundary,
+                        backend=backend
+                    )
+            Ap[2:-2,2:-2,2] = Apx[:,:,2] + Apy[:,:,2]
+        elif solver in smoothers.smoothers:
+            with timer.phase("smoothing",cells=grid.ncells):
+                smoothers.smoothers[solver]\
+                    (
+                        grid,Apx,Apy,solution[:,:,2],
+                        relaxation=relaxation,
+                        source=source,
+                        boundary=boundary
+                    )
+            Ap[2:-2,2:-2,2] = Apx[:,:,2] + Apy[:,:,2]
+        elif solver == "multigrid":
+            # point smoothers diverge on the convection dominated second
+            # order upwind stencil, line smoothing does not
+            mg = multigrid.multigrid\
                 (
-                    grid.val[1:-1,1:-1,0], 
-                    grid.val[1:-1,1:-1,1], 
-                    solution[1:-1,1:-1,2], 
-                    rangev, 
-                    extend='both', 
-                    cmap=mpl.get_cmap('bwr')
+                    grid,Apx,Apy,
+                    assembler=functools.partial(assembleCase,backend="numpy"),
+                    solution=solution,
+                    smoother="line"
+                )
+            with timer.phase("smoothing",cells=grid.ncells):
+                info = mg.solve\
+                    (
+                        solution[:,:,2],
+                        source=source,
+                        boundary=boundary,
+                        tol=1e-6
+                    )
+            Ap[2:-2,2:-2,2] = Apx[:,:,2] + Apy[:,:,2]
+            timer.count("cycles",info["cycles"])
+            logger.info\
+                (
+                    "\tmultigrid: {levels} levels, {cycles} cycles, "
+                    "rate {convergenceRate:.3f}, setup {setupTime:.4f}s "
+                    "solve {solveTime:.4f}s".format(**info)
+                )
+        else:
+            # solve the whole system at once, with the boundary conditions
+            # folded into the matrix
+            with timer.phase("smoothing",cells=grid.ncells):
+                info = linearSolver.solve\
+                    (
+                        grid,Apx,Apy,solution,field=2,method=solver,source=source,
+                        boundary=bcs,structure=structure
+                    )
+            Ap[2:-2,2:-2,2] = Apx[:,:,2] + Apy[:,:,2]
+            timer.count("linear iterations",info["iterations"])
+            logger.info\
+                (
+                    "\t{method}: {iterations} iterations, residual {residual:.3e}, "
+                    "assemble {assembleTime:.4f}s setup {setupTime:.4f}s "
+                    "solve {solveTime:.4f}s".format(**info)
                 )
-            fig.colorbar(cs, ax=axs, ticks=rangev, cmap=mpl.get_cmap('bwr'))
-            axs.set_title("phi")
-            mpl.scatter(
-                grid.val[:,:,0],
-                grid.val[:,:,1],
-                c='k',
-                s=2
-            )
-            #mpl.plot(grid.val[:,15,0],solution[:,15,2],'k.')
-            mpl.savefig("sol_{0}".format(it))
-            mpl.close()
-
-    fig,axs = mpl.subplots(1)
-    mpl.plot(grid.val[5,2:-2,1],np.flip(np.fliplr(solution[2:-2,2:-2,2]).diagonal()),'k.')
-    mpl.savefig("test.png")
-    mpl.close()
-
 
-def solve(i,j,grid,solution,kinVisc):
+        if outer is not None:
+            with timer.phase("acceleration",cells=grid.ncells):
+                swept = grid.interior(solution[:,:,2]).ravel()
+                grid.interior(solution[:,:,2])[:] = outer.update(previous,swept)\
+                    .reshape(grid.nx,grid.ny)
+                bcs.apply(solution)
+
+        # equation imbalance with this iteration's coefficients
+        with timer.phase("residual",cells=grid.ncells):
+            if solver == "decomposed":
+                monitor.record("phi",*norms)
+            else:
+                # an exact solve zeroes the residual of the lagged correction,
+                # so measure that of the scheme with the new phi
+                if deferredScheme is not None:
+                    source = deferred.correction(grid,solution,deferredScheme)
+                monitor.measure("phi",Apx,Apy,solution[:,:,2],source=source)
+            converged = monitor.update(it)
+
+        logger.info\
+            (
+                "\tResiduals: phi {0:.6e} (relative {1:.6e})".format
+                    (monitor.current["phi"]["scaled"],monitor.relative("phi"))
+            )
+        logger.info("\tMax: phi:{0:.5f} ".format(solution[5,-5,1]))
+
+        # snapshot the solution for the background writer, the
+        # rendering itself happens off the solve loop
+        with timer.phase("output"):
+            writer.submit(it,solution,wait=converged or it == iterations)
+
+        if checkpointDirectory is not None and checkpoints.due(it):
+            with timer.phase("output"):
+                checkpoints.save\
+                    (
+                        it,grid,solution,Ap=Ap,
+                        state={"monitor": monitor.state()}
+                    )
+
+        if converged:
+            logger.info("Converged after {} iterations".format(it))
+            break
+
+    if solver == "decomposed":
+        if not failed:
+            for phase, seconds in dd.phaseTimes().items():
+                logger.info("\tworkers {0}: {1:.4f}s".format(phase,seconds))
+        dd.close()
+        solution = dd.solution
+
+    with timer.phase("output"):
+        stats = writer.close()
+        if historyFile is not None:
+            monitor.export(historyFile)
+    logger.info\
+        (
+            "output: {written} written, {skipped} skipped, "
+            "render {renderTime:.3f}s copy {copyTime:.4f}s".format(**stats)
+        )
+    if failed:
+        return
+
+    if solver in linearSolver.methods:
+        logger.info\
+            (
+                "matrix structure: {builds} built, {refills} refilled".format
+                    (**structure.stats)
+            )
 
-    from interpolate import linear as linInterp
-    from fvSchemes import firstOrderUpwind as FOU
-    from fvSchemes import secondOrderUpwind as SOU
-    from fvSchemes import centralDifference as CD
-    from fvSchemes import linear as linear
+    with timer.phase("output"):
+        fig,axs = mpl.subplots(1)
+        #phi along the cells of the anti-diagonal, from the top left corner
+        cells = np.arange(min(nx,ny))
+        diagonal = (cells,ny-1-cells)
+        mpl.plot(grid.interior(grid.val[:,:,1])[diagonal],grid.interior(solution[:,:,2])[diagonal],'k.')
+        mpl.savefig(os.path.join(directory,"test.png"))
+        mpl.close()
+
+    if summaryFile is not None:
+        logger.info(timer.report(grid="{0}x{1}".format(nx,ny),solver=solver,backend=backend))
+        timer.write(summaryFile,nx=nx,ny=ny,solver=solver,backend=backend)
+
+
+def testCase(nx,ny,precision="double",x=None,y=None,boundaries=None,
+             velocity=(-1.0,-1.0)):
+
+    """
+    builds the convected step test case, shared with benchmark.py
+
+    inputs:
+        nx        (int)       -x gridpoints
+        ny        (int)       -y gridpoints
+        precision (string)    -"double" or "single" solution storage
+        x, y      (ndarray)   -optional face coordinates, see Grid.grid
+        boundaries(dict)      -optional conditions on phi, as read by
+                               Boundary.boundaries.configure
+        velocity  (tuple)     -uniform (u, v)
+    returns:
+        grid      (Grid)      -grid object from Grid.py
+        solution  (ndarray)   -numpy array with solution data [x,y,field]
+        bcs       (boundaries)-Boundary.boundaries of phi, already applied
+    """
+
+    grid=Grid.grid(nx,ny,verbose=False,x=x,y=y)
+
+    #solution ordered [x,y,(u,v,phi)], each field stored as its own
+    #contiguous plane
+    solution=fields.fields(grid,precision=precision).solution
+
+    #boundary conditions on phi, applied to the ghost layers once per sweep
+    bcs = Boundary.boundaries(grid)
+    if boundaries is None:
+        #+1, +1 is the same step with inflow 1.0 on B and 0.0 on L
+        #-1, -1
+        boundaries = defaults["boundaries"]
+    if bcs.configure(boundaries,field=2) is None:
+        return grid, solution, None
+    solution[:,:,0]=velocity[0]
+    solution[:,:,1]=velocity[1]
+
+    bcs.apply(solution)
+
+    return grid, solution, bcs
+
+def solve(i,j,grid,solution,kinVisc,convection="secondOrderUpwind",diffusion=None):
+
+    """
+    per-cell version of assemble, returning the new phi of cell i,j as
+    stencilValue does
+
+    inputs:
+        convection            -scheme of fvSchemes.registry or its name
+        diffusion             -scheme of fvSchemes.registry, its name or None
+    """
+
+    convection = fvSchemes.lookup("convection",convection)
+    diffusion = fvSchemes.lookup("diffusion",diffusion)
 
     #coefficients
     #   these are ordered LL L P R RR (Apx)
@@ -125,36 +602,25 @@ def solve(i,j,grid,solution,kinVisc):
     d_X = grid.width(i,j,'x')
     d_Y = grid.width(i,j,'y')
 
-    # get interpolated velocity * area for convection schemes
-    Ft = linInterp(i,j,grid,solution,neighbor="T",field=1) * d_X
-    Fb = linInterp(i,j,grid,solution,neighbor="B",field=1) * d_X
-    Fl = linInterp(i,j,grid,solution,neighbor="L",field=0) * d_Y
-    Fr = linInterp(i,j,grid,solution,neighbor="R",field=0) * d_Y
-
-    # Apy += Ft * FOU(i,j,grid,velocity=solution[i,j,0:2],facename="T")
-    # Apy += Fb * FOU(i,j,grid,velocity=solution[i,j,0:2],facename="B")
-    # Apx += Fl * FOU(i,j,grid,velocity=solution[i,j,0:2],facename="L")
-    # Apx += Fr * FOU(i,j,grid,velocity=solution[i,j,0:2],facename="R")
+    velocity = solution[i,j,0:2]
 
-    Apy += Ft * SOU(i,j,grid,velocity=solution[i,j,0:2],facename="T")
-    Apy += Fb * SOU(i,j,grid,velocity=solution[i,j,0:2],facename="B")
-    Apx += Fl * SOU(i,j,grid,velocity=solution[i,j,0:2],facename="L")
-    Apx += Fr * SOU(i,j,grid,velocity=solution[i,j,0:2],facename="R")
+    if convection is not None:
+        # get interpolated velocity * area for convection schemes
+        Ft = interpolate.linear(i,j,grid,solution,neighbor="T",field=1) * d_X
+        Fb = interpolate.linear(i,j,grid,solution,neighbor="B",field=1) * d_X
+        Fl = interpolate.linear(i,j,grid,solution,neighbor="L",field=0) * d_Y
+        Fr = interpolate.linear(i,j,grid,solution,neighbor="R",field=0) * d_Y
 
-    # Apy += Ft * linear(i,j,grid,facename="T")
-    # Apy += Fb * linear(i,j,grid,facename="B")
-    # Apx += Fl * linear(i,j,grid,facename="L")
-    # Apx += Fr * linear(i,j,grid,facename="R")
+        Apy += Ft * convection.cellCoefficients(i,j,grid,velocity,"T")
+        Apy += Fb * convection.cellCoefficients(i,j,grid,velocity,"B")
+        Apx += Fl * convection.cellCoefficients(i,j,grid,velocity,"L")
+        Apx += Fr * convection.cellCoefficients(i,j,grid,velocity,"R")
 
-    ########## diffusion tests below ##########
-
-    # diffusion: CD with new Face class
-    # Apy += CD(i,j,grid,facename="T") * kinVisc
-    # Apy += CD(i,j,grid,facename="B") * kinVisc
-    # Apx += CD(i,j,grid,facename="L") * kinVisc
-    # Apx += CD(i,j,grid,facename="R") * kinVisc
-
-    ########## diffusion tests above ##########
+    if diffusion is not None:
+        Apy += diffusion.cellCoefficients(i,j,grid,velocity,"T") * kinVisc
+        Apy += diffusion.cellCoefficients(i,j,grid,velocity,"B") * kinVisc
+        Apx += diffusion.cellCoefficients(i,j,grid,velocity,"L") * kinVisc
+        Apx += diffusion.cellCoefficients(i,j,grid,velocity,"R") * kinVisc
 
     # Ap is always considered to be on the LHS for solivng.
     # so the final discrete equation is:
@@ -163,8 +629,98 @@ def solve(i,j,grid,solution,kinVisc):
     # and any Ap on the right hand side must be reversed
 
     # compute desired value of Up
-    print("{0}-{1}: {2:.3f} {3:.3f} {4:.3f} {5:.3f} {6:.3f} ".format(i,j,*Apx))
-    print("{0}-{1}: {2:.3f} {3:.3f} {4:.3f} {5:.3f} {6:.3f} ".format(i,j,*Apy))
+    if instrumentation.debugEnabled():
+        logger.debug("{0}-{1}: {2:.3f} {3:.3f} {4:.3f} {5:.3f} {6:.3f} ".format(i,j,*Apx))
+        logger.debug("{0}-{1}: {2:.3f} {3:.3f} {4:.3f} {5:.3f} {6:.3f} ".format(i,j,*Apy))
+
+    return stencilValue(i,j,Apx,Apy,solution)
+
+def assemble(grid,solution,kinVisc,backend="numpy",convection="secondOrderUpwind",
+             diffusion=None):
+
+    """
+    whole-grid version of the coefficient assembly in solve, building the
+    coefficients of every non-BC cell in one pass
+
+    inputs:
+        grid      (Grid)      -grid object from Grid.py
+        solution  (ndarray)   -numpy array with solution data [x,y,field]
+        kinVisc   (float)     -kinematic viscosity
+        backend   (string)    -"numpy" or "numba"
+        convection            -scheme of fvSchemes.registry, its name or None
+        diffusion             -scheme of fvSchemes.registry, its name or None
+    returns:
+        Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+        Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+    """
+
+    convectionScheme = fvSchemes.lookup("convection",convection)
+    diffusionScheme = fvSchemes.lookup("diffusion",diffusion)
+    if (convectionScheme is None) != (convection is None):
+        return
+    if (diffusionScheme is None) != (diffusion is None):
+        return
+    convectionName = None if convection is None else convectionScheme.name
+
+    # the compiled kernel covers the upwind schemes and central difference
+    # diffusion
+    if kernels.useNumba(backend) and convectionName in kernels.convectionSchemes \
+            and (diffusion is None or diffusionScheme.name == "centralDifference"):
+        return kernels.assemble\
+            (
+                grid,solution,kinVisc,convection=convectionName,
+                diffusion=diffusion is not None,backend=backend
+            )
+
+    Apx = np.zeros((grid.nx,grid.ny,5))
+    Apy = np.zeros((grid.nx,grid.ny,5))
+
+    velocity = solution[:,:,0:2]
+
+    if convectionScheme is not None:
+        d_X, d_Y = grid.cellWidths()
+
+        # get interpolated velocity * area for convection schemes
+        Ft = (interpolate.linearField(grid,solution,neighbor="T",field=1) * d_X)[:,:,np.newaxis]
+        Fb = (interpolate.linearField(grid,solution,neighbor="B",field=1) * d_X)[:,:,np.newaxis]
+        Fl = (interpolate.linearField(grid,solution,neighbor="L",field=0) * d_Y)[:,:,np.newaxis]
+        Fr = (interpolate.linearField(grid,solution,neighbor="R",field=0) * d_Y)[:,:,np.newaxis]
+
+        Apy += Ft * convectionScheme.coefficients(grid,velocity,"T")
+        Apy += Fb * convectionScheme.coefficients(grid,velocity,"B")
+        Apx += Fl * convectionScheme.coefficients(grid,velocity,"L")
+        Apx += Fr * convectionScheme.coefficients(grid,velocity,"R")
+
+    # central difference diffusion only depends on the geometry and
+    # kinVisc, so it is taken from the operator cache like kernels.assemble
+    if diffusionScheme is not None and diffusionScheme.name == "centralDifference":
+        constant = operators.shared.diffusion(grid,kinVisc)
+        Apx += constant.Apx
+        Apy += constant.Apy
+    elif diffusionScheme is not None:
+        Apy += diffusionScheme.coefficients(grid,velocity,"T") * kinVisc
+        Apy += diffusionScheme.coefficients(grid,velocity,"B") * kinVisc
+        Apx += diffusionScheme.coefficients(grid,velocity,"L") * kinVisc
+        Apx += diffusionScheme.coefficients(grid,velocity,"R") * kinVisc
+
+    return Apx, Apy
+
+def stencilValue(i,j,Apx,Apy,solution):
+
+    """
+    computes the new value of phi at a cell from its coefficients
+    using the final discrete equation Ap*phi_p = sum(An*phi_n)
+
+    inputs:
+        i         (int)       -current gridpoint x index
+        j         (int)       -current gridpoint y index
+        Apx       (ndarray)   -5x1 coefficients ordered LL L P R RR
+        Apy       (ndarray)   -5x1 coefficients ordered BB B P T TT
+        solution  (ndarray)   -numpy array with solution data [x,y,field]
+    returns:
+        value     (float)     -new phi at i,j
+        A_P       (float)     -the cell's Ap coefficient
+    """
 
     A_P = Apy[2] + Apx[2]
 
@@ -183,12 +739,31 @@ def solve(i,j,grid,solution,kinVisc):
 
     return value, A_P
 
-def residual(old, new, maxResiduals):
-    residual = abs(new - old)
-    maxResiduals[0] = np.max(residual[:,:,0])
-    maxResiduals[1] = np.max(residual[:,:,1])
-    maxResiduals[2] = np.max(residual[:,:,2])
-    return maxResiduals
-
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser\
+        (
+            description="convected step test case, with the options of "
+                        "defaults read from an optional JSON case file"
+        )
+    parser.add_argument("case",nargs="?",help="JSON case file")
+    parser.add_argument("--output",help="directory of the results and profiles")
+    parser.add_argument\
+        (
+            "--profile",choices=instrumentation.profilers,
+            help="profile the run, written next to the results"
+        )
+    parser.add_argument\
+        (
+            "--timing",action="store_true",
+            help="time the phases of the run, written to summary.json"
+        )
+    args = parser.parse_args()
+
+    case = {} if args.case is None else readCase(args.case)
+    if args.output is not None:
+        case["outputDirectory"] = args.output
+    if args.profile is not None:
+        case["profile"] = args.profile
+    if args.timing:
+        case["timing"] = True
+    main(case)
\ No newline at end of file
@@ -0,0 +1,619 @@
+"""
+    steady laminar incompressible Navier-Stokes by SIMPLE or SIMPLEC
+    pressure-velocity coupling on a collocated Grid.grid
+
+    the solution array holds [x,y,(u,v,p)], p being the kinematic pressure
+    p/rho, so the density never appears. Every outer iteration
+
+        assembles the momentum equations of u and v, which share their
+        coefficients: the constant viscous part from the operator cache and
+        first-order upwind convection of the face fluxes, with an optional
+        deferred correction to one of deferred.schemes
+        solves both with one factorization of the shared matrix
+        interpolates face fluxes with Rhie-Chow, so that the face velocity
+        sees the pressure difference across the face rather than the
+        average of the cell gradients, which would decouple odd and even
+        cells on the collocated grid
+        solves the pressure-correction equation with the sparse solvers of
+        linearSolver or multigrid, reusing the matrix structure
+        corrects the face fluxes, cell velocities and pressure
+
+    SIMPLEC takes the velocity correction coefficient as V / (A_P - sum A_n)
+    and needs no pressure under-relaxation, which allows a larger momentum
+    relaxation and several times fewer outer iterations. Only closed domains are
+    handled: every side is a wall with a fixed tangential velocity, the wall
+    value taken on the boundary face, and no flux through it. The pressure
+    is fixed to zero at the first cell.
+
+    run this file for the lid-driven cavity benchmark at Re = 100, 400 and
+    1000, which reports the time per outer iteration and the largest
+    difference of the centerline velocity to Ghia, Ghia & Shin (1982):
+        python simple.py [cells]
+"""
+
+import time
+import numpy as np
+import scipy.sparse.linalg as spla
+
+import Boundary
+import convergence
+import deferred
+import fields
+import instrumentation
+import linearSolver
+import multigrid
+import operators
+from instrumentation import logger
+
+algorithms = ("SIMPLE", "SIMPLEC")
+
+pressureSolvers = linearSolver.methods + ("multigrid",)
+
+# u along the vertical centerline of the lid-driven cavity, Ghia, Ghia &
+# Shin (1982) table I
+ghiaY = np.array([
+    1.0000, 0.9766, 0.9688, 0.9609, 0.9531, 0.8516, 0.7344, 0.6172, 0.5000,
+    0.4531, 0.2813, 0.1719, 0.1016, 0.0703, 0.0625, 0.0547, 0.0000,
+])
+ghiaU = {
+    100: np.array([
+        1.00000, 0.84123, 0.78871, 0.73722, 0.68717, 0.23151, 0.00332,
+        -0.13641, -0.20581, -0.21090, -0.15662, -0.10150, -0.06434,
+        -0.04775, -0.04192, -0.03717, 0.00000,
+    ]),
+    400: np.array([
+        1.00000, 0.75837, 0.68439, 0.61756, 0.55892, 0.29093, 0.16256,
+        0.02135, -0.11477, -0.17119, -0.32726, -0.24299, -0.14612,
+        -0.10338, -0.09266, -0.08186, 0.00000,
+    ]),
+    1000: np.array([
+        1.00000, 0.65928, 0.57492, 0.51117, 0.46604, 0.33304, 0.18719,
+        0.05702, -0.06080, -0.10648, -0.27805, -0.38289, -0.29730,
+        -0.22220, -0.20196, -0.18109, 0.00000,
+    ]),
+}
+
+def gradient(grid,solution,field):
+
+    """
+        Gauss gradient of one field in every non-BC cell, from the linearly
+        interpolated face values
+
+        returns:
+            gradient  (ndarray)   -(nx,ny,2) x and y derivatives
+    """
+
+    from interpolate import linearField as linInterp
+
+    d_X, d_Y = grid.cellWidths()
+    return np.stack\
+        (
+            (
+                (linInterp(grid,solution,neighbor="R",field=field) - \
+                 linInterp(grid,solution,neighbor="L",field=field)) / d_X,
+                (linInterp(grid,solution,neighbor="T",field=field) - \
+                 linInterp(grid,solution,neighbor="B",field=field)) / d_Y
+            ),
+            axis=-1
+        )
+
+def faceGradient(phi,table):
+
+    """
+        derivative of a padded field along the axis of one face, from the
+        two cells either side of it
+    """
+
+    flat = np.ravel(phi)
+    return (flat[table.neighbor] - flat[table.owner]) / table.distance * table.sign
+
+def interiorFaces(grid):
+    # per face name, the cells whose face lies inside the domain
+    inside = {}
+    for name, table in grid.faces.items():
+        mask = np.ones((grid.nx,grid.ny),dtype=bool)
+        wall = [slice(None),slice(None)]
+        wall[table.axis] = 0 if table.sign < 0 else -1
+        mask[tuple(wall)] = False
+        inside[name] = mask
+    return inside
+
+def pressureCoefficients(grid,d,inside=None):
+
+    """
+        coefficients of the pressure-correction equation,
+            sum_faces d_f A_f / distance (p'_P - p'_N) = -net outflow
+        with no correction flux through the walls. Only differences of the
+        pressure are defined, so the correction of the first cell is tied
+        to zero
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            d         (ndarray)   -(nx+4,ny+4,1) velocity correction
+                                   coefficient V / A_P
+            inside    (dict)      -interiorFaces of the grid, if already known
+        returns:
+            Apx, Apy  (ndarray)   -(nx,ny,5) coefficients
+    """
+
+    from interpolate import linearField as linInterp
+
+    if inside is None:
+        inside = interiorFaces(grid)
+    Apx = np.zeros((grid.nx,grid.ny,5))
+    Apy = np.zeros((grid.nx,grid.ny,5))
+    for name, table in grid.faces.items():
+        Apn = Apx if table.axis == 0 else Apy
+        faceD = linInterp(grid,d,neighbor=name,field=0)
+        coefficient = np.where(inside[name],faceD * table.area / table.distance,0.0)
+        Apn[:,:,2] += coefficient
+        Apn[:,:,table.neighborApn] += coefficient
+
+    Apx[0,0,2] += Apx[0,0,2] + Apy[0,0,2]
+    return Apx, Apy
+
+class simple:
+
+    def __init__(self,grid,solution,walls,kinVisc,algorithm="SIMPLE",
+                 velocityRelaxation=None,pressureRelaxation=None,convection=None,
+                 momentumSolver="lu",pressureSolver="lu",linearTol=1e-6):
+
+        """
+        pressure-velocity coupled solver of one case
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,(u,v,p)],
+                                   updated in place
+            walls     (dict)      -side (TBLR): (u,v) velocity of its wall
+            kinVisc   (float)     -kinematic viscosity
+            algorithm (string)    -"SIMPLE" or "SIMPLEC"
+            velocityRelaxation (float)
+                                  -implicit under-relaxation of momentum,
+                                   None for 0.7 with SIMPLE and 0.9 with
+                                   SIMPLEC
+            pressureRelaxation (float)
+                                  -pressure correction factor, None for 0.3
+                                   with SIMPLE and 1 with SIMPLEC
+            convection(string)    -None for first-order upwind, or one of
+                                   deferred.schemes as a deferred correction
+            momentumSolver(string)-one of linearSolver.methods
+            pressureSolver(string)-one of linearSolver.methods, or "multigrid"
+                                   for BiCGSTAB preconditioned by multigrid
+            linearTol (float)     -relative tolerance of the iterative solves
+        """
+
+        if algorithm not in algorithms:
+            print("ERROR: pressure-velocity algorithm not known: {}".format(algorithm))
+            return
+        if convection is not None and convection not in deferred.schemes:
+            print("ERROR: deferred correction scheme not known: {}".format(convection))
+            return
+        if momentumSolver not in linearSolver.methods:
+            print("ERROR: linear solver not known: {}".format(momentumSolver))
+            return
+        if pressureSolver not in pressureSolvers:
+            print("ERROR: linear solver not known: {}".format(pressureSolver))
+            return
+        for side in Boundary.sides:
+            if side not in walls:
+                print("ERROR: no wall velocity given for side: {}".format(side))
+                return
+
+        if velocityRelaxation is None:
+            velocityRelaxation = 0.7 if algorithm == "SIMPLE" else 0.9
+        if pressureRelaxation is None:
+            pressureRelaxation = 0.3 if algorithm == "SIMPLE" else 1.0
+
+        self.grid = grid
+        self.solution = solution
+        self.walls = walls
+        self.kinVisc = kinVisc
+        self.algorithm = algorithm
+        self.velocityRelaxation = velocityRelaxation
+        self.pressureRelaxation = pressureRelaxation
+        self.convection = convection
+        self.momentumSolver = momentumSolver
+        self.pressureSolver = pressureSolver
+        self.linearTol = linearTol
+
+        # ghost cells hold the wall velocity, for the deferred correction,
+        # and a zero gradient pressure, for the cell gradients
+        self.bcs = Boundary.boundaries(grid)
+        for side in Boundary.sides:
+            self.bcs.set(side,Boundary.dirichlet(walls[side][0]),field=0)
+            self.bcs.set(side,Boundary.dirichlet(walls[side][1]),field=1)
+            self.bcs.set(side,Boundary.neumann(),field=2)
+        self.bcs.apply(solution)
+
+        # faces on the domain boundary are walls and never carry a flux
+        self.inside = interiorFaces(grid)
+
+        self.flux = {name: np.zeros((grid.nx,grid.ny)) for name in grid.faces}
+        d_X, d_Y = grid.cellWidths()
+        self.volume = d_X * d_Y
+        self.viscousApx, self.viscousApy, self.viscousSource = self.viscous()
+
+        # padded work arrays: the velocity correction coefficient d, the
+        # cell pressure gradient and the pressure correction
+        self.d = np.zeros((grid.nx+4,grid.ny+4,1))
+        self.pressureGradient = np.zeros((grid.nx+4,grid.ny+4,2))
+        self.correction = np.zeros((grid.nx+4,grid.ny+4,1))
+        self.correctionBcs = Boundary.boundaries(grid)
+        for side in Boundary.sides:
+            self.correctionBcs.set(side,Boundary.neumann(),field=0)
+
+        self.momentumStructure = linearSolver.sparsity()
+        self.pressureStructure = linearSolver.sparsity()
+        self.monitor = convergence.monitor(grid,fields=("u","v","mass"))
+        self.timer = instrumentation.timers()
+        self.iterationTimes = []
+        self.iteration = 0
+
+    def viscous(self):
+
+        """
+        the constant viscous coefficients of the momentum equations. The
+        cached diffusion takes the ghost value a cell away, so on the walls
+        the ghost coefficient is replaced by twice its value on A_P and the
+        wall velocity over the half cell to the boundary face
+
+        returns:
+            Apx, Apy  (ndarray)   -(nx,ny,5) coefficients
+            source    (ndarray)   -(2,nx,ny) wall source of u and v
+        """
+
+        grid = self.grid
+        constant = operators.shared.diffusion(grid,self.kinVisc)
+        Apx = np.array(constant.Apx)
+        Apy = np.array(constant.Apy)
+        source = np.zeros((2,grid.nx,grid.ny))
+
+        for side in Boundary.sides:
+            table = grid.faces[side]
+            Apn = Apx if table.axis == 0 else Apy
+            wall = ~self.inside[side]
+            coefficient = Apn[wall,table.neighborApn]
+            Apn[wall,2] += coefficient
+            Apn[wall,table.neighborApn] = 0.0
+            for component in (0,1):
+                source[component][wall] += 2 * coefficient * self.walls[side][component]
+
+        return Apx, Apy, source
+
+    def momentum(self):
+
+        """
+        under-relaxed momentum coefficients of the current face fluxes
+
+        returns:
+            Apx, Apy  (ndarray)   -(nx,ny,5) coefficients shared by u and v
+            source    (ndarray)   -(2,nx,ny) source of u and v
+        """
+
+        grid = self.grid
+        solution = self.solution
+        Apx = self.viscousApx.copy()
+        Apy = self.viscousApy.copy()
+        source = self.viscousSource.copy()
+
+        for name, table in grid.faces.items():
+            Apn = Apx if table.axis == 0 else Apy
+            outward = table.sign * self.flux[name]
+            # first-order upwind: outflow on P, inflow from the neighbor
+            Apn[:,:,2] += np.maximum(outward,0.0)
+            Apn[:,:,table.neighborApn] += np.maximum(-outward,0.0)
+            if self.convection is not None:
+                upstream = 1 - np.sign(self.flux[name]).astype(int)
+                for component in (0,1):
+                    upwind, value = deferred.faceValues\
+                        (
+                            grid,solution[:,:,component],table,upstream,
+                            self.convection
+                        )
+                    source[component] -= outward * (value - upwind)
+
+        pressureGradient = grid.interior(self.pressureGradient)
+        for component in (0,1):
+            source[component] -= pressureGradient[:,:,component] * self.volume
+
+        # implicit under-relaxation, A_P / alpha with the difference made up
+        # from the previous velocity
+        A_P = Apx[:,:,2] + Apy[:,:,2]
+        relaxed = A_P / self.velocityRelaxation
+        Apx[:,:,2] += relaxed - A_P
+        for component in (0,1):
+            source[component] += (relaxed - A_P) * grid.interior(solution[:,:,component])
+
+        return Apx, Apy, source
+
+    def solveMomentum(self,Apx,Apy,source):
+        # u and v share the matrix, so it is built and factored once
+        grid = self.grid
+        A = self.momentumStructure.matrix(grid,Apx,Apy,field=0)
+        if self.momentumSolver == "lu":
+            factor = spla.splu(A.tocsc())
+        else:
+            ilu = spla.spilu(A.tocsc())
+            preconditioner = spla.LinearOperator(A.shape,ilu.solve)
+
+        for component in (0,1):
+            b = linearSolver.rightHandSide\
+                (
+                    grid,Apx,Apy,self.solution,field=component,
+                    source=source[component]
+                )
+            if self.momentumSolver == "lu":
+                x = factor.solve(b)
+            else:
+                x, info = linearSolver.solveMatrix\
+                    (
+                        A,b,x0=grid.interior(self.solution[:,:,component]).ravel(),
+                        method=self.momentumSolver,tol=self.linearTol,
+                        preconditioner=preconditioner
+                    )
+            grid.interior(self.solution[:,:,component])[:] = x.reshape(grid.nx,grid.ny)
+        self.bcs.apply(self.solution,fields=[0,1])
+
+    def rhieChow(self):
+
+        """
+        face fluxes of the current velocity and pressure,
+            u_f = mean(u) - mean(d) (dp/dn - mean(grad p) . n)
+        zero on the walls
+        """
+
+        from interpolate import linearField as linInterp
+
+        grid = self.grid
+        pressure = self.solution[:,:,2]
+        for name, table in grid.faces.items():
+            velocity = linInterp(grid,self.solution,neighbor=name,field=table.axis)
+            d = linInterp(grid,self.d,neighbor=name,field=0)
+            average = linInterp(grid,self.pressureGradient,neighbor=name,field=table.axis)
+            velocity -= d * (faceGradient(pressure,table) - average)
+            self.flux[name] = np.where(self.inside[name],velocity * table.area,0.0)
+
+    def pressureEquation(self):
+
+        """
+        pressure-correction coefficients, and the mass imbalance of the
+        current face fluxes as its source
+
+        returns:
+            Apx, Apy  (ndarray)   -(nx,ny,5) coefficients
+            source    (ndarray)   -(nx,ny) minus the net outflow of each cell
+        """
+
+        Apx, Apy = pressureCoefficients(self.grid,self.d,self.inside)
+        source = np.zeros((self.grid.nx,self.grid.ny))
+        for name, table in self.grid.faces.items():
+            source -= table.sign * self.flux[name]
+        return Apx, Apy, source
+
+    def solvePressure(self,Apx,Apy,source):
+        # returns the Krylov iterations taken
+        self.correction[:] = 0.0
+        method = self.pressureSolver
+        options = {}
+        if method == "multigrid":
+            # BiCGSTAB preconditioned by one V-cycle, whose coarse levels are
+            # re-discretized from the volume averaged d. On its own the
+            # V-cycle converges slowly on the nearly singular operator
+            mg = multigrid.multigrid\
+                (
+                    self.grid,Apx,Apy,assembler=pressureCoefficients,
+                    solution=self.d
+                )
+            method = "bicgstab"
+            options["preconditioner"] = mg.asPreconditioner()
+        info = linearSolver.solve\
+            (
+                self.grid,Apx,Apy,self.correction,field=0,method=method,
+                source=source,structure=self.pressureStructure,
+                tol=self.linearTol,**options
+            )
+        return info["iterations"]
+
+    def correct(self):
+        # corrects the fluxes, velocities and pressure with the solved p'
+        from interpolate import linearField as linInterp
+
+        grid = self.grid
+        solution = self.solution
+        self.correctionBcs.apply(self.correction)
+
+        correctionGradient = gradient(grid,self.correction,0)
+        d = grid.interior(self.d[:,:,0])
+        for component in (0,1):
+            grid.interior(solution[:,:,component])[:] -= d * correctionGradient[:,:,component]
+        self.bcs.apply(solution,fields=[0,1])
+
+        for name, table in grid.faces.items():
+            faceD = linInterp(grid,self.d,neighbor=name,field=0)
+            change = faceD * faceGradient(self.correction[:,:,0],table) * table.area
+            self.flux[name] = np.where(self.inside[name],self.flux[name] - change,0.0)
+
+        solution[:,:,2] += self.pressureRelaxation * self.correction[:,:,0]
+        solution[:,:,2] -= solution[2,2,2]
+        self.bcs.apply(solution,fields=[2])
+
+    def iterate(self):
+
+        """
+        one outer iteration
+
+        returns:
+            converged (bool)      -whether the momentum and mass residuals
+                                   meet the monitor's tolerances
+        """
+
+        start = time.perf_counter()
+        grid = self.grid
+        solution = self.solution
+        timer = self.timer
+        self.iteration += 1
+
+        with timer.phase("momentum assembly",cells=grid.ncells):
+            grid.interior(self.pressureGradient)[:] = gradient(grid,solution,2)
+            Apx, Apy, source = self.momentum()
+            # residuals of the momentum equations before they are solved
+            self.monitor.measure("u",Apx,Apy,solution[:,:,0],source=source[0])
+            self.monitor.measure("v",Apx,Apy,solution[:,:,1],source=source[1])
+
+        with timer.phase("momentum solve",cells=grid.ncells):
+            self.solveMomentum(Apx,Apy,source)
+
+        with timer.phase("pressure assembly",cells=grid.ncells):
+            A_P = Apx[:,:,2] + Apy[:,:,2]
+            if self.algorithm == "SIMPLEC":
+                neighbors = Apx.sum(axis=2) + Apy.sum(axis=2) - A_P
+                A_P = A_P - neighbors
+            grid.interior(self.d[:,:,0])[:] = self.volume / A_P
+            self.rhieChow()
+            pApx, pApy, imbalance = self.pressureEquation()
+            total = sum(np.abs(flux).sum() for flux in self.flux.values()) / 2
+            self.monitor.record\
+                (
+                    "mass",np.abs(imbalance).sum(),np.linalg.norm(imbalance),
+                    np.abs(imbalance).max(),total
+                )
+
+        with timer.phase("pressure solve",cells=grid.ncells):
+            steps = self.solvePressure(pApx,pApy,imbalance)
+            timer.count("pressure iterations",steps)
+
+        with timer.phase("correction",cells=grid.ncells):
+            self.correct()
+
+        converged = self.monitor.update(self.iteration)
+        self.iterationTimes.append(time.perf_counter() - start)
+        timer.count("iterations")
+
+        current = self.monitor.current
+        logger.info\
+            (
+                "Iteration {0}: u {1:.3e} v {2:.3e} mass {3:.3e}  {4:.4f}s".format
+                    (
+                        self.iteration,current["u"]["scaled"],current["v"]["scaled"],
+                        current["mass"]["scaled"],self.iterationTimes[-1]
+                    )
+            )
+        return converged
+
+    def solve(self,iterations=2000,absTol=1e-6,relTol=None):
+
+        """
+        outer iterations until the scaled residuals of u, v and mass are
+        below absTol, or below relTol times those of the first iteration
+
+        returns:
+            info      (dict)      -iterations, convergence, total seconds
+                                   and seconds per outer iteration
+        """
+
+        self.monitor.absTol = absTol
+        self.monitor.relTol = relTol
+        converged = False
+        first = self.iteration
+        for it in range(iterations):
+            converged = self.iterate()
+            if converged:
+                break
+
+        times = self.iterationTimes[first:]
+        return {
+            "iterations": len(times),
+            "converged": converged,
+            "seconds": float(np.sum(times)),
+            "secondsPerIteration": float(np.mean(times)) if times else 0.0,
+        }
+
+def lidDrivenCavity(n,precision="double"):
+
+    """
+    the unit square cavity, its lid the top wall moving at u = 1
+
+    inputs:
+        n         (int)       -cells in each direction
+        precision (string)    -"double" or "single" solution storage
+    returns:
+        grid      (Grid)      -grid object from Grid.py
+        solution  (ndarray)   -numpy array with solution data [x,y,(u,v,p)]
+        walls     (dict)      -side: (u,v) wall velocity
+    """
+
+    import Grid
+    grid = Grid.grid(n,n)
+    solution = fields.fields(grid,names=("u","v","p"),precision=precision).solution
+    walls = {"T": (1.0,0.0), "B": (0.0,0.0), "L": (0.0,0.0), "R": (0.0,0.0)}
+    return grid, solution, walls
+
+def centerline(grid,solution):
+
+    """
+    u along the vertical line x = 0.5, interpolated between the two columns
+    of cells either side of it, with the wall values at both ends
+
+    returns:
+        y         (ndarray)   -heights, from 0 to 1
+        u         (ndarray)   -u at those heights
+    """
+
+    x = grid.val[2:-2,2,0]
+    column = int(np.clip(np.searchsorted(x,0.5) - 1,0,grid.nx-2))
+    weight = (0.5 - x[column]) / (x[column+1] - x[column])
+    u = grid.interior(solution[:,:,0])
+    u = (1 - weight) * u[column] + weight * u[column+1]
+
+    y = np.concatenate(([0.0],grid.val[2,2:-2,1],[1.0]))
+    u = np.concatenate(([0.0],u,[1.0]))
+    return y, u
+
+def ghiaError(grid,solution,Re):
+    # largest difference of the centerline u to Ghia et al. at their heights
+    y, u = centerline(grid,solution)
+    return float(np.abs(np.interp(ghiaY,y,u) - ghiaU[Re]).max())
+
+def cavityBenchmark(n=64,reynolds=(100,400,1000),algorithm="SIMPLE",
+                    pressureSolver="lu",convection="secondOrderUpwind",
+                    iterations=3000,absTol=1e-6):
+
+    """
+        solves the lid-driven cavity at each Reynolds number
+
+        returns:
+            results   (dict)      -per Re the iterations, time per outer
+                                   iteration, the time of each phase and the
+                                   centerline error to Ghia et al.
+    """
+
+    results = {}
+    for Re in reynolds:
+        grid, solution, walls = lidDrivenCavity(n)
+        solver = simple\
+            (
+                grid,solution,walls,1.0/Re,algorithm=algorithm,
+                convection=convection,pressureSolver=pressureSolver
+            )
+        info = solver.solve(iterations=iterations,absTol=absTol)
+        info["phases"] = dict(solver.timer.totals)
+        info["error"] = ghiaError(grid,solution,Re)
+        results[Re] = info
+    return results
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    for algorithm in algorithms:
+        for Re, info in cavityBenchmark(n,algorithm=algorithm).items():
+            print\
+                (
+                    "{0:<8} Re {1:>5}: {2:>5} iterations{3}  {4:.4f}s per iteration  "
+                    "centerline error {5:.4f}".format
+                        (
+                            algorithm,Re,info["iterations"],
+                            "" if info["converged"] else " (not converged)",
+                            info["secondsPerIteration"],info["error"]
+                        )
+                )
@@ -0,0 +1,303 @@
+"""
+    vectorized relaxation of the discrete equation Ap*phi_p = sum(An*phi_n)
+    over every non-BC cell, as a faster alternative to the point
+    Gauss-Seidel loop in run_CD_test
+
+    every smoother works on a padded (nx+4,ny+4) phi array in place, such as
+    solution[:,:,2], and keeps the under-relaxation of the GS loop:
+        phi = phi * (1 - relaxation) + relaxation * phi_new
+"""
+
+import numpy as np
+import scipy.linalg
+
+# (direction, Ap slot, shift) of each neighbor, ordered LL L R RR and BB B T TT
+stencilShifts = (
+    ("x", 0, -2),
+    ("x", 1, -1),
+    ("x", 3, 1),
+    ("x", 4, 2),
+    ("y", 0, -2),
+    ("y", 1, -1),
+    ("y", 3, 1),
+    ("y", 4, 2),
+)
+
+def stencilReach(Apx,Apy):
+
+    """
+        returns how many cells away the stencil reaches, 1 for the 5-point
+        schemes and 2 when any LL/RR/BB/TT coefficient is used
+
+        inputs:
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+        returns:
+            reach     (int)       -1 or 2
+    """
+
+    if Apx[:,:,[0,4]].any() or Apy[:,:,[0,4]].any():
+        return 2
+    return 1
+
+def neighborSum(grid,Apx,Apy,phi,si=slice(None),sj=slice(None)):
+
+    """
+        computes sum(An*phi_n) for a block of non-BC cells
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field
+            si        (slice)     -x slice of the non-BC cells to sum over
+            sj        (slice)     -y slice of the non-BC cells to sum over
+        returns:
+            total     (ndarray)   -sum over the block
+    """
+
+    istart, istop, istep = si.indices(grid.nx)
+    jstart, jstop, jstep = sj.indices(grid.ny)
+
+    total = np.zeros_like(Apx[si,sj,2])
+    for direction, slot, shift in stencilShifts:
+        coefficient = Apx[si,sj,slot] if direction == "x" else Apy[si,sj,slot]
+        di, dj = (shift,0) if direction == "x" else (0,shift)
+        total += coefficient * phi\
+            [
+                2+istart+di:2+istop+di:istep,
+                2+jstart+dj:2+jstop+dj:jstep
+            ]
+
+    return total
+
+def residual(grid,Apx,Apy,phi,source=None):
+
+    """
+        computes the residual sum(An*phi_n) + source - Ap*phi_p of every
+        non-BC cell
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field
+            source    (ndarray)   -optional (nx,ny) explicit source term
+        returns:
+            r         (ndarray)   -(nx,ny) residual
+    """
+
+    r = neighborSum(grid,Apx,Apy,phi)
+    if source is not None:
+        r += source
+    r -= (Apx[:,:,2] + Apy[:,:,2]) * grid.interior(phi)
+    return r
+
+def colorBlocks(grid,ncolors):
+
+    """
+        splits the non-BC cells into ncolors colors by (i+j) % ncolors so
+        no two cells of one color share a stencil. Two colors (red-black)
+        decouple the 5-point stencil, while the second-order upwind stencil
+        reaches two cells away and needs three. Each color is returned as
+        a list of strided (x slice, y slice) blocks.
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            ncolors   (int)       -number of colors
+        returns:
+            colors    (list)      -list of ncolors lists of slice pairs
+    """
+
+    colors = []
+    for color in range(ncolors):
+        blocks = []
+        for start in range(ncolors):
+            blocks.append\
+                (
+                    (
+                        slice(start,grid.nx,ncolors),
+                        slice((color - start) % ncolors,grid.ny,ncolors)
+                    )
+                )
+        colors.append(blocks)
+    return colors
+
+def multicolorGaussSeidel(grid,Apx,Apy,phi,relaxation=1.0,source=None,
+                          boundary=None,sweeps=1):
+
+    """
+        red-black (or three-color for second-order stencils) Gauss-Seidel,
+        updating every cell of one color at once with numpy slicing
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field, updated in place
+            relaxation(float)     -under-relaxation factor
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (callable)  -optional, called after every color to
+                                   update the ghost cells
+            sweeps    (int)       -number of sweeps to perform
+    """
+
+    A_P = Apx[:,:,2] + Apy[:,:,2]
+    colors = colorBlocks(grid,stencilReach(Apx,Apy) + 1)
+    inner = grid.interior(phi)
+
+    for sweep in range(sweeps):
+        for blocks in colors:
+            for si, sj in blocks:
+                total = neighborSum(grid,Apx,Apy,phi,si,sj)
+                if source is not None:
+                    total += source[si,sj]
+                inner[si,sj] = inner[si,sj] * (1 - relaxation) + \
+                    relaxation * total / A_P[si,sj]
+            if boundary is not None:
+                boundary()
+
+def jacobi(grid,Apx,Apy,phi,relaxation=2/3,source=None,boundary=None,sweeps=1):
+
+    """
+        weighted Jacobi, updating every cell from the previous sweep's values
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field, updated in place
+            relaxation(float)     -Jacobi weight
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (callable)  -optional, called after every sweep to
+                                   update the ghost cells
+            sweeps    (int)       -number of sweeps to perform
+    """
+
+    A_P = Apx[:,:,2] + Apy[:,:,2]
+    inner = grid.interior(phi)
+
+    for sweep in range(sweeps):
+        total = neighborSum(grid,Apx,Apy,phi)
+        if source is not None:
+            total += source
+        inner[:] = inner * (1 - relaxation) + relaxation * total / A_P
+        if boundary is not None:
+            boundary()
+
+def solveLines(diagonal,lower2,lower1,upper1,upper2,rhs):
+
+    """
+        solves a batch of independent penta-diagonal systems, one per row of
+        the inputs, as a single banded system
+
+        inputs:
+            diagonal  (ndarray)   -(nlines,n) main diagonal
+            lower2    (ndarray)   -(nlines,n) coefficient of the unknown two before
+            lower1    (ndarray)   -(nlines,n) coefficient of the unknown one before
+            upper1    (ndarray)   -(nlines,n) coefficient of the unknown one after
+            upper2    (ndarray)   -(nlines,n) coefficient of the unknown two after
+            rhs       (ndarray)   -(nlines,n) right hand side
+        returns:
+            x         (ndarray)   -(nlines,n) solution
+    """
+
+    # lower and upper coefficients must be zero where they would leave the
+    # line, so the lines stay uncoupled when stacked end to end
+    size = diagonal.size
+    ab = np.zeros((5,size))
+    ab[0,2:] = upper2.ravel()[:-2]
+    ab[1,1:] = upper1.ravel()[:-1]
+    ab[2,:]  = diagonal.ravel()
+    ab[3,:-1] = lower1.ravel()[1:]
+    ab[4,:-2] = lower2.ravel()[2:]
+
+    x = scipy.linalg.solve_banded((2,2),ab,rhs.ravel(),check_finite=False)
+    return x.reshape(diagonal.shape)
+
+def lineSweep(grid,Apx,Apy,phi,direction,relaxation,source):
+
+    """
+        solves every line in one direction implicitly, with the neighbors
+        off the line taken from the current phi
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field, updated in place
+            direction (string)    -"x" for rows of constant j, "y" for columns
+            relaxation(float)     -under-relaxation factor
+            source    (ndarray)   -optional (nx,ny) explicit source term
+    """
+
+    rhs = neighborSum(grid,Apx,Apy,phi)
+    if source is not None:
+        rhs += source
+
+    if direction == "x":
+        Apn = Apx
+        n = grid.nx
+        position = np.arange(n)[:,np.newaxis]
+    else:
+        Apn = Apy
+        n = grid.ny
+        position = np.arange(n)[np.newaxis,:]
+
+    # move the on-line neighbors that are not ghost cells into the matrix
+    bands = {}
+    for slot, shift in ((0,-2),(1,-1),(3,1),(4,2)):
+        inside = (position + shift >= 0) & (position + shift < n)
+        coefficient = np.where(inside,Apn[:,:,slot],0.0)
+        di, dj = (shift,0) if direction == "x" else (0,shift)
+        rhs -= coefficient * grid.interior(phi,di,dj)
+        bands[slot] = -coefficient
+
+    diagonal = Apx[:,:,2] + Apy[:,:,2]
+
+    # the banded solver wants each line contiguous
+    if direction == "x":
+        lines = solveLines\
+            (
+                diagonal.T,bands[0].T,bands[1].T,bands[3].T,bands[4].T,rhs.T
+            ).T
+    else:
+        lines = solveLines\
+            (
+                diagonal,bands[0],bands[1],bands[3],bands[4],rhs
+            )
+
+    inner = grid.interior(phi)
+    inner[:] = inner * (1 - relaxation) + relaxation * lines
+
+def lineRelaxation(grid,Apx,Apy,phi,relaxation=1.0,source=None,
+                   boundary=None,sweeps=1):
+
+    """
+        alternating-direction line relaxation, solving all rows and then all
+        columns implicitly with a penta-diagonal banded solver
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            Apx       (ndarray)   -(nx,ny,5) coefficients ordered LL L P R RR
+            Apy       (ndarray)   -(nx,ny,5) coefficients ordered BB B P T TT
+            phi       (ndarray)   -(nx+4,ny+4) padded field, updated in place
+            relaxation(float)     -under-relaxation factor
+            source    (ndarray)   -optional (nx,ny) explicit source term
+            boundary  (callable)  -optional, called after every direction to
+                                   update the ghost cells
+            sweeps    (int)       -number of sweeps to perform
+    """
+
+    for sweep in range(sweeps):
+        for direction in ("x","y"):
+            lineSweep(grid,Apx,Apy,phi,direction,relaxation,source)
+            if boundary is not None:
+                boundary()
+
+# smoothers selectable by name from the drivers
+smoothers = {
+    "multicolor": multicolorGaussSeidel,
+    "jacobi": jacobi,
+    "line": lineRelaxation,
+}
@@ -0,0 +1,518 @@
+"""
+    implicit time stepping of the convection-diffusion of one field,
+
+        V dphi/dt = R(phi) = sum(An*phi_n) + source - Ap*phi_p
+
+    R being the steady operator of kernels.assemble, convection at the
+    velocity of the solution, which stays frozen through a run, plus
+    diffusion. Every scheme adds a mass term c V to A_P and moves the older
+    levels to the source:
+
+        implicitEuler   c = 1/dt            source V/dt phi^n
+        BDF2            c = (1+2w)/(1+w)/dt source V/dt ((1+w) phi^n
+                                                 - w^2/(1+w) phi^n-1)
+                        with w = dt / dt_n-1, implicit Euler on the first step
+        CrankNicolson   c = 2/dt            source 2V/dt phi^n + R(phi^n)
+
+    so a step is a solve of the steady operator plus the mass term. Those
+    are kept per value of c, each with its matrix and factorization (see
+    operators.operator), so steps of a time step met before only build a
+    right hand side.
+
+    the time step adapts to an estimate of the local error, the Milne
+    device: the difference between the solution and the extrapolation of
+    the previous levels, scaled by the error constants of the scheme and
+    predictor. Steps whose error is above errorTol are repeated with a
+    smaller dt. New time steps are rounded down to dt0 * 2^(k/levels), one level
+    per doubling by default, and accepted
+    steps never shrink dt, so a run only meets a handful of distinct
+    systems. dt can also be capped at a Courant number. Implicit steps are
+    not limited by the explicit stability limit of explicitLimit, which is
+    where compare() finds the savings in wall time. Crank-Nicolson is not
+    L-stable, so at very large steps its stiff modes decay slowly.
+
+    run this file for the convected and diffused Gaussian pulse and the
+    run_CD_test step marched to steady state:
+        python transient.py [cells]
+"""
+
+import collections
+import time
+import numpy as np
+
+import Boundary
+import kernels
+import operators
+import instrumentation
+from instrumentation import logger
+
+schemes = ("implicitEuler", "BDF2", "CrankNicolson")
+
+# order of accuracy, and the Milne factor |C / (C - C_P)| turning the
+# difference to the extrapolated predictor into the local error. The
+# predictor through order + 1 levels has C_P = 1 on the h^(p+1) term,
+# against C = 1/2, 2/9 and 1/12 for the schemes
+orders = {"implicitEuler": 1, "BDF2": 2, "CrankNicolson": 2}
+errorConstants = {"implicitEuler": 1/3, "BDF2": 2/11, "CrankNicolson": 1/13}
+
+def extrapolationWeights(times,t):
+
+    """
+        Lagrange weights of values at times for their polynomial at t
+
+        inputs:
+            times     (list)      -distinct times of the values
+            t         (float)     -time to extrapolate to
+        returns:
+            weights   (list)      -one weight per time
+    """
+
+    weights = []
+    for k, tk in enumerate(times):
+        weight = 1.0
+        for m, tm in enumerate(times):
+            if m != k:
+                weight *= (t - tm) / (tk - tm)
+        weights.append(weight)
+    return weights
+
+def explicitLimit(grid,solution,kinVisc):
+
+    """
+        the forward Euler stability limit of convection and diffusion,
+            dt < 1 / max(|u|/dx + |v|/dy + 2 kinVisc (1/dx^2 + 1/dy^2))
+    """
+
+    d_X, d_Y = grid.cellWidths()
+    u = np.abs(grid.interior(solution[:,:,0]))
+    v = np.abs(grid.interior(solution[:,:,1]))
+    rate = u / d_X + v / d_Y + 2 * kinVisc * (1 / d_X**2 + 1 / d_Y**2)
+    return 1 / float(np.max(rate))
+
+def courant(grid,solution,dt):
+
+    """
+        the largest Courant number dt (|u|/dx + |v|/dy) of the cells
+    """
+
+    d_X, d_Y = grid.cellWidths()
+    u = np.abs(grid.interior(solution[:,:,0]))
+    v = np.abs(grid.interior(solution[:,:,1]))
+    return dt * float(np.max(u / d_X + v / d_Y))
+
+class stepper:
+
+    def __init__(self,grid,solution,bcs,kinVisc,scheme="BDF2",field=2,
+                 convection="secondOrderUpwind",method="lu",tol=1e-10,
+                 maxSystems=8,backend="numpy",**options):
+
+        """
+        implicit time stepping of one field of the solution in place
+
+        inputs:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,field]
+            bcs       (boundaries)-Boundary.boundaries of the field
+            kinVisc   (float)     -kinematic viscosity
+            scheme    (string)    -one of schemes
+            field     (int)       -field of the solution stepped
+            convection(string)    -convection scheme of kernels.assemble
+            method    (string)    -"lu", "bicgstab", "gmres" or "multigrid"
+            tol       (float)     -relative tolerance of every step's solve
+            maxSystems(int)       -mass term systems kept for reuse
+            backend   (string)    -kernel backend of the assembly
+            options               -multigrid.multigrid options for "multigrid"
+        """
+
+        if scheme not in schemes:
+            print("ERROR: time scheme not known: {}".format(scheme))
+            scheme = "BDF2"
+
+        self.grid = grid
+        self.solution = solution
+        self.bcs = bcs
+        self.kinVisc = kinVisc
+        self.scheme = scheme
+        self.field = field
+        self.convection = convection
+        self.method = method
+        self.tol = tol
+        self.maxSystems = maxSystems
+        self.backend = backend
+        self.options = options
+
+        d_X, d_Y = grid.cellWidths()
+        self.volume = d_X * d_Y
+        self.timer = instrumentation.timers()
+        self.reassemble()
+
+        self.t = 0.0
+        # accepted levels, newest last, as (t, interior copy, the dt that
+        # reached them), so that repeated steps give identical coefficients
+        self.history = collections.deque(maxlen=3)
+        self.history.append((self.t,np.copy(grid.interior(solution[:,:,field])),None))
+        self.stats = {"steps": 0, "rejected": 0, "systemsBuilt": 0,
+                      "systemsReused": 0, "linearIterations": 0}
+
+    def reassemble(self):
+
+        """
+        assembles the steady operator at the current velocity, dropping
+        the systems of the previous one. Call after changing the velocity
+        """
+
+        with self.timer.phase("assembly",cells=self.grid.ncells):
+            self.Apx, self.Apy = kernels.assemble\
+                (
+                    self.grid,self.solution,self.kinVisc,convection=self.convection,
+                    diffusion=True,backend=self.backend
+                )
+        self.systems = collections.OrderedDict()
+
+    def system(self,coefficient):
+
+        """
+        returns the operator of the steady operator plus coefficient times
+        the volume on A_P, building it on first use
+        """
+
+        if coefficient in self.systems:
+            self.stats["systemsReused"] += 1
+            self.systems.move_to_end(coefficient)
+            return self.systems[coefficient]
+
+        self.stats["systemsBuilt"] += 1
+        massApx, massApy = operators.mass(self.grid,coefficient)
+        kinVisc, convection = self.kinVisc, self.convection
+
+        def assembler(coarseGrid,coarseSolution):
+            Apx, Apy = kernels.assemble\
+                (
+                    coarseGrid,coarseSolution,kinVisc,convection=convection,
+                    diffusion=True,backend="numpy"
+                )
+            Apx += operators.mass(coarseGrid,coefficient)[0]
+            return Apx, Apy
+
+        self.systems[coefficient] = operators.operator\
+            (
+                self.grid,(("mass",coefficient),),
+                coefficients=(self.Apx + massApx,self.Apy + massApy),
+                assembler=assembler
+            )
+        while len(self.systems) > self.maxSystems:
+            self.systems.popitem(last=False)
+        return self.systems[coefficient]
+
+    def stepScheme(self):
+        # BDF2 needs a previous level, its first step is implicit Euler
+        if self.scheme == "BDF2" and len(self.history) < 2:
+            return "implicitEuler"
+        return self.scheme
+
+    def step(self,dt):
+
+        """
+        takes one step of dt from the newest accepted level, leaving the
+        result in the solution until accept() or reject()
+
+        returns:
+            info      (dict)      -dt, scheme, linear solve info and the
+                                   estimated local error (None until enough
+                                   levels are known)
+        """
+
+        grid = self.grid
+        phi = self.solution[:,:,self.field]
+        scheme = self.stepScheme()
+        t, current, previousDt = self.history[-1]
+
+        if scheme == "implicitEuler":
+            coefficient = 1 / dt
+            source = self.volume / dt * current
+        elif scheme == "BDF2":
+            previous = self.history[-2]
+            w = dt / previousDt
+            coefficient = (1 + 2*w) / ((1 + w) * dt)
+            source = self.volume / dt * ((1 + w) * current - w**2 / (1 + w) * previous[1])
+        else:
+            import smoothers
+            coefficient = 2 / dt
+            source = 2 * self.volume / dt * current + \
+                smoothers.residual(grid,self.Apx,self.Apy,phi)
+
+        with self.timer.phase("system",cells=grid.ncells):
+            system = self.system(coefficient)
+        with self.timer.phase("solve",cells=grid.ncells):
+            info = system.solve\
+                (
+                    self.solution,field=self.field,method=self.method,
+                    source=source,boundary=self.bcs,tol=self.tol,**self.options
+                )
+        self.stats["linearIterations"] += info["iterations"]
+
+        # the Milne device needs order + 1 levels to extrapolate from
+        error = None
+        order = orders[scheme]
+        if len(self.history) > order:
+            levels = list(self.history)[-(order+1):]
+            weights = extrapolationWeights([level[0] for level in levels],t + dt)
+            predictor = sum(weight * level[1] for weight, level in zip(weights,levels))
+            local = errorConstants[scheme] * np.abs(grid.interior(phi) - predictor).max()
+            error = float(local / max(1.0,np.abs(current).max()))
+
+        self.pending = (t + dt,dt)
+        return {"dt": dt, "scheme": scheme, "error": error, "solve": info}
+
+    def accept(self):
+        t, dt = self.pending
+        self.t = t
+        self.history.append((t,np.copy(self.grid.interior(self.solution[:,:,self.field])),dt))
+        self.stats["steps"] += 1
+        self.timer.count("steps")
+
+    def reject(self):
+        # back to the newest accepted level
+        self.grid.interior(self.solution[:,:,self.field])[:] = self.history[-1][1]
+        self.bcs.apply(self.solution,fields=[self.field])
+        self.stats["rejected"] += 1
+        self.timer.count("rejected")
+
+    def run(self,tEnd,dt=None,adaptive=True,errorTol=1e-3,maxCourant=None,
+            safety=0.9,maxGrowth=2.0,levels=1,dtMin=None,maxSteps=100000,
+            callback=None):
+
+        """
+        steps to tEnd, adapting dt to keep the estimated local error,
+        relative to the largest |phi|, below errorTol
+
+        inputs:
+            tEnd      (float)     -time to stop at, reached exactly
+            dt        (float)     -first time step, explicitLimit when None
+            adaptive  (bool)      -adapt dt, or keep it fixed
+            errorTol  (float)     -local error accepted per step
+            maxCourant(float)     -optional cap on the Courant number
+            safety    (float)     -factor on the error optimal step
+            maxGrowth (float)     -largest factor dt may grow by per step
+            levels    (int)       -time steps per doubling of dt that a
+                                   step can take, fewer meaning fewer
+                                   systems to factorize
+            dtMin     (float)     -steps this small are accepted whatever
+                                   their error, dt0/1000 when None
+            maxSteps  (int)       -maximum number of accepted steps
+            callback  (callable)  -optional callback(stepper,info) after
+                                   every accepted step
+        returns:
+            info      (dict)      -steps, rejections, systems built and
+                                   reused, linear iterations, the time step
+                                   range, wall time and phase timings
+        """
+
+        start = time.perf_counter()
+        if dt is None:
+            dt = explicitLimit(self.grid,self.solution,self.kinVisc)
+        reference = dt
+        if dtMin is None:
+            dtMin = reference / 1000
+        if maxCourant is not None:
+            dtCourant = maxCourant * dt / max(courant(self.grid,self.solution,dt),1e-300)
+
+        def rounded(dt):
+            # down to the nearest dt0 * 2^(k/levels), so that time steps repeat
+            return reference * 2**(np.floor(levels * np.log2(dt / reference) + 1e-9) / levels)
+
+        steps = []
+        while self.t < tEnd * (1 - 1e-12) and self.stats["steps"] < maxSteps:
+            if maxCourant is not None:
+                dt = min(dt,dtCourant)
+            # a last step within round-off of dt is taken as dt
+            size = dt if tEnd - self.t > dt * (1 - 1e-9) else tEnd - self.t
+            info = self.step(size)
+
+            if adaptive and info["error"] is not None:
+                ratio = max(info["error"] / errorTol,1e-10)
+                factor = min(maxGrowth,max(0.2,safety * ratio**(-1 / (orders[info["scheme"]] + 1))))
+                if ratio > 1 and size > dtMin:
+                    self.reject()
+                    dt = max(rounded(size * factor),dtMin)
+                    continue
+                # accepted steps only ever grow dt, shrinking is left to
+                # rejections, so that dt does not alternate between two
+                # levels. A shortened last step says nothing about dt
+                if size == dt and factor > 1:
+                    dt = rounded(dt * factor)
+
+            self.accept()
+            steps.append(size)
+            logger.debug\
+                (
+                    "t {0:.5g}  dt {1:.3e}  {2}  error {3}".format
+                        (
+                            self.t,size,info["scheme"],
+                            "-" if info["error"] is None else "{:.2e}".format(info["error"])
+                        )
+                )
+            if callback is not None:
+                callback(self,info)
+
+        result = dict(self.stats)
+        result.update\
+            (
+                {
+                    "t": self.t, "seconds": time.perf_counter() - start,
+                    "minDt": min(steps) if steps else None,
+                    "maxDt": max(steps) if steps else None,
+                    "phases": dict(self.timer.totals),
+                }
+            )
+        return result
+
+def pulse(n=128,kinVisc=0.02,velocity=(0.5,0.25),width=0.05,center=(0.4,0.4)):
+
+    """
+        a Gaussian pulse of phi convected by a uniform velocity and diffused,
+        with phi = 0 on every side, far enough away to compare with
+            phi = s0/s exp(-|x - x0 - u t|^2 / (2 s)), s = width^2 + 2 kinVisc t
+
+        returns:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -solution at t = 0
+            bcs       (boundaries)-Boundary.boundaries of phi
+            exact     (callable)  -exact(t) giving the (nx,ny) exact phi
+    """
+
+    import Grid
+    import fields
+
+    grid = Grid.grid(n,n)
+    solution = fields.fields(grid).solution
+    solution[:,:,0] = velocity[0]
+    solution[:,:,1] = velocity[1]
+
+    x = grid.interior(grid.val[:,:,0])
+    y = grid.interior(grid.val[:,:,1])
+
+    def exact(t):
+        spread = width**2 + 2 * kinVisc * t
+        distance = (x - center[0] - velocity[0] * t)**2 + (y - center[1] - velocity[1] * t)**2
+        return width**2 / spread * np.exp(-distance / (2 * spread))
+
+    grid.interior(solution[:,:,2])[:] = exact(0.0)
+    bcs = Boundary.boundaries(grid)
+    for side in Boundary.sides:
+        bcs.set(side, Boundary.inflow(0.0), field=2)
+    bcs.apply(solution)
+    return grid, solution, bcs, exact
+
+def explicitEuler(grid,solution,bcs,kinVisc,tEnd,dt,convection="firstOrderUpwind"):
+
+    """
+        forward Euler steps of the same operator, for comparison. With
+        first-order upwind convection explicitLimit is its stability limit,
+        higher-order schemes need smaller steps
+
+        returns:
+            info      (dict)      -steps and wall time
+    """
+
+    import smoothers
+
+    start = time.perf_counter()
+    Apx, Apy = kernels.assemble\
+        (
+            grid,solution,kinVisc,convection=convection,diffusion=True,
+            backend="numpy"
+        )
+    d_X, d_Y = grid.cellWidths()
+    volume = d_X * d_Y
+    phi = solution[:,:,2]
+    steps = int(np.ceil(tEnd / dt * (1 - 1e-12)))
+    dt = tEnd / steps
+    for step in range(steps):
+        grid.interior(phi)[:] += dt / volume * smoothers.residual(grid,Apx,Apy,phi)
+        bcs.apply(solution,fields=[2])
+    return {"steps": steps, "seconds": time.perf_counter() - start}
+
+# case: (kinVisc, tEnd) of compare
+cases = {"pulse": (0.02,0.3), "steady": (1/40,20.0)}
+
+def compare(n=128,case="steady",errorTol=1e-4,method="lu",convection="firstOrderUpwind"):
+
+    """
+        steps one case with forward Euler at 0.9 times its stability limit
+        and with every implicit scheme at adaptive time steps:
+
+            pulse     -the Gaussian pulse to t = 0.3, compared with the
+                       exact solution. Resolving the pulse in time keeps the
+                       Courant number near one, where a forward Euler step
+                       costs much less than a solve
+            steady    -the run_CD_test step from phi = 0 to t = 20, compared
+                       with the steady solution of the same operator. The
+                       time step of the implicit schemes grows as the
+                       transient dies out, far past the explicit limit
+
+        returns:
+            results   (dict)      -per method the steps, the largest error
+                                   and the wall time, and for the implicit
+                                   schemes the rejections, systems built and
+                                   largest Courant number
+    """
+
+    import linearSolver
+    import run_CD_test
+
+    if case not in cases:
+        print("ERROR: transient case not known: {}".format(case))
+        return
+    kinVisc, tEnd = cases[case]
+
+    def setup():
+        if case == "pulse":
+            grid, solution, bcs, exact = pulse(n,kinVisc)
+            return grid, solution, bcs, exact(tEnd)
+        grid, solution, bcs = run_CD_test.testCase(n,n)
+        steady = np.copy(solution)
+        Apx, Apy = kernels.assemble\
+            (
+                grid,steady,kinVisc,convection=convection,diffusion=True,
+                backend="numpy"
+            )
+        linearSolver.solve(grid,Apx,Apy,steady,field=2,method="lu",boundary=bcs)
+        return grid, solution, bcs, grid.interior(steady[:,:,2])
+
+    results = {}
+    grid, solution, bcs, reference = setup()
+    limit = 0.9 * explicitLimit(grid,solution,kinVisc)
+    info = explicitEuler(grid,solution,bcs,kinVisc,tEnd,limit,convection=convection)
+    info["error"] = float(np.abs(grid.interior(solution[:,:,2]) - reference).max())
+    info["maxCourant"] = courant(grid,solution,limit)
+    results["explicitEuler"] = info
+
+    for scheme in schemes:
+        grid, solution, bcs, reference = setup()
+        march = stepper\
+            (
+                grid,solution,bcs,kinVisc,scheme=scheme,convection=convection,
+                method=method
+            )
+        info = march.run(tEnd,errorTol=errorTol)
+        info["error"] = float(np.abs(grid.interior(solution[:,:,2]) - reference).max())
+        info["maxCourant"] = courant(grid,solution,info["maxDt"])
+        results[scheme] = info
+    return results
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    for case in cases:
+        print(case)
+        for name, info in compare(n,case).items():
+            print\
+                (
+                    "    {0:<14}{1:>6} steps  error {2:.2e}  {3:7.3f}s  Courant up to {4:8.2f}{5}".format
+                        (
+                            name,info["steps"],info["error"],info["seconds"],info["maxCourant"],
+                            "" if name == "explicitEuler" else
+                            "  {0} rejected, {1} systems built".format(info["rejected"],info["systemsBuilt"])
+                        )
+                )
@@ -0,0 +1,496 @@
+"""
+    verification of the fvSchemes discretizations by the method of
+    manufactured solutions
+
+    a smooth phi is chosen and the source it needs to satisfy the steady
+    convection-diffusion equation
+        u . grad(phi) - kinVisc laplacian(phi) = f
+    is added to every cell as f V at the cell center. The ghost cells hold
+    the exact phi at the centers the schemes place them at (one and two
+    widths beyond the last cell, see Boundary.neumann), so the boundaries
+    add no error of their own and the difference of the discrete solution
+    to phi at the cell centers is the discretization error.
+
+    study() solves a ladder of grids for every combination of schemes and
+    solver, one case per task of a process pool, and from its results
+        observedOrder   -the order of the error between successive grids
+                         and fitted over the ladder, against the design
+                         order of the schemes in fvSchemes.registry
+        timeToAccuracy  -per combination the wall time to reach an error,
+                         interpolated along the ladder, cheapest first
+
+    the times are those of assembly and solve in the worker, so run fewer
+    workers than cores when they matter:
+
+        python verification.py --ladder 16 32 64 128 --workers 2 --output mms
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+import Boundary
+import Grid
+import decomposition
+import fields
+import fvSchemes
+import linearSolver
+import multigrid
+import smoothers
+import run_CD_test
+
+ladder = (16, 32, 64, 128)
+
+# (convection, diffusion) pairs of the default study
+combinations = (
+    ("firstOrderUpwind", "centralDifference"),
+    ("secondOrderUpwind", "centralDifference"),
+    ("linear", "centralDifference"),
+    (None, "centralDifference"),
+)
+
+solvers = ("lu", "multigrid", "line")
+
+norms = ("L1", "L2", "Linf")
+
+class manufactured:
+
+    def __init__(self,velocity=(1.0,0.5),kinVisc=0.05,waves=(2.0,1.5),
+                 phases=(0.3,0.2)):
+
+        """
+        phi = sin(a x + b) cos(c y + d) convected by a uniform velocity
+
+        inputs:
+            velocity  (tuple)     -uniform (u, v)
+            kinVisc   (float)     -kinematic viscosity
+            waves     (tuple)     -(a, c) in multiples of pi
+            phases    (tuple)     -(b, d)
+        """
+
+        self.velocity = velocity
+        self.kinVisc = kinVisc
+        self.a = np.pi * waves[0]
+        self.c = np.pi * waves[1]
+        self.b, self.d = phases
+
+    def value(self,x,y):
+        return np.sin(self.a * x + self.b) * np.cos(self.c * y + self.d)
+
+    def source(self,x,y,convection=True,diffusion=True):
+
+        """
+        f at the points x, y, with the terms the discretization leaves out
+        dropped
+        """
+
+        f = np.zeros(np.broadcast(x,y).shape)
+        if convection:
+            f += self.velocity[0] * self.a * np.cos(self.a * x + self.b) * np.cos(self.c * y + self.d)
+            f -= self.velocity[1] * self.c * np.sin(self.a * x + self.b) * np.sin(self.c * y + self.d)
+        if diffusion:
+            f += self.kinVisc * (self.a**2 + self.c**2) * self.value(x,y)
+        return f
+
+def centers(faces):
+
+    """
+        cell centers along one axis with those of the two ghost cells on
+        each side, which the schemes place one and two widths beyond the
+        last cell
+
+        inputs:
+            faces     (ndarray)   -(n+1,) face coordinates
+        returns:
+            centers   (ndarray)   -(n+4,) padded cell centers
+    """
+
+    widths = np.diff(faces)
+    middle = (faces[1:] + faces[:-1]) / 2
+    return np.concatenate\
+        (
+            (
+                middle[0] - widths[0] * np.array([2.0,1.0]),
+                middle,
+                middle[-1] + widths[-1] * np.array([1.0,2.0])
+            )
+        )
+
+def setup(n,problem,convection,diffusion,clustering="uniform",strength=None):
+
+    """
+        builds one case of the study on an n x n grid
+
+        returns:
+            grid      (Grid)      -grid object from Grid.py
+            solution  (ndarray)   -numpy array with solution data [x,y,field],
+                                   phi zero inside and exact in the ghosts
+            bcs       (boundaries)-prescribed ghost values on every side
+            source    (ndarray)   -(nx,ny) manufactured source f V
+            exact     (ndarray)   -(nx,ny) phi at the cell centers
+            volume    (ndarray)   -(nx,ny) cell volumes
+    """
+
+    x = Grid.distribution(n,clustering=clustering,side="both",strength=strength)
+    y = Grid.distribution(n,clustering=clustering,side="both",strength=strength)
+    if x is None or y is None:
+        return
+    grid = Grid.grid(n,n,x=x,y=y)
+
+    solution = fields.fields(grid).solution
+    solution[:,:,0] = problem.velocity[0]
+    solution[:,:,1] = problem.velocity[1]
+
+    X, Y = np.meshgrid(centers(x),centers(y),indexing="ij")
+    bcs = Boundary.boundaries(grid)
+    values = problem.value(X,Y)
+    for side in Boundary.sides:
+        bcs.set(side,Boundary.prescribed(values),field=2)
+    bcs.apply(solution)
+
+    volume = np.outer(np.diff(x),np.diff(y))
+    X, Y = grid.interior(X), grid.interior(Y)
+    source = volume * problem.source\
+        (
+            X,Y,convection=convection is not None,diffusion=diffusion is not None
+        )
+    exact = problem.value(X,Y)
+
+    return grid, solution, bcs, source, exact, volume
+
+def solveCase(grid,solution,bcs,Apx,Apy,source,solver,assembler,tol=1e-10,
+              maxSweeps=5000):
+
+    """
+        solves the assembled case to a relative residual of tol
+
+        inputs:
+            solver    (string)    -one of linearSolver.methods, "multigrid"
+                                   or one of smoothers.smoothers, swept until
+                                   converged
+            assembler (callable)  -assembler(grid,solution) of the coarse
+                                   multigrid levels
+        returns:
+            info      (dict)      -iterations and convergence
+    """
+
+    phi = solution[:,:,2]
+    boundary = bcs.updater(solution,field=2)
+
+    if solver in linearSolver.methods:
+        info = linearSolver.solve\
+            (
+                grid,Apx,Apy,solution,field=2,method=solver,source=source,
+                boundary=bcs,tol=tol
+            )
+        if info is None:
+            return {"iterations": 0, "converged": False}
+        return {"iterations": info["iterations"], "converged": info["converged"]}
+
+    if solver == "multigrid":
+        mg = multigrid.multigrid\
+            (
+                grid,Apx,Apy,assembler=assembler,solution=solution,
+                smoother="line"
+            )
+        info = mg.solve(phi,source=source,boundary=boundary,tol=tol,atol=0.0)
+        converged = info["residuals"][-1] <= tol * info["residuals"][0]
+        return {"iterations": info["cycles"], "converged": bool(converged)}
+
+    if solver not in smoothers.smoothers:
+        print("ERROR: solver not known: {}".format(solver))
+        return
+
+    first = np.linalg.norm(smoothers.residual(grid,Apx,Apy,phi,source))
+    norm = first
+    sweeps = 0
+    while sweeps < maxSweeps and norm > tol * first:
+        smoothers.smoothers[solver](grid,Apx,Apy,phi,source=source,boundary=boundary)
+        sweeps += 1
+        norm = np.linalg.norm(smoothers.residual(grid,Apx,Apy,phi,source))
+        # stop a diverging smoother rather than sweeping to overflow
+        if not np.isfinite(norm) or norm > 1e6 * first:
+            break
+    return {"iterations": sweeps, "converged": bool(norm <= tol * first)}
+
+def runCase(task):
+
+    """
+        solves one case of the study and measures its error
+
+        inputs:
+            task      (dict)      -n, convection, diffusion, solver,
+                                   clustering, strength, problem and tol
+        returns:
+            result    (dict)      -the task entries but the problem, with
+                                   the L1, L2 and Linf norms of the error,
+                                   the iterations, convergence and seconds
+                                   of assembly and solve
+    """
+
+    problem = task["problem"]
+    case = setup\
+        (
+            task["n"],problem,task["convection"],task["diffusion"],
+            task["clustering"],task["strength"]
+        )
+    if case is None:
+        return
+    grid, solution, bcs, source, exact, volume = case
+
+    assembler = lambda grid, solution: run_CD_test.assemble\
+        (
+            grid,solution,problem.kinVisc,convection=task["convection"],
+            diffusion=task["diffusion"]
+        )
+
+    start = time.perf_counter()
+    Apx, Apy = assembler(grid,solution)
+    info = solveCase\
+        (
+            grid,solution,bcs,Apx,Apy,source,task["solver"],assembler,
+            tol=task["tol"]
+        )
+    seconds = time.perf_counter() - start
+    if info is None:
+        return
+
+    error = np.abs(grid.interior(solution[:,:,2]) - exact)
+    result = {key: value for key, value in task.items() if key != "problem"}
+    result.update(info)
+    result["seconds"] = seconds
+    result["L1"] = float((error * volume).sum() / volume.sum())
+    result["L2"] = float(np.sqrt((error**2 * volume).sum() / volume.sum()))
+    result["Linf"] = float(error.max())
+    return result
+
+def study(ladder=ladder,combinations=combinations,solvers=solvers,problem=None,
+          clustering="uniform",strength=None,tol=1e-10,workers=None):
+
+    """
+        solves every combination of schemes and solver on every grid of the
+        ladder, spreading the cases over a process pool
+
+        inputs:
+            ladder    (tuple)     -cells in each direction of the grids
+            combinations(tuple)   -(convection, diffusion) names in
+                                   fvSchemes.registry, None for no term
+            solvers   (tuple)     -solvers as in solveCase
+            problem   (manufactured)-the manufactured solution, the default
+                                   one when None
+            clustering(string)    -one of Grid.clusterings, refined towards
+                                   both ends of each axis
+            strength  (float)     -clustering strength, see Grid.distribution
+            tol       (float)     -relative residual of every solve
+            workers   (int)       -processes, one per core when None
+        returns:
+            results   (list)      -runCase results, largest grids first
+    """
+
+    if problem is None:
+        problem = manufactured()
+    for solver in solvers:
+        if solver not in linearSolver.methods + ("multigrid",) + tuple(smoothers.smoothers):
+            print("ERROR: solver not known: {}".format(solver))
+            return
+    for convection, diffusion in combinations:
+        if fvSchemes.lookup("convection",convection) is None and convection is not None:
+            return
+        if fvSchemes.lookup("diffusion",diffusion) is None and diffusion is not None:
+            return
+
+    # the largest grids are started first so they do not finish last
+    tasks = \
+        [
+            {
+                "n": n, "convection": convection, "diffusion": diffusion,
+                "solver": solver, "clustering": clustering, "strength": strength,
+                "problem": problem, "tol": tol,
+            }
+            for n in sorted(ladder,reverse=True)
+            for convection, diffusion in combinations
+            for solver in solvers
+        ]
+
+    # not forked, see decomposition.startContext
+    with decomposition.startContext().Pool(workers) as pool:
+        results = pool.map(runCase,tasks,chunksize=1)
+    return [result for result in results if result is not None]
+
+def combination(result):
+    # the key results are grouped by along the ladder
+    return (result["convection"],result["diffusion"],result["solver"])
+
+def label(key):
+    convection, diffusion, solver = key
+    return "{0} + {1}, {2}".format(convection or "-",diffusion or "-",solver)
+
+def designOrder(convection,diffusion):
+    # the lowest design order of the terms present
+    orders = [fvSchemes.lookup(kind,name).order for kind, name in
+              (("convection",convection),("diffusion",diffusion)) if name is not None]
+    return min(orders) if orders else None
+
+def ladders(results):
+
+    """
+        returns the converged results per combination, ordered from the
+        coarsest grid
+    """
+
+    grouped = {}
+    for result in results:
+        if result["converged"]:
+            grouped.setdefault(combination(result),[]).append(result)
+    for key in grouped:
+        grouped[key].sort(key=lambda result: result["n"])
+    return grouped
+
+def observedOrder(results,norm="L2"):
+
+    """
+        orders of accuracy observed along the ladder of every combination,
+            p = log(e_coarse / e_fine) / log(h_coarse / h_fine)
+
+        inputs:
+            results   (list)      -results of study
+            norm      (string)    -one of norms
+        returns:
+            orders    (dict)      -per (convection, diffusion, solver) the
+                                   grid sizes, errors, orders between
+                                   successive grids, the order fitted over
+                                   the ladder and the design order
+    """
+
+    orders = {}
+    for key, ladder in ladders(results).items():
+        h = np.array([1.0 / result["n"] for result in ladder])
+        errors = np.array([result[norm] for result in ladder])
+        pairwise = np.log(errors[:-1] / errors[1:]) / np.log(h[:-1] / h[1:])
+        fitted = np.polyfit(np.log(h),np.log(errors),1)[0] if len(h) > 1 else np.nan
+        orders[key] = {
+            "n": [result["n"] for result in ladder],
+            "errors": errors.tolist(),
+            "orders": pairwise.tolist(),
+            "fitted": float(fitted),
+            "design": designOrder(key[0],key[1]),
+        }
+    return orders
+
+def timeToAccuracy(results,target,norm="L2"):
+
+    """
+        the wall time every combination needs to bring the error down to
+        target, interpolated in log-log between the two grids of the
+        ladder around it. A combination whose coarsest grid is already
+        accurate enough gets that grid's time, one that never reaches
+        target is left out
+
+        inputs:
+            results   (list)      -results of study
+            target    (float)     -error to reach
+            norm      (string)    -one of norms
+        returns:
+            times     (list)      -(seconds, key) pairs, cheapest first
+    """
+
+    times = []
+    for key, ladder in ladders(results).items():
+        for k, result in enumerate(ladder):
+            if result[norm] > target:
+                continue
+            if k == 0:
+                seconds = result["seconds"]
+            else:
+                coarse = ladder[k-1]
+                fraction = np.log(target / coarse[norm]) / np.log(result[norm] / coarse[norm])
+                seconds = float(np.exp\
+                    (
+                        np.log(coarse["seconds"]) + \
+                        fraction * np.log(result["seconds"] / coarse["seconds"])
+                    ))
+            times.append((seconds,key))
+            break
+    return sorted(times)
+
+def plotTimeToAccuracy(results,filename,norm="L2"):
+
+    """
+        plots the error against the wall time of every combination, one
+        line along its ladder
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(8,6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1,1,1)
+    # one color per pair of schemes, one line style per solver
+    grouped = sorted(ladders(results).items(),key=lambda item: label(item[0]))
+    pairs = sorted(set(key[:2] for key, ladder in grouped),key=str)
+    styles = sorted(set(key[2] for key, ladder in grouped))
+    for key, ladder in grouped:
+        axes.loglog\
+            (
+                [result["seconds"] for result in ladder],
+                [result[norm] for result in ladder],
+                marker="o",linestyle=("-","--",":","-.")[styles.index(key[2]) % 4],
+                color="C{}".format(pairs.index(key[:2]) % 10),label=label(key)
+            )
+    axes.set_xlabel("seconds")
+    axes.set_ylabel("{} error".format(norm))
+    axes.legend(fontsize="small")
+    axes.grid(True,which="both",alpha=0.3)
+    figure.savefig(filename)
+
+def report(results,targets=(1e-2,1e-3,1e-4),norm="L2"):
+
+    """
+        returns the observed orders and the time to accuracy at each target
+        as a text table
+    """
+
+    lines = ["{0:<52}{1:>8}{2:>8}  orders".format("combination","design","fitted")]
+    for key, entry in sorted(observedOrder(results,norm).items(),key=lambda item: label(item[0])):
+        lines.append\
+            (
+                "{0:<52}{1:>8}{2:>8.2f}  {3}".format
+                    (
+                        label(key),entry["design"],entry["fitted"],
+                        " ".join("{:.2f}".format(p) for p in entry["orders"])
+                    )
+            )
+    failed = [result for result in results if not result["converged"]]
+    for result in failed:
+        lines.append("not converged: {0} at {1}x{1}".format(label(combination(result)),result["n"]))
+    for target in targets:
+        lines.append("time to {0} error {1:g}:".format(norm,target))
+        for seconds, key in timeToAccuracy(results,target,norm):
+            lines.append("    {0:10.4f}s  {1}".format(seconds,label(key)))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ladder",type=int,nargs="+",default=list(ladder))
+    parser.add_argument("--solvers",nargs="+",default=list(solvers))
+    parser.add_argument("--clustering",default="uniform",choices=Grid.clusterings)
+    parser.add_argument("--workers",type=int,default=None)
+    parser.add_argument("--norm",default="L2",choices=norms)
+    parser.add_argument("--output",default=None,help="directory for results.json and the plot")
+    args = parser.parse_args()
+
+    results = study\
+        (
+            ladder=args.ladder,solvers=args.solvers,clustering=args.clustering,
+            workers=args.workers
+        )
+    if results is not None:
+        print(report(results,norm=args.norm))
+    if results is not None and args.output is not None:
+        os.makedirs(args.output,exist_ok=True)
+        with open(os.path.join(args.output,"results.json"),"w") as f:
+            json.dump(results,f,indent=2)
+        plotTimeToAccuracy(results,os.path.join(args.output,"timeToAccuracy.png"),args.norm)